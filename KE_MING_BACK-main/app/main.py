@@ -1,10 +1,17 @@
 import os
-import shutil
 
 from app.routers import chat, history, upload
+from app.utils.data_version import current_data_version
+from app.utils.responses import CompressionMiddleware, FastJSONResponse
+from app.utils.static_files import ImageStaticFiles
+from app.utils.vector_store import (
+    cleanup_discarded_generations,
+    generation_embedding,
+    generation_path,
+    reset_vector_store,
+)
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 # 創建並設置必要的目錄
 def setup_directories():
@@ -14,8 +21,8 @@ def setup_directories():
     os.chmod(static_dir, 0o777)
     
     # 設置向量存儲目錄 - 使用應用根目錄下的持久化目錄
-    render_data_dir = os.path.join(os.getcwd(), ".render", "data")
-    vector_store_dir = os.path.join(render_data_dir, "chroma_new")
+    vector_store_dir = generation_path()
+    render_data_dir = os.path.dirname(vector_store_dir)
     
     # 確保目錄層次結構存在
     os.makedirs(render_data_dir, exist_ok=True)
@@ -35,8 +42,13 @@ def setup_directories():
 
 # 初始化目錄
 setup_directories()
+# 清除上次重置時尚未在背景刪完的舊索引目錄
+cleanup_discarded_generations()
+# 記錄使用中索引的嵌入模型（舊索引首次啟動時以目前設定補上），之後更換模型須經由遷移
+print(f"向量索引使用的嵌入模型: {generation_embedding()}")
 
-app = FastAPI(title="RAG API")
+# 所有 JSON 回應以 orjson 序列化
+app = FastAPI(title="RAG API", default_response_class=FastJSONResponse)
 
 # 配置CORS
 app.add_middleware(
@@ -46,40 +58,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 依 Accept-Encoding 壓縮較大的回應（brotli / gzip），SSE 串流不壓縮
+app.add_middleware(CompressionMiddleware)
 
 # 註冊路由
 app.include_router(chat.router)
 app.include_router(upload.router)
 app.include_router(history.router)
 
-# 檢查是否需要重置數據庫
+# 收尾上次中斷的文件處理與刪除，讓文件登記表與向量庫一致
+upload.recover_file_registry()
+
+# 舊版 hard-reset 留下的重置信號：切換到新的空索引世代（重建已改為線上進行，不再寫入此信號）
 if os.path.exists("RESET_DB"):
     print("檢測到知識庫重置信號，正在重置...")
-    
-    # 清空知識庫目錄
-    render_data_dir = os.path.join(os.getcwd(), ".render", "data")
-    for db_dir in ["chroma_new", "chroma_db", "vector_db"]:
-        db_path = os.path.join(render_data_dir, db_dir)
-        if os.path.exists(db_path):
-            try:
-                shutil.rmtree(db_path, ignore_errors=True)
-                print(f"已刪除向量庫目錄: {db_path}")
-                os.makedirs(db_path, exist_ok=True)
-                os.chmod(db_path, 0o777)
-            except Exception as e:
-                print(f"無法重置目錄 {db_path}: {str(e)}")
-    
-    # 刪除信號文件
+    reset_vector_store()
     os.remove("RESET_DB")
     print("知識庫重置完成")
 
-app.mount("/images", StaticFiles(directory="static/images"), name="images")
+# 圖片以內容雜湊命名，可使用強 ETag 與長期快取
+app.mount("/images", ImageStaticFiles(directory="static/images"), name="images")
 
 @app.get("/")
 async def root():
     return {"message": "歡迎使用RAG API"}
 
 
+@app.get("/api/data-version")
+async def data_version():
+    """資料版本號：文件、向量庫或對話記錄變動時遞增，可作為前端或快取的鍵"""
+    version, updated_at = current_data_version()
+    return {"version": version, "updated_at": updated_at}
+
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy"}
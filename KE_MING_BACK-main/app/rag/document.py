@@ -1,9 +1,35 @@
 import os
+import re
 import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
 
-from app.utils.openai_client import get_embeddings_model
-from app.utils.vector_store import get_vector_store
+from app.rag.filters import product_prefix
+from app.utils.vector_store import (
+    current_generation,
+    generation_path,
+    get_vector_store,
+    validate_namespace,
+    writable_store,
+)
 from app.utils.gpt_processor import process_pdf_with_gpt
+from app.utils.image_store import (
+    commit_source_images,
+    copy_source_images,
+    discard_staged_images,
+    release_source_images,
+    set_chunk_pages,
+)
+from app.utils.product_store import (
+    copy_products,
+    release_source_products,
+    remove_stale_products,
+    upsert_products,
+)
+from app.utils.tesseract_ocr import process_pdf_with_tesseract
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     Docx2txtLoader,
@@ -13,150 +39,557 @@ from langchain_community.document_loaders import (
 )
 from langchain.schema import Document
 
+# JSON 串流解析每次讀取的字元數
+JSON_READ_CHUNK_SIZE = 1024 * 1024
+# 大型 JSON 產品資料匯入時，每批寫入向量數據庫的產品數
+JSON_INGEST_BATCH_SIZE = int(os.getenv("JSON_INGEST_BATCH_SIZE", "500"))
+BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
+INGEST_CHECKPOINT_PATH = os.path.join(BASE_PATH, 'ingest_checkpoints.sqlite3')
+
+
+def _iter_json_array(file_path: str, key: str = "products"):
+    """逐項串流讀取 JSON 頂層物件中指定鍵的陣列，不將整個文件載入記憶體"""
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill() -> bool:
+            """讀入更多資料，丟棄已解析的部分，回傳是否還有資料"""
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            chunk = f.read(JSON_READ_CHUNK_SIZE)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = not chunk
+            return bool(chunk)
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buffer) or not fill():
+                    return
+
+        def expect(char: str):
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buffer) or buffer[pos] != char:
+                raise ValueError(f"JSON 格式錯誤: 預期 '{char}'")
+            pos += 1
+
+        def decode_value():
+            """解析下一個完整的 JSON 值，資料不足時自動補讀"""
+            nonlocal pos
+            skip_whitespace()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # 數字可能剛好被截斷在讀取邊界，確認後面還有其他字元
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        expect("{")
+        skip_whitespace()
+        if pos < len(buffer) and buffer[pos] == "}":
+            return
+        while True:
+            name = decode_value()
+            expect(":")
+            if name != key:
+                decode_value()  # 略過其他鍵的值
+            else:
+                expect("[")
+                skip_whitespace()
+                if pos < len(buffer) and buffer[pos] == "]":
+                    pos += 1
+                else:
+                    while True:
+                        yield decode_value()
+                        skip_whitespace()
+                        if pos < len(buffer) and buffer[pos] == ",":
+                            pos += 1
+                            continue
+                        expect("]")
+                        break
+            skip_whitespace()
+            if pos < len(buffer) and buffer[pos] == ",":
+                pos += 1
+                continue
+            expect("}")
+            return
+
+
 # 添加新的JSON產品數據加載器
 class JSONProductLoader:
     """加載JSON格式的產品數據"""
     
     def __init__(self, file_path):
         self.file_path = file_path
-    
-    def load(self):
-        """加載並處理JSON產品數據"""
+
+    @staticmethod
+    def product_text(product: dict) -> str:
+        """產品的文字內容（chunk ID 由內容決定，格式變更會使所有產品重新嵌入）"""
+        # 產品基本資訊轉字符串
+        product_info = f"產品ID: {product['id']}\n"
+        product_info += f"產品名稱: {product['name']}\n"
+        product_info += f"產品描述: {product['description']}\n"
+        product_info += f"價格: {product['price']}\n"
+        product_info += f"類別: {product['category']}\n"
+
+        # 產品規格如果存在
+        if 'specifications' in product:
+            product_info += "產品規格:\n"
+            for spec_key, spec_value in product['specifications'].items():
+                product_info += f"- {spec_key}: {spec_value}\n"
+        return product_info
+
+    def product_to_document(self, product: dict) -> Document:
+        """將單一產品轉為 Document"""
+        return Document(
+            page_content=self.product_text(product),
+            metadata={
+                "source": self.file_path,
+                "filename": os.path.basename(self.file_path),
+                "product_id": product['id'],
+                "product_name": product['name'],
+                "product_category": product['category'],
+                "product_prefix": product_prefix(product['id']),
+            }
+        )
+
+    def lazy_load(self):
+        """逐項產出產品 Document，記憶體用量與產品數量無關"""
         try:
-            with open(self.file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            documents = []
-            
-            # 處理產品資料
-            if 'products' in data:
-                for product in data['products']:
-                    # 產品基本資訊轉字符串
-                    product_info = f"產品ID: {product['id']}\n"
-                    product_info += f"產品名稱: {product['name']}\n"
-                    product_info += f"產品描述: {product['description']}\n"
-                    product_info += f"價格: {product['price']}\n"
-                    product_info += f"類別: {product['category']}\n"
-                    
-                    # 產品規格如果存在
-                    if 'specifications' in product:
-                        product_info += "產品規格:\n"
-                        for spec_key, spec_value in product['specifications'].items():
-                            product_info += f"- {spec_key}: {spec_value}\n"
-                    
-                    # 創建Document對象
-                    doc = Document(
-                        page_content=product_info,
-                        metadata={
-                            "source": self.file_path,
-                            "filename": os.path.basename(self.file_path),
-                            "product_id": product['id'],
-                            "product_name": product['name'],
-                            "product_category": product['category']
-                        }
-                    )
-                    documents.append(doc)
-            
-            return documents
+            for product in _iter_json_array(self.file_path, "products"):
+                yield self.product_to_document(product)
         except Exception as e:
             print(f"處理JSON產品數據時出錯: {str(e)}")
             raise
+    
+    def load(self):
+        """加載並處理JSON產品數據"""
+        return list(self.lazy_load())
 
 
-async def process_document(file_path: str) -> bool:
-    """處理上傳的文件，使用 GPT-4o 進行處理，並存儲到向量數據庫"""
+@contextmanager
+def _checkpoint_db():
+    """開啟匯入檢查點資料庫，離開時提交並關閉連線"""
+    os.makedirs(os.path.dirname(INGEST_CHECKPOINT_PATH), exist_ok=True)
+    conn = sqlite3.connect(INGEST_CHECKPOINT_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS checkpoints ("
+        "source TEXT PRIMARY KEY, signature TEXT NOT NULL, next_index INTEGER NOT NULL, "
+        "updated_at REAL NOT NULL)"
+    )
+    # 本次匯入已寫入的 chunk ID，存在磁碟上以免佔用記憶體，完成後用來找出過期 chunk
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS seen_chunks ("
+        "source TEXT NOT NULL, chunk_id TEXT NOT NULL, PRIMARY KEY (source, chunk_id))"
+    )
     try:
-        print(f"開始處理文件: {file_path}")
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
 
-        # 檢查是否為 PDF 文件
-        file_ext = os.path.splitext(file_path)[1].lower()
-        if file_ext != ".pdf":
-            raise ValueError("只支持 PDF 文件格式")
 
-        # 使用 GPT-4o 處理 PDF
-        print("使用 GPT-4o 處理 PDF...")
-        documents = process_pdf_with_gpt(file_path)
-        print(f"處理成功，獲取文檔內容")
+def _file_signature(file_path: str) -> str:
+    """以內容雜湊判斷文件是否與檢查點相同（重新上傳同一文件也能續傳）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(JSON_READ_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clear_ingest_checkpoint(source: str):
+    """刪除來源文件的匯入檢查點"""
+    with _checkpoint_db() as conn:
+        conn.execute("DELETE FROM checkpoints WHERE source = ?", (source,))
+        conn.execute("DELETE FROM seen_chunks WHERE source = ?", (source,))
+
+
+def ingest_json_products(file_path: str, batch_size: int = None, namespace: str = None,
+                         generation: str = None) -> dict:
+    """串流匯入大型 JSON 產品資料，分批寫入向量數據庫並記錄檢查點
+
+    中途失敗後再次匯入同一文件（內容未變）會從上次完成的批次之後繼續。
+    generation 指定時寫入尚未啟用的索引世代（背景重建），檢查點與線上匯入分開記錄。
+    回傳 {"added", "unchanged", "removed", "resumed_from"}。
+    """
+    batch_size = batch_size or JSON_INGEST_BATCH_SIZE
+    signature = _file_signature(file_path)
+    namespace = validate_namespace(namespace)
+    checkpoint_key = f"{generation}:{file_path}" if generation else file_path
+
+    with _checkpoint_db() as conn:
+        row = conn.execute(
+            "SELECT signature, next_index FROM checkpoints WHERE source = ?", (checkpoint_key,)
+        ).fetchone()
+        if row and row[0] == signature:
+            start_index = row[1]
+            print(f"從檢查點繼續匯入 {os.path.basename(file_path)}，已完成 {start_index} 個產品")
+        else:
+            # 文件已變更或首次匯入，重新開始
+            start_index = 0
+            conn.execute("DELETE FROM seen_chunks WHERE source = ?", (checkpoint_key,))
+
+    summary = {"added": 0, "unchanged": 0, "removed": 0, "resumed_from": start_index}
+
+    def write_batch(products: list, batch: list, next_index: int):
+        # 內容完全相同的產品得到相同的 chunk ID，只保留一份
+        batch = list({doc.metadata["chunk_id"]: doc for doc in batch}.values())
+        ids = [doc.metadata["chunk_id"] for doc in batch]
+        # 每批各自取得寫入鎖，背景重建切換世代時只會落在批次之間
+        with writable_store(namespace, generation, sources=[file_path]) as (vector_store, target):
+            # 結構化產品表與向量數據庫同步更新，供屬性篩選查詢使用
+            upsert_products(file_path, products, run=signature, namespace=namespace, generation=target)
+            existing = set(vector_store.get(ids=ids, include=[])["ids"])
+            new_docs = [doc for doc in batch if doc.metadata["chunk_id"] not in existing]
+            if new_docs:
+                vector_store.add_documents(new_docs, ids=[doc.metadata["chunk_id"] for doc in new_docs])
+        summary["added"] += len(new_docs)
+        summary["unchanged"] += len(batch) - len(new_docs)
+
+        with _checkpoint_db() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO seen_chunks (source, chunk_id) VALUES (?, ?)",
+                [(checkpoint_key, chunk_id) for chunk_id in ids],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (source, signature, next_index, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (checkpoint_key, signature, next_index, time.time()),
+            )
+        print(f"已匯入 {next_index} 個產品")
+
+    loader = JSONProductLoader(file_path)
+    products = []
+    batch = []
+    index = 0
+    for index, product in enumerate(_iter_json_array(file_path, "products"), start=1):
+        if index <= start_index:
+            continue
+        doc = loader.product_to_document(product)
+        # chunk ID 只由內容決定，產品順序變動不會導致重新嵌入
+        doc.metadata["chunk_id"] = make_chunk_id(file_path, doc)
+        products.append(product)
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            write_batch(products, batch, index)
+            products, batch = [], []
+    if batch:
+        write_batch(products, batch, index)
+
+    # 全部寫入後，刪除本次匯入沒有出現的舊 chunk
+    with writable_store(namespace, generation, sources=[file_path]) as (vector_store, target):
+        stale_ids = []
+        with _checkpoint_db() as conn:
+            for chunk_ids in _iter_source_chunk_ids(vector_store, file_path):
+                placeholders = ",".join("?" * len(chunk_ids))
+                seen = {
+                    r[0] for r in conn.execute(
+                        f"SELECT chunk_id FROM seen_chunks WHERE source = ? AND chunk_id IN ({placeholders})",
+                        [checkpoint_key, *chunk_ids],
+                    )
+                }
+                stale_ids.extend(chunk_id for chunk_id in chunk_ids if chunk_id not in seen)
+        for start in range(0, len(stale_ids), batch_size):
+            vector_store.delete(ids=stale_ids[start:start + batch_size])
+        summary["removed"] = len(stale_ids)
+        remove_stale_products(file_path, run=signature, generation=target)
+
+    # 匯入完成，清除檢查點
+    clear_ingest_checkpoint(checkpoint_key)
+
+    print(
+        f"JSON 產品匯入完成 {os.path.basename(file_path)}: 新增 {summary['added']} 個，"
+        f"未變更 {summary['unchanged']} 個，移除 {summary['removed']} 個"
+    )
+    return summary
+
+
+def copy_source_chunks(source: str, namespace: str = None, generation: str = None,
+                       batch_size: int = None, replace: bool = False) -> int:
+    """把來源文件在使用中索引裡的 chunk 複製到另一個世代（背景重建用）
+
+    沿用原本的 chunk ID、內容與 metadata，不需重新解析文件；向量由嵌入快取取得。
+    圖片引用、chunk 頁碼與產品資料一併複製。replace 為 True 時先刪除目標世代中該來源的 chunk。
+    回傳複製的 chunk 數，來源不在使用中索引時回傳 0。
+    """
+    batch_size = batch_size or JSON_INGEST_BATCH_SIZE
+    live = current_generation()
+    source_store = get_vector_store(namespace=namespace)
+    target_store = get_vector_store(namespace=namespace, generation=generation)
+    if replace:
+        target_store.delete(where={"source": source})
+    copied = 0
+    while True:
+        results = source_store.get(
+            where={"source": source}, include=["documents", "metadatas"], limit=batch_size, offset=copied
+        )
+        if not results["ids"]:
+            if copied:
+                copy_source_images(live, generation, sources=[source])
+                copy_products(live, generation, sources=[source])
+            return copied
+        documents = [
+            Document(page_content=content, metadata=metadata)
+            for content, metadata in zip(results["documents"], results["metadatas"])
+        ]
+        target_store.add_documents(documents, ids=results["ids"])
+        copied += len(results["ids"])
+
+
+def _iter_source_chunk_ids(vector_store, source: str, page_size: int = 1000):
+    """分頁取回來源文件的 chunk ID"""
+    offset = 0
+    while True:
+        ids = vector_store.get(where={"source": source}, include=[], limit=page_size, offset=offset)["ids"]
+        if not ids:
+            return
+        yield ids
+        offset += len(ids)
+
+
+# 可選的 PDF 內容提取方式
+EXTRACTION_METHODS = {
+    "gpt4o": process_pdf_with_gpt,  # 文字層本地解析 + GPT-4o 視覺辨識
+    "tesseract": process_pdf_with_tesseract,  # 本地 Tesseract OCR，不呼叫外部 API
+}
+
+# 支持的文件類型
+SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".docx", ".json"}
+
 
-        # 獲取向量存儲和嵌入模型
-        print("初始化向量存儲和嵌入模型...")
-        vector_store = get_vector_store()
-        embedding_model = get_embeddings_model()
+def load_documents(file_path: str, extraction_method: str = "gpt4o") -> list:
+    """依文件類型選擇加載器，解析成文檔（不寫入向量數據庫）"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"不支持的文件格式: {file_ext}")
 
-        # 確保向量存儲目錄權限正確
-        render_data_dir = os.path.join(os.getcwd(), ".render", "data")
-        persist_directory = os.path.join(render_data_dir, "chroma_new")
-        if not os.path.exists(persist_directory):
-            os.makedirs(persist_directory, exist_ok=True)
+    if file_ext == ".pdf":
+        if extraction_method not in EXTRACTION_METHODS:
+            raise ValueError(f"不支持的提取方式: {extraction_method}")
+        print(f"使用 {extraction_method} 處理 PDF...")
+        return EXTRACTION_METHODS[extraction_method](file_path)
+
+    if file_ext == ".json":
+        return JSONProductLoader(file_path).load()
+
+    # 純文字與 Word 文件切分成較小的 chunk
+    if file_ext == ".txt":
+        loader = TextLoader(file_path, encoding="utf-8")
+    else:
+        loader = Docx2txtLoader(file_path)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    documents = splitter.split_documents(loader.load())
+    for doc in documents:
+        doc.metadata["source"] = file_path
+        doc.metadata["filename"] = os.path.basename(file_path)
+        doc.metadata["extraction_method"] = "text"
+    return documents
+
+
+def _chunk_pages(doc: Document) -> set:
+    """取得 chunk 涵蓋的頁碼：優先使用 metadata，跨頁內容則從頁碼標註解析"""
+    if doc.metadata.get("page") is not None:
+        return {int(doc.metadata["page"])}
+    return {int(page) for page in re.findall(r"第\s*(\d+)\s*頁", doc.page_content)}
+
+
+def make_chunk_id(source: str, doc: Document) -> str:
+    """由來源路徑與內容雜湊產生確定性的 chunk ID，內容不變則 ID 不變"""
+    source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    metadata = {k: v for k, v in doc.metadata.items() if k != "chunk_id"}
+    content = doc.page_content + "\0" + json.dumps(metadata, sort_keys=True, ensure_ascii=False)
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+    return f"{source_hash}-{content_hash}"
+
+
+def get_source_chunk_ids(vector_store, source: str) -> set:
+    """只取回來源文件現有的 chunk ID，不載入內容與向量"""
+    try:
+        results = vector_store.get(where={"source": source}, include=[])
+        return set(results["ids"])
+    except Exception as e:
+        print(f"查詢現有向量時出錯（視為新文件）: {str(e)}")
+        return set()
+
+
+def _assign_chunk_ids(source: str, documents: list):
+    """為每個 chunk 產生確定性 ID，回傳 (ID 列表, {chunk_id: 頁碼})"""
+    ids = []
+    chunk_pages = {}
+    occurrences = {}
+    for doc in documents:
+        chunk_id = make_chunk_id(source, doc)
+        # 同一文件內完全相同的 chunk 以出現次序區分
+        occurrence = occurrences.get(chunk_id, 0)
+        occurrences[chunk_id] = occurrence + 1
+        if occurrence:
+            chunk_id = f"{chunk_id}-{occurrence}"
+        doc.metadata["chunk_id"] = chunk_id
+        ids.append(chunk_id)
+        chunk_pages[chunk_id] = _chunk_pages(doc)
+    return ids, chunk_pages
+
+
+def index_documents(documents_by_source: dict, namespace: str = None, generation: str = None) -> dict:
+    """將一或多個來源文件的文檔增量寫入向量數據庫
+
+    chunk ID 由來源與內容決定：只嵌入新增或變更的 chunk（多個文件的新 chunk 合併成
+    同一批嵌入），先寫入新 chunk、再切換圖片索引、最後刪除消失的 chunk，查詢期間
+    不會出現空窗。generation 指定時寫入尚未啟用的索引世代（背景重建）。
+    回傳 {來源: {"added", "unchanged", "removed"}}。
+    """
+    # 寫入使用中的索引時持有寫入鎖，背景重建的最後追趕與切換不會與寫入交錯
+    with writable_store(namespace, generation, sources=documents_by_source) as (vector_store, target):
+        return _index_documents(vector_store, documents_by_source, target)
+
+
+def _index_documents(vector_store, documents_by_source: dict, generation: str) -> dict:
+    print("初始化向量存儲...")
+
+    # 確保向量存儲目錄權限正確
+    persist_directory = generation_path(generation)
+    render_data_dir = os.path.dirname(persist_directory)
+    if not os.path.exists(persist_directory):
+        os.makedirs(persist_directory, exist_ok=True)
+    
+    # 設置所有相關目錄的權限
+    db_path = os.path.join(persist_directory, "chroma.sqlite3")
+    try:
+        # 設置向量存儲目錄權限
+        os.chmod(render_data_dir, 0o777)
+        os.chmod(persist_directory, 0o777)
         
-        # 設置所有相關目錄的權限
-        try:
-            # 設置向量存儲目錄權限
-            os.chmod(render_data_dir, 0o777)
-            os.chmod(persist_directory, 0o777)
-            
-            # 確保 SQLite 數據庫文件權限正確
-            db_path = os.path.join(persist_directory, "chroma.sqlite3")
-            if os.path.exists(db_path):
-                os.chmod(db_path, 0o777)
-        except Exception as e:
-            print(f"設置權限時出錯（非致命）: {str(e)}")
-            
-        # 先檢查並刪除相同路徑的舊文檔
-        try:
-            vector_store.delete(where={"source": file_path})
-            print(f"已刪除文件 {file_path} 的現有向量")
-        except Exception as del_e:
-            print(f"刪除現有向量時出錯（可能是新文件）: {str(del_e)}")
+        # 確保 SQLite 數據庫文件權限正確
+        if os.path.exists(db_path):
+            os.chmod(db_path, 0o777)
+    except Exception as e:
+        print(f"設置權限時出錯（非致命）: {str(e)}")
+
+    # 與現有 chunk 比對，只嵌入新增或變更的部分
+    new_documents, new_ids = [], []
+    stale_ids = []
+    chunk_pages_by_source = {}
+    summary = {}
+    for source, documents in documents_by_source.items():
+        ids, chunk_pages = _assign_chunk_ids(source, documents)
+        chunk_pages_by_source[source] = chunk_pages
+        existing_ids = get_source_chunk_ids(vector_store, source)
+
+        added = 0
+        for doc, chunk_id in zip(documents, ids):
+            if chunk_id not in existing_ids:
+                new_documents.append(doc)
+                new_ids.append(chunk_id)
+                added += 1
+        removed = existing_ids - set(ids)
+        stale_ids.extend(removed)
 
-        # 添加到向量數據庫
-        print("將文檔添加到向量數據庫...")
+        summary[source] = {"added": added, "unchanged": len(ids) - added, "removed": len(removed)}
+        print(
+            f"增量更新 {os.path.basename(source)}: 新增/變更 {added} 個，"
+            f"未變更 {len(ids) - added} 個，移除 {len(removed)} 個"
+        )
+
+    # 添加到向量數據庫；失敗時重試一次，仍失敗則讓呼叫端回滾本次處理
+    # （不可重建集合：同一命名空間的其他文件也在裡面）
+    print("將文檔添加到向量數據庫...")
+    if new_documents:
         try:
-            # 嘗試使用不同的方式添加文檔
-            try:
-                vector_store.add_documents(documents)
-            except Exception as e1:
-                print(f"第一次嘗試添加文檔失敗: {str(e1)}")
-                # 重新初始化向量存儲
-                vector_store = get_vector_store(force_new=True)
-                vector_store.add_documents(documents)
-            
-            print("文檔成功添加到向量數據庫!")
-            
-            # 再次確保數據庫文件權限正確
-            if os.path.exists(db_path):
-                os.chmod(db_path, 0o777)
-                
+            vector_store.add_documents(new_documents, ids=new_ids)
+        except Exception as e1:
+            print(f"第一次嘗試添加文檔失敗，重試: {str(e1)}")
+            vector_store.add_documents(new_documents, ids=new_ids)
+    print("文檔成功添加到向量數據庫!")
+
+    # 新 chunk 已可查詢，切換圖片索引後再移除消失的 chunk
+    for source, chunk_pages in chunk_pages_by_source.items():
+        commit_source_images(source, generation)
+        set_chunk_pages(source, chunk_pages, generation)
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+        print(f"已移除 {len(stale_ids)} 個過期的 chunk")
+
+    # 再次確保數據庫文件權限正確
+    if os.path.exists(db_path):
+        os.chmod(db_path, 0o777)
+
+    return summary
+
+
+async def process_document(file_path: str, extraction_method: str = "gpt4o",
+                           namespace: str = None) -> bool:
+    """處理上傳的文件，依類型解析後增量更新向量數據庫"""
+    is_new_source = True
+    try:
+        print(f"開始處理文件: {file_path}")
+        is_new_source = not get_source_chunk_ids(get_vector_store(namespace=namespace), file_path)
+
+        if file_path.lower().endswith(".json"):
+            # 大型產品資料串流分批匯入，記憶體用量固定且可從檢查點續傳
+            await asyncio.to_thread(ingest_json_products, file_path, None, namespace)
             return True
-        except Exception as e:
-            print(f"添加文檔時出錯: {str(e)}")
-            try:
-                # 最後一次嘗試
-                vector_store = get_vector_store(force_new=True)
-                vector_store.add_documents(documents, embedding=embedding_model)
-                print("使用替代方法成功添加文檔!")
-                
-                # 確保數據庫文件權限正確
-                if os.path.exists(db_path):
-                    os.chmod(db_path, 0o777)
-                    
-                return True
-            except Exception as e2:
-                print(f"替代方法添加文檔失敗: {str(e2)}")
-                raise e2
+
+        # 解析 PDF（OCR、GPT-4o 視覺辨識）耗時且為同步呼叫，放到執行緒中避免卡住事件迴圈
+        documents = await asyncio.to_thread(load_documents, file_path, extraction_method)
+        print(f"處理成功，獲取文檔內容")
+
+        # 寫入時可能等待背景重建切換世代，放到執行緒中避免卡住事件迴圈
+        await asyncio.to_thread(index_documents, {file_path: documents}, namespace)
+        return True
 
     except Exception as e:
         print(f"處理文件時出錯: {str(e)}")
         import traceback
         print(traceback.format_exc())
+        # 釋放時可能等待寫入鎖（重建或遷移切換中），放到執行緒中避免卡住事件迴圈
+        await asyncio.to_thread(_release_failed_source, file_path, namespace, is_new_source)
         return False
 
 
-async def remove_document(file_path: str) -> bool:
+def _release_failed_source(file_path: str, namespace: str, is_new_source: bool):
+    """放棄本次提取的圖片；新文件另外釋放已寫入的引用，重新處理失敗則保留舊版本繼續服務"""
+    try:
+        discard_staged_images(file_path)
+        if is_new_source:
+            with writable_store(namespace, sources=[file_path]):
+                release_source_images(file_path)
+                release_source_products(file_path)
+    except Exception as img_e:
+        print(f"釋放圖片與產品資料時出錯: {str(img_e)}")
+
+
+async def remove_document(file_path: str, namespace: str = None) -> bool:
     """從向量數據庫中移除文件"""
+    return await asyncio.to_thread(delete_document, file_path, namespace)
+
+
+def delete_document(file_path: str, namespace: str = None) -> bool:
+    """remove_document 的同步版本（啟動時收尾中斷的刪除用）"""
     try:
-        vector_store = get_vector_store()
-        vector_store.delete(where={"source": file_path})
+        with writable_store(namespace, sources=[file_path]) as (vector_store, target):
+            vector_store.delete(where={"source": file_path})
+            # 向量已刪除，未完成的匯入檢查點與結構化產品資料也不再有效
+            clear_ingest_checkpoint(file_path)
+            release_source_products(file_path, target)
+
+            # 釋放圖片引用，回收不再被任何文件使用的圖片
+            removed = release_source_images(file_path)
+        if removed:
+            print(f"已回收 {removed} 張圖片")
         return True
     except Exception as e:
         print(f"移除文件時出錯: {str(e)}")
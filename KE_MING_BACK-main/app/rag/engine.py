@@ -1,17 +1,28 @@
 import os
 import re
-import json
 from typing import Any, Dict, List, Optional
 
-from app.utils.vector_store import get_vector_store
+from app.rag.filters import build_where, extract_query_filters
+from app.rag.migration import compare_shadow
+from app.rag.product_query import answer_structured_query
+from app.utils.image_store import get_chunk_images
+from app.utils.vector_store import get_vector_store, validate_namespace
 from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain.schema import Document
 
 
+def _record_images(doc: Document, chunk_images: Dict[str, List[Dict]]) -> List[Dict]:
+    """取得 chunk 的圖片；結構化產品紀錄只保留模型標註屬於該產品的圖片"""
+    images = chunk_images.get(doc.metadata.get("chunk_id"), [])
+    if doc.metadata.get("record_type") == "product":
+        refs = set(filter(None, doc.metadata.get("image_refs", "").split(",")))
+        images = [image for image in images if image["key"] in refs]
+    return images
+
+
 class RAGEngine:
     def __init__(self):
-        self.vector_store = get_vector_store()
         self.llm = ChatOpenAI(
             model_name=os.getenv("CHAT_MODEL_NAME", "gpt-3.5-turbo"),
             temperature=0.7,
@@ -43,6 +54,11 @@ class RAGEngine:
             input_variables=["context", "question"],
         )
 
+    @property
+    def vector_store(self):
+        # 每次取用目前的存儲，索引重置或切換世代後不會拿到已關閉的舊集合
+        return get_vector_store()
+
     def setup_retrieval_qa(self, is_product_query=False):
         # 設置檢索問答系統
         retriever = self.vector_store.as_retriever(
@@ -129,41 +145,64 @@ class RAGEngine:
         
         return docs
 
-    def process_query(self, query, history=None):
+    def search(self, query: str, k: int = 3, filters: Optional[Dict[str, Any]] = None,
+               file_names: Optional[Dict[str, str]] = None, namespace: Optional[str] = None):
+        """向量檢索，篩選條件以 where 子句下推到 Chroma
+
+        filters 為請求中明確指定的條件（一定套用）；問題文字推斷出的條件只補上未指定的部分，
+        若推斷條件過嚴而沒有結果，退回只用明確條件搜尋。
+        """
+        namespace = validate_namespace(namespace)
+        vector_store = get_vector_store(namespace=namespace)
+        explicit = filters or {}
+        inferred = extract_query_filters(query, file_names, namespace)
+        combined = {**inferred, **explicit}
+
+        # 類別由問題推斷時不排除沒有類別欄位的 PDF 與文字文件 chunk
+        where = build_where(combined, loose_categories="categories" not in explicit)
+        if where:
+            print(f"檢索篩選條件: {where}")
+        results = vector_store.similarity_search_with_score(query, k=k, filter=where)
+        if not results and combined != explicit:
+            where = build_where(explicit)
+            results = vector_store.similarity_search_with_score(query, k=k, filter=where)
+        # 嵌入模型遷移的雙讀期：同一查詢在背景送到新模型的影子索引比對結果
+        compare_shadow(query, k, where, namespace, results)
+        return results
+
+    def process_query(self, query, history=None, filters=None, file_names=None, namespace=None):
         try:
-            # 確保向量存儲已初始化
-            if not self.vector_store:
-                print("重新初始化向量存儲...")
-                self.vector_store = get_vector_store()
-                if not self.vector_store:
-                    return {
-                        "answer": "我沒有找到任何相關信息，可能是因為尚未上傳任何文件。",
-                        "sources": [],
-                    }
+            namespace = validate_namespace(namespace)
+
+            # 列表、篩選類的產品問題直接查結構化產品表，不經過向量檢索與 LLM
+            # （明確指定文件或頁碼範圍時，結構化資料無法套用這些條件，改走向量檢索）
+            structured = None if filters else answer_structured_query(query, namespace)
+            if structured is not None:
+                print(f"使用結構化產品查詢，條件: {structured['constraints']}")
+                return {"answer": structured["answer"], "sources": structured["sources"]}
 
             # 使用向量搜索找出相關內容
-            results = self.vector_store.similarity_search_with_score(
-                query,
-                k=3
+            results = self.search(
+                query, k=3, filters=filters, file_names=file_names, namespace=namespace
             )
 
+            # 一次取出所有命中 chunk 的圖片（入庫時已建立旁路索引）
+            chunk_images = get_chunk_images(doc.metadata.get("chunk_id") for doc, _ in results)
+
             # 整理搜索結果
             sources = []
             context = ""
             for doc, score in results:
-                # 從內容中提取頁碼信息
-                page_info = ""
-                if "(第" in doc.page_content:
-                    # 從內容中提取頁碼
-                    page_matches = re.findall(r'第(\d+)頁', doc.page_content)
-                    if page_matches:
-                        page_info = f"(第 {page_matches[0]} 頁)"
-                
+                # 頁碼與產品圖片直接取自入庫時的結構化 metadata
+                page = doc.metadata.get("page")
+                page_info = f"(第 {page} 頁)" if page is not None else ""
+
                 source = {
                     "content": doc.page_content,
                     "metadata": doc.metadata,
                     "score": score,
-                    "page_info": page_info
+                    "page_info": page_info,
+                    "images": _record_images(doc, chunk_images)
                 }
                 sources.append(source)
                 context += doc.page_content + "\n\n"
@@ -244,30 +283,18 @@ class RAGEngine:
             response = self.llm.invoke(messages)
             answer = response.content if hasattr(response, "content") else str(response)
 
-            # 處理圖片信息
+            # 處理圖片信息：直接取用入庫時建立的 chunk 圖片索引
+            chunk_images = get_chunk_images(
+                doc.metadata.get("chunk_id") for doc in docs if hasattr(doc, 'metadata')
+            )
             sources = []
             for doc in docs:
                 if hasattr(doc, 'metadata'):
-                    source_info = {
+                    sources.append({
                         "content": doc.page_content,
                         "source": doc.metadata.get("source", ""),
-                        "images": {}
-                    }
-                    
-                    # 解析圖片信息
-                    images_str = doc.metadata.get("images", "{}")
-                    try:
-                        images_dict = json.loads(images_str)
-                        for key, value in images_dict.items():
-                            path, page = value.split("|")
-                            source_info["images"][key] = {
-                                "path": path,
-                                "page": int(page)
-                            }
-                    except json.JSONDecodeError:
-                        print(f"解析圖片信息時出錯: {images_str}")
-                    
-                    sources.append(source_info)
+                        "images": _record_images(doc, chunk_images)
+                    })
             
             return answer, sources
 
@@ -0,0 +1,124 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from app.utils.product_store import get_product_vocabulary
+
+# 可用的篩選條件：
+#   categories: 產品類別列表（對應 metadata product_category）
+#   product_prefix: 產品型號前綴，例如 "HK"（對應 metadata product_prefix）
+#   files: 來源文件名稱列表（對應 metadata filename，即 uploads 中的實際文件名）
+#   page_from / page_to: 頁碼範圍（對應 metadata page）
+FILTER_KEYS = ("categories", "product_prefix", "files", "page_from", "page_to")
+
+# 沒有 product_category 的 chunk（PDF 各解析方式、純文字與 Word 文件）的 extraction_method，
+# 從問題推斷的類別條件不排除這些 chunk（Chroma 與平面後端對缺少欄位的 $nin 判斷不一致，改以正向列舉）
+UNCATEGORIZED_EXTRACTION_METHODS = ("text_layer", "gpt4o", "tesseract", "text")
+
+# 「第 3 頁」、「第3到5頁」
+_PAGE_RANGE = re.compile(r"第\s*(\d+)\s*(?:(?:到|至|-|~)\s*(?:第\s*)?(\d+)\s*)?頁")
+# 「HK 系列」、「HK-」這類型號前綴（完整型號如 HK-2189 不算）
+_PREFIX = re.compile(r"(?<![A-Za-z0-9])([A-Z]{2})(?:\s*系列|-(?!\d))")
+
+
+def product_prefix(product_id: str) -> str:
+    """取得型號前綴，例如 HK-2189 的前綴為 HK"""
+    return str(product_id).split("-")[0].strip().upper()
+
+
+def normalize_filters(raw: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """檢查請求中明確指定的篩選條件，格式錯誤時拋出 ValueError"""
+    if not raw:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError("filters 必須是物件")
+    unknown = set(raw) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"不支持的篩選條件: {', '.join(sorted(unknown))}")
+
+    filters: Dict[str, Any] = {}
+    for key in ("categories", "files"):
+        value = raw.get(key)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list) or not all(isinstance(v, str) and v for v in value):
+            raise ValueError(f"{key} 必須是字串列表")
+        if value:
+            filters[key] = value
+    if raw.get("product_prefix"):
+        filters["product_prefix"] = product_prefix(raw["product_prefix"])
+    for key in ("page_from", "page_to"):
+        value = raw.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, int) or value < 1:
+            raise ValueError(f"{key} 必須是正整數")
+        filters[key] = value
+    if filters.get("page_from") and filters.get("page_to") and filters["page_from"] > filters["page_to"]:
+        raise ValueError("page_from 不可大於 page_to")
+    return filters
+
+
+def extract_query_filters(query: str, file_names: Optional[Dict[str, str]] = None,
+                          namespace: str = "default") -> Dict[str, Any]:
+    """從問題文字推斷篩選條件
+
+    file_names: 顯示名稱 -> 實際文件名，問題中提到某個文件（含或不含副檔名）時只搜尋該文件。
+    """
+    filters: Dict[str, Any] = {}
+
+    categories = [c for c in get_product_vocabulary(namespace)["categories"] if c and c in query]
+    if categories:
+        filters["categories"] = categories
+
+    prefix_match = _PREFIX.search(query)
+    if prefix_match:
+        filters["product_prefix"] = prefix_match.group(1)
+
+    page_match = _PAGE_RANGE.search(query)
+    if page_match:
+        first = int(page_match.group(1))
+        last = int(page_match.group(2) or first)
+        filters["page_from"], filters["page_to"] = min(first, last), max(first, last)
+
+    files = []
+    for display_name, actual_name in (file_names or {}).items():
+        stem = os.path.splitext(display_name)[0]
+        if display_name in query or (len(stem) >= 2 and stem in query):
+            files.append(actual_name)
+    if files:
+        filters["files"] = files
+
+    return filters
+
+
+def build_where(filters: Dict[str, Any], loose_categories: bool = False) -> Optional[Dict[str, Any]]:
+    """將篩選條件轉為 Chroma 的 where 子句，沒有條件時回傳 None
+
+    loose_categories: 類別條件只套用於帶有 product_category 的產品 chunk（從問題推斷的類別用），
+    PDF 與文字文件的 chunk 仍可被檢索到；明確指定的類別則只搜尋該類別的產品。
+    """
+    clauses: List[Dict[str, Any]] = []
+    if filters.get("categories"):
+        category = {"product_category": {"$in": filters["categories"]}}
+        if loose_categories:
+            category = {"$or": [
+                category, {"extraction_method": {"$in": list(UNCATEGORIZED_EXTRACTION_METHODS)}},
+            ]}
+        clauses.append(category)
+    if filters.get("product_prefix"):
+        clauses.append({"product_prefix": filters["product_prefix"]})
+    if filters.get("files"):
+        clauses.append({"filename": {"$in": filters["files"]}})
+    if filters.get("page_from") is not None:
+        clauses.append({"page": {"$gte": filters["page_from"]}})
+    if filters.get("page_to") is not None:
+        clauses.append({"page": {"$lte": filters["page_to"]}})
+
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
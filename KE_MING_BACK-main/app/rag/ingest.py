@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.rag.document import (
+    SUPPORTED_EXTENSIONS,
+    index_documents,
+    ingest_json_products,
+    load_documents,
+)
+from app.utils import image_store, page_renderer, tesseract_ocr
+
+# 解析文件的工作進程數，預設每個 CPU 核心一個
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+# 累積多少個 chunk 後合併成一批嵌入並寫入向量數據庫
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+
+def _init_ingest_worker(inner_workers: int):
+    """解析工作進程的初始化：縮小進程內的渲染、OCR 與圖片進程池
+
+    N 個解析進程各自再開 CPU 核心數的子進程池會超額佔用核心，
+    因此每個解析進程只分到 CPU 核心數 / N 個子進程。
+    """
+    page_renderer.RENDER_WORKERS = inner_workers
+    page_renderer.RENDER_MAX_INFLIGHT = inner_workers * 2
+    tesseract_ocr.TESSERACT_WORKERS = inner_workers
+    image_store.IMAGE_VARIANT_WORKERS = inner_workers
+
+
+def scan_folder(folder_path: str) -> List[str]:
+    """單次遍歷資料夾，找出所有支持的文件"""
+    files = []
+    for root, _, filenames in os.walk(folder_path):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                files.append(os.path.join(root, filename))
+    return sorted(files)
+
+
+def new_ingest_job(files: List[Tuple[str, str]]) -> Dict:
+    """建立進度紀錄，files 為 (實際路徑, 顯示名稱) 列表"""
+    return {
+        "status": "pending",
+        "total": len(files),
+        "completed": 0,
+        "failed": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+        "files": {
+            path: {"name": name, "status": "pending", "chunks": 0, "error": None}
+            for path, name in files
+        },
+    }
+
+
+def _set_file_status(job: Dict, path: str, status: str, **fields):
+    entry = job["files"][path]
+    entry.update(status=status, **fields)
+    if status == "indexed":
+        job["completed"] += 1
+    elif status == "failed":
+        job["failed"] += 1
+    print(
+        f"[{job['completed'] + job['failed']}/{job['total']}] "
+        f"{entry['name']}: {status}" + (f" ({entry['error']})" if entry.get("error") else "")
+    )
+
+
+async def ingest_files(job: Dict, extraction_method: str = "gpt4o", namespace: str = None,
+                       generation: str = None) -> Dict:
+    """平行解析多個文件並分批寫入向量數據庫，進度即時更新在 job 中
+
+    解析在進程池中進行（N 核心約可得 N 倍速度），解析完成的文件先暫存，
+    累積到 EMBEDDING_BATCH_SIZE 個 chunk 後一次嵌入寫入，減少 API 請求次數。
+    JSON 產品資料則各自串流分批匯入。generation 指定時寫入尚未啟用的索引世代。
+    """
+    loop = asyncio.get_running_loop()
+    job["status"] = "running"
+    paths = list(job["files"])
+
+    pending_batch: Dict[str, list] = {}
+    pending_chunks = 0
+
+    async def flush():
+        nonlocal pending_batch, pending_chunks
+        if not pending_batch:
+            return
+        batch, pending_batch, pending_chunks = pending_batch, {}, 0
+        try:
+            # 嵌入與寫入是阻塞操作，放到執行緒中避免卡住事件迴圈
+            await loop.run_in_executor(None, index_documents, batch, namespace, generation)
+            for path, documents in batch.items():
+                _set_file_status(job, path, "indexed", chunks=len(documents))
+        except Exception as e:
+            for path in batch:
+                _set_file_status(job, path, "failed", error=f"寫入向量數據庫失敗: {str(e)}")
+
+    async def ingest_json(path: str):
+        # 產品資料自行串流分批寫入，不經過解析進程池與合併批次
+        job["files"][path]["status"] = "parsing"
+        try:
+            summary = await loop.run_in_executor(
+                None, ingest_json_products, path, None, namespace, generation
+            )
+            _set_file_status(job, path, "indexed", chunks=summary["added"] + summary["unchanged"])
+        except Exception as e:
+            _set_file_status(job, path, "failed", error=str(e))
+
+    json_paths = [path for path in paths if path.lower().endswith(".json")]
+    paths = [path for path in paths if not path.lower().endswith(".json")]
+    json_tasks = [asyncio.create_task(ingest_json(path)) for path in json_paths]
+
+    workers = max(1, min(INGEST_WORKERS, len(paths)))
+    inner_workers = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_ingest_worker, initargs=(inner_workers,)
+    ) as executor:
+
+        async def parse(path: str):
+            job["files"][path]["status"] = "parsing"
+            try:
+                documents = await loop.run_in_executor(
+                    executor, load_documents, path, extraction_method
+                )
+                return path, documents, None
+            except Exception as e:
+                return path, None, e
+
+        # 依完成順序處理，先解析完的文件先進入嵌入批次
+        for parsed in asyncio.as_completed([parse(path) for path in paths]):
+            path, documents, error = await parsed
+            if error is not None:
+                _set_file_status(job, path, "failed", error=str(error))
+                continue
+
+            job["files"][path]["status"] = "parsed"
+            pending_batch[path] = documents
+            pending_chunks += len(documents)
+            if pending_chunks >= EMBEDDING_BATCH_SIZE:
+                await flush()
+
+    await flush()
+    await asyncio.gather(*json_tasks)
+
+    job["status"] = "finished"
+    job["finished_at"] = time.time()
+    return job
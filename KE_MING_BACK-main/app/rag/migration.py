@@ -0,0 +1,239 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from langchain.schema import Document
+
+from app.rag.document import copy_source_chunks
+from app.utils.image_store import copy_source_images, release_source_images
+from app.utils.product_store import copy_products, release_source_products
+from app.utils.vector_store import (
+    activate_generation,
+    create_generation,
+    current_generation,
+    discard_generation,
+    drop_namespace,
+    generation_embedding,
+    get_vector_store,
+    index_write_lock,
+    list_namespaces,
+    page_chunk_ids,
+    source_write_marks,
+    store_count,
+)
+
+# 每批重新嵌入的 chunk 數，以及批次間的等待秒數（限速，避免佔滿嵌入 API 配額影響線上查詢）
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "200"))
+MIGRATION_BATCH_DELAY = float(os.getenv("MIGRATION_BATCH_DELAY", "1.0"))
+# 雙讀比對時新舊索引各取前幾筆計算重疊率
+MIGRATION_COMPARE_K = int(os.getenv("MIGRATION_COMPARE_K", "10"))
+
+# 目前進行中的遷移（同一時間只允許一個），查詢時依此決定是否雙讀比對
+_active_job: Optional[Dict] = None
+_compare_lock = threading.Lock()
+# 影子索引的比對查詢在背景執行，不增加線上查詢的延遲
+_compare_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def new_migration_job(model: str, dimensions: Optional[int] = None, dual_read_seconds: int = 0,
+                      auto_cutover: bool = True) -> Dict:
+    """建立遷移進度紀錄"""
+    return {
+        "status": "pending",
+        "model": model,
+        "dimensions": dimensions,
+        "from": generation_embedding(),
+        "generation": None,
+        "previous_generation": None,
+        "total": 0,
+        "migrated": 0,
+        "coverage": 0.0,
+        "namespaces": {},
+        # 開始時使用中索引各來源文件的寫入序號，追趕時只同步之後寫入過的文件
+        "writes": source_write_marks(),
+        "dual_read_seconds": dual_read_seconds,
+        "dual_read_until": None,
+        "auto_cutover": auto_cutover,
+        "comparisons": 0,
+        "overlap_sum": 0.0,
+        "min_overlap": None,
+        "started_at": time.time(),
+        "finished_at": None,
+        "error": None,
+    }
+
+
+def active_migration() -> Optional[Dict]:
+    return _active_job
+
+
+async def _migrate_namespace(job: Dict, namespace: str, hnsw: Optional[Dict]):
+    """依 chunk ID 排序分頁讀取使用中的索引，分批以新模型嵌入寫入影子世代
+
+    以上一批最後一個 ID 為游標，遷移期間的寫入不會讓分頁跳過或重複 chunk。
+    """
+    source = get_vector_store(namespace=namespace)
+    target = get_vector_store(namespace=namespace, hnsw=hnsw, generation=job["generation"])
+    progress = job["namespaces"][namespace]
+    after = None
+    while True:
+        ids = await asyncio.to_thread(page_chunk_ids, namespace, None, after, MIGRATION_BATCH_SIZE)
+        if not ids:
+            return
+        after = ids[-1]
+        results = await asyncio.to_thread(source.get, ids=ids, include=["documents", "metadatas"])
+        documents = [
+            Document(page_content=content, metadata=metadata)
+            for content, metadata in zip(results["documents"], results["metadatas"])
+        ]
+        if documents:
+            await asyncio.to_thread(target.add_documents, documents, ids=results["ids"])
+        progress["migrated"] += len(results["ids"])
+        job["migrated"] += len(results["ids"])
+        job["coverage"] = job["migrated"] / job["total"] if job["total"] else 1.0
+        print(f"嵌入模型遷移 [{namespace}] {progress['migrated']}/{progress['total']}")
+        await asyncio.sleep(MIGRATION_BATCH_DELAY)
+
+
+def _catch_up(job: Dict) -> float:
+    """同步遷移期間使用中索引的變動，回傳影子世代的覆蓋率（1.0 代表兩邊 chunk 數一致）
+
+    與重建的追趕相同，只重新複製上次同步後寫入過的來源文件（依 source_write_marks），
+    不掃描整個索引，切換前持鎖的最後一次追趕只處理剩下的少量變動。
+    每次重新列出命名空間：遷移期間新建的命名空間以其 HNSW 參數加入影子世代，
+    已刪除的命名空間也從影子世代中刪除。
+    """
+    generation = job["generation"]
+    live_namespaces = {item["namespace"]: item.get("hnsw") for item in list_namespaces()}
+    for namespace, hnsw in live_namespaces.items():
+        if namespace not in job["namespaces"]:
+            get_vector_store(namespace=namespace, hnsw=hnsw, generation=generation)
+            job["namespaces"][namespace] = {"total": 0, "migrated": 0}
+            print(f"嵌入模型遷移: 加入遷移期間新建的命名空間 {namespace}")
+    for namespace in [namespace for namespace in job["namespaces"] if namespace not in live_namespaces]:
+        drop_namespace(namespace, generation=generation)
+        job["namespaces"].pop(namespace)
+        print(f"嵌入模型遷移: 移除遷移期間刪除的命名空間 {namespace}")
+
+    # 先記下寫入序號再複製，複製期間又被寫入的文件下一次仍會被找出
+    writes = source_write_marks()
+    changed = [source for source, mark in writes.items() if job["writes"].get(source) != mark]
+    for source in changed:
+        copied = sum(
+            copy_source_chunks(source, namespace, generation, replace=True) for namespace in job["namespaces"]
+        )
+        if not copied:
+            # 文件已從使用中的索引刪除
+            release_source_images(source, generation)
+            release_source_products(source, generation)
+    job["writes"] = writes
+    if changed:
+        print(f"嵌入模型遷移追趕同步: 重新複製 {len(changed)} 個寫入過的文件")
+
+    live_total = 0
+    shadow_total = 0
+    for namespace in job["namespaces"]:
+        live = store_count(get_vector_store(namespace=namespace))
+        shadow = store_count(get_vector_store(namespace=namespace, generation=generation))
+        live_total += max(live, shadow)
+        shadow_total += min(live, shadow)
+    # 影子世代多出使用中索引已刪除的 chunk 也算未同步
+    return shadow_total / live_total if live_total else 1.0
+
+
+def compare_shadow(query: str, k: int, where: Optional[Dict], namespace: str, results: List):
+    """雙讀期間把同一查詢送到影子世代，背景記錄新舊模型結果的重疊率"""
+    job = _active_job
+    if job is None or job["status"] != "dual_read" or namespace not in job["namespaces"]:
+        return
+    live_keys = [_result_key(doc) for doc, _ in results[:MIGRATION_COMPARE_K]]
+    _compare_executor.submit(_record_overlap, job, query, k, where, namespace, live_keys)
+
+
+def _result_key(doc: Document) -> str:
+    return getattr(doc, "id", None) or doc.metadata.get("chunk_id") or doc.page_content
+
+
+def _record_overlap(job: Dict, query: str, k: int, where: Optional[Dict], namespace: str, live_keys: List[str]):
+    try:
+        shadow = get_vector_store(namespace=namespace, generation=job["generation"])
+        shadow_results = shadow.similarity_search_with_score(query, k=len(live_keys) or k, filter=where)
+    except Exception as e:
+        print(f"影子索引比對查詢失敗: {str(e)}")
+        return
+    shadow_keys = {_result_key(doc) for doc, _ in shadow_results}
+    overlap = len(set(live_keys) & shadow_keys) / len(live_keys) if live_keys else 1.0
+    with _compare_lock:
+        job["comparisons"] += 1
+        job["overlap_sum"] += overlap
+        job["min_overlap"] = overlap if job["min_overlap"] is None else min(job["min_overlap"], overlap)
+
+
+def cutover(job: Dict) -> str:
+    """最後一次追趕同步，覆蓋率達 100% 後原子切換到新模型的世代（原世代保留可回滾）
+
+    先不持鎖追趕大部分變動，再持有寫入鎖做最後一次追趕並切換，
+    期間的上傳與刪除會等切換完成後寫入新世代，不會在追趕與切換之間遺失。
+    """
+    if job["status"] not in ("dual_read", "ready"):
+        raise ValueError(f"遷移狀態為 {job['status']}，無法切換")
+    _catch_up(job)
+    with index_write_lock:
+        coverage = _catch_up(job)
+        job["coverage"] = coverage
+        if coverage < 1.0:
+            raise RuntimeError(f"影子索引覆蓋率 {coverage:.2%}，未達 100%，不切換")
+        # chunk ID 不變，圖片引用、chunk 頁碼與產品資料直接沿用使用中的世代
+        copy_source_images(current_generation(), job["generation"])
+        copy_products(current_generation(), job["generation"])
+        job["previous_generation"] = current_generation()
+        activate_generation(job["generation"])
+    job["status"] = "finished"
+    job["finished_at"] = time.time()
+    print(f"嵌入模型已切換為 {job['model']}，世代 {job['generation']}")
+    return job["generation"]
+
+
+async def migrate_embeddings(job: Dict) -> Dict:
+    """以新的嵌入模型在影子世代重新嵌入所有 chunk，完成後雙讀比對並原子切換
+
+    遷移期間使用中的索引照常提供查詢與上傳；新上傳的內容在切換前由追趕同步補上。
+    dual_read_seconds 大於 0 時先進入雙讀期，查詢同時送到影子世代比對結果重疊率；
+    auto_cutover 為 False 時停在 ready / dual_read，等待手動呼叫 cutover。
+    """
+    global _active_job
+    _active_job = job
+    job["status"] = "running"
+    embedding = {"model": job["model"], "dimensions": job["dimensions"]}
+    try:
+        generation = await asyncio.to_thread(create_generation, embedding)
+        job["generation"] = generation
+        namespaces = list_namespaces()
+        for item in namespaces:
+            total = store_count(get_vector_store(namespace=item["namespace"]))
+            job["namespaces"][item["namespace"]] = {"total": total, "migrated": 0}
+            job["total"] += total
+        for item in namespaces:
+            await _migrate_namespace(job, item["namespace"], item.get("hnsw"))
+
+        job["coverage"] = await asyncio.to_thread(_catch_up, job)
+        job["status"] = "ready"
+        if job["dual_read_seconds"] > 0:
+            # 未自動切換時雙讀持續到手動切換為止
+            job["status"] = "dual_read"
+            job["dual_read_until"] = time.time() + job["dual_read_seconds"]
+            print(f"嵌入模型遷移進入雙讀比對期 {job['dual_read_seconds']} 秒")
+            await asyncio.sleep(job["dual_read_seconds"])
+        if job["auto_cutover"]:
+            await asyncio.to_thread(cutover, job)
+    except Exception as e:
+        print(f"嵌入模型遷移失敗: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+        job["finished_at"] = time.time()
+        if job["generation"]:
+            discard_generation(job["generation"])
+    return job
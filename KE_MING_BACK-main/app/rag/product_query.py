@@ -0,0 +1,206 @@
+import os
+import re
+from typing import Dict, List, Optional
+
+from app.rag.document import JSONProductLoader
+from app.utils.product_store import find_spec_key_by_unit, get_product_vocabulary, query_products
+
+# 是否啟用結構化產品查詢（列表、篩選類問題直接以 SQL 回答）
+STRUCTURED_PRODUCT_QUERY = os.getenv("STRUCTURED_PRODUCT_QUERY", "true").lower() == "true"
+# 結構化查詢最多列出的產品數
+STRUCTURED_QUERY_LIMIT = int(os.getenv("STRUCTURED_QUERY_LIMIT", "50"))
+
+# 表示「列出 / 篩選」意圖的關鍵詞
+LISTING_KEYWORDS = ["所有", "全部", "列出", "哪些", "有什麼", "有沒有", "清單", "篩選", "推薦"]
+
+_NUMBER = r"(\d+(?:\.\d+)?)"
+# 數字不可接在英數字或連字號之後（排除 HK-2034、IP65 這類型號中的數字）
+_LEADING_NUMBER = r"(?<![A-Za-z0-9.\-])" + _NUMBER
+# 金額單位：寫出金額單位的數字一定是價格條件
+_PRICE_UNITS = ("元", "塊錢", "塊")
+# 沒有金額單位時，數字前方要有價格詞才視為價格條件
+_PRICE_WORDS = ("價格", "價錢", "售價", "單價", "預算")
+# 數字後緊接的單位，金額以外的單位依產品規格值找出對應的規格（例如 12-24V、1000流明）
+_UNIT = r"(塊錢|元|塊|流明|小時|毫安時|毫安|瓦|伏|[A-Za-z%°]+)"
+# 頁碼、年份、日期之類的數字不是產品條件，例如「第3-5頁」、「2023-2024 年」
+_NON_PRODUCT_SUFFIXES = ("頁", "年", "月", "日", "號", "歲")
+
+# 「1000 元以下」、「500流明以上」這類後置比較
+_SUFFIX_COMPARISON = re.compile(_LEADING_NUMBER + r"\s*" + _UNIT + r"?\s*(以下|以內|之內|以上)")
+# 「低於 1000 元」、「超過 12V」這類前置比較
+_PREFIX_COMPARISON = re.compile(
+    r"(低於|少於|小於|不超過|不到|高於|大於|超過|至少)\s*" + _LEADING_NUMBER + r"\s*" + _UNIT + r"?"
+)
+# 「500 到 1000 元」、「12-24V」這類範圍
+_RANGE = re.compile(
+    _LEADING_NUMBER + r"\s*" + _UNIT + r"?\s*(?:到|至|~|-)\s*" + _NUMBER + r"\s*" + _UNIT + r"?"
+)
+# 產品 ID 或前綴，例如 HK-2189、HK-
+_PRODUCT_ID = re.compile(r"(?<![A-Za-z0-9])([A-Z]{2})-(\d{0,4})")
+# 規格值中的型號類字串，例如 IP65
+_SPEC_TOKEN = re.compile(r"(?<![A-Za-z0-9\-])([A-Za-z]{1,4}\d{1,4})(?![A-Za-z0-9])")
+
+_UPPER_OPS = {"以下", "以內", "之內", "低於", "少於", "小於", "不超過", "不到"}
+_NO_TARGET = object()
+
+
+def _comparison_target(query: str, position: int, spec_keys: List[str]) -> Optional[str]:
+    """比較條件前方緊鄰的規格名稱（例如「亮度 1000 以上」），沒有則回傳 None"""
+    window = query[max(0, position - 8):position]
+    for key in sorted(spec_keys, key=len, reverse=True):
+        if key in window:
+            return key
+    return None
+
+
+def _constraint_target(query: str, start: int, end: int, unit: Optional[str],
+                       vocabulary: Dict, namespace: str):
+    """判斷數字條件的對象：價格回傳 None、規格回傳規格名稱，都不是時回傳 _NO_TARGET
+
+    只有寫出金額單位或價格詞才是價格條件，其他單位須對應到產品規格，
+    頁碼、年份等數字一律略過。
+    """
+    if query[:start].rstrip().endswith("第") or query[end:].lstrip().startswith(_NON_PRODUCT_SUFFIXES):
+        return _NO_TARGET
+    if unit in _PRICE_UNITS:
+        return None
+    if unit:
+        key = find_spec_key_by_unit(unit, namespace)
+        return _NO_TARGET if key is None else key
+
+    key = _comparison_target(query, start, vocabulary["spec_keys"])
+    if key is not None:
+        return key
+    window = query[max(0, start - 8):start]
+    if any(word in window for word in _PRICE_WORDS):
+        return None
+    return _NO_TARGET
+
+
+def parse_product_constraints(query: str, namespace: str = "default") -> Optional[Dict]:
+    """從問題中解析產品屬性條件；不是列表/篩選類問題時回傳 None"""
+    # 沒有列表意圖的問題（例如「IP65 的頭燈怎麼充電」、「支援 12-24V 電壓嗎」）走語意檢索
+    if not any(keyword in query for keyword in LISTING_KEYWORDS):
+        return None
+
+    vocabulary = get_product_vocabulary(namespace)
+    if not vocabulary["categories"] and not vocabulary["spec_keys"]:
+        return None
+
+    constraints: Dict = {
+        "categories": [c for c in vocabulary["categories"] if c and c in query],
+        "min_price": None,
+        "max_price": None,
+        "id_prefix": None,
+        "spec_values": [],
+        "spec_ranges": [],
+    }
+
+    def add_bound(key: Optional[str], op_is_upper: bool, value: float):
+        if key is None:
+            constraints["max_price" if op_is_upper else "min_price"] = value
+        else:
+            constraints["spec_ranges"].append({"key": key, "max" if op_is_upper else "min": value})
+
+    for match in _RANGE.finditer(query):
+        low, high = sorted((float(match.group(1)), float(match.group(3))))
+        unit = match.group(4) or match.group(2)
+        key = _constraint_target(query, match.start(), match.end(), unit, vocabulary, namespace)
+        if key is _NO_TARGET:
+            continue
+        add_bound(key, False, low)
+        add_bound(key, True, high)
+    for match in _SUFFIX_COMPARISON.finditer(query):
+        key = _constraint_target(query, match.start(), match.end(), match.group(2), vocabulary, namespace)
+        if key is not _NO_TARGET:
+            add_bound(key, match.group(3) in _UPPER_OPS, float(match.group(1)))
+    for match in _PREFIX_COMPARISON.finditer(query):
+        key = _constraint_target(query, match.start(), match.end(), match.group(3), vocabulary, namespace)
+        if key is not _NO_TARGET:
+            add_bound(key, match.group(1) in _UPPER_OPS, float(match.group(2)))
+
+    id_match = _PRODUCT_ID.search(query)
+    if id_match:
+        # 完整 ID 屬於單一產品詢問，交給語意檢索回答細節
+        if len(id_match.group(2)) == 4:
+            return None
+        constraints["id_prefix"] = id_match.group(1) + "-" + id_match.group(2)
+
+    constraints["spec_values"] = _SPEC_TOKEN.findall(query)
+
+    has_condition = any([
+        constraints["categories"],
+        constraints["min_price"] is not None,
+        constraints["max_price"] is not None,
+        constraints["id_prefix"],
+        constraints["spec_values"],
+        constraints["spec_ranges"],
+    ])
+    if not has_condition:
+        return None
+    return constraints
+
+
+def _describe_constraints(constraints: Dict) -> str:
+    parts = []
+    if constraints["categories"]:
+        parts.append("類別為" + "、".join(constraints["categories"]))
+    if constraints["min_price"] is not None:
+        parts.append(f"價格不低於 {constraints['min_price']:g}")
+    if constraints["max_price"] is not None:
+        parts.append(f"價格不超過 {constraints['max_price']:g}")
+    if constraints["id_prefix"]:
+        parts.append(f"產品ID以 {constraints['id_prefix']} 開頭")
+    for value in constraints["spec_values"]:
+        parts.append(f"規格包含 {value}")
+    for spec_range in constraints["spec_ranges"]:
+        if spec_range.get("min") is not None:
+            parts.append(f"{spec_range['key']}不低於 {spec_range['min']:g}")
+        if spec_range.get("max") is not None:
+            parts.append(f"{spec_range['key']}不超過 {spec_range['max']:g}")
+    return "、".join(parts)
+
+
+def answer_structured_query(query: str, namespace: str = "default") -> Optional[Dict]:
+    """以結構化產品資料回答列表/篩選類問題，無法處理時回傳 None 交給語意檢索"""
+    if not STRUCTURED_PRODUCT_QUERY:
+        return None
+    constraints = parse_product_constraints(query, namespace)
+    if constraints is None:
+        return None
+
+    products = query_products(limit=STRUCTURED_QUERY_LIMIT, namespace=namespace, **constraints)
+    condition = _describe_constraints(constraints)
+    if not products:
+        answer = f"沒有找到符合條件（{condition}）的產品。"
+    else:
+        lines = [f"符合條件（{condition}）的產品共 {len(products)} 項：", ""]
+        for product in products:
+            specs = "，".join(f"{k}: {v}" for k, v in (product.get("specifications") or {}).items())
+            line = f"- **{product['id']} {product['name']}**：價格 {product.get('price')}，類別 {product.get('category')}"
+            if specs:
+                line += f"（{specs}）"
+            lines.append(line)
+        if len(products) >= STRUCTURED_QUERY_LIMIT:
+            lines.append("")
+            lines.append(f"僅列出前 {STRUCTURED_QUERY_LIMIT} 項，請加上更多條件縮小範圍。")
+        answer = "\n".join(lines)
+
+    sources = [
+        {
+            # 與向量庫中的產品 chunk 相同的文字格式
+            "content": JSONProductLoader.product_text(product),
+            "metadata": {
+                "source": product["source"],
+                "filename": os.path.basename(product["source"]),
+                "product_id": product["id"],
+                "product_name": product["name"],
+                "product_category": product.get("category"),
+            },
+            "score": 0.0,
+            "page_info": "",
+            "images": [],
+        }
+        for product in products
+    ]
+    return {"answer": answer, "sources": sources, "constraints": constraints}
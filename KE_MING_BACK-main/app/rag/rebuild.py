@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from app.rag.document import copy_source_chunks
+from app.rag.ingest import ingest_files, new_ingest_job
+from app.utils.image_store import discard_staged_images, release_source_images
+from app.utils.product_store import release_source_products
+from app.utils.vector_store import (
+    activate_generation,
+    create_generation,
+    current_generation,
+    discard_generation,
+    get_vector_store,
+    index_write_lock,
+    list_namespaces,
+    source_write_marks,
+)
+
+
+def new_rebuild_job(sources: Dict[str, str], reextract: bool = False) -> Dict:
+    """建立重建進度紀錄，sources 為 {實際路徑: 命名空間}"""
+    return {
+        "status": "pending",
+        "reextract": reextract,
+        "generation": None,
+        "previous_generation": None,
+        "total": len(sources),
+        "completed": 0,
+        "failed": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+        "error": None,
+        "sources": dict(sources),
+        # 開始時各文件的修改時間與使用中索引的寫入序號，完成前用來找出重建期間變動過的文件
+        "mtimes": {path: _mtime(path) for path in sources},
+        "writes": source_write_marks(),
+    }
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+async def _copy_sources(job: Dict, sources: Dict[str, str], generation: str) -> Dict[str, str]:
+    """從使用中的索引複製 chunk 到新世代，回傳使用中索引沒有、需要重新解析的文件"""
+    missing = {}
+    for path, namespace in sources.items():
+        try:
+            copied = await asyncio.to_thread(copy_source_chunks, path, namespace, generation)
+        except Exception as e:
+            print(f"複製 {os.path.basename(path)} 失敗，改為重新解析: {str(e)}")
+            copied = 0
+        if copied:
+            job["completed"] += 1
+        else:
+            missing[path] = namespace
+    return missing
+
+
+async def _ingest_sources(job: Dict, sources: Dict[str, str], generation: str, extraction_method: str):
+    """重新解析文件寫入新世代（依命名空間分組，沿用資料夾匯入的平行流程）"""
+    by_namespace: Dict[str, list] = {}
+    for path, namespace in sources.items():
+        by_namespace.setdefault(namespace, []).append((path, os.path.basename(path)))
+    for namespace, files in by_namespace.items():
+        ingest_job = new_ingest_job(files)
+        await ingest_files(ingest_job, extraction_method=extraction_method, namespace=namespace,
+                           generation=generation)
+        job["completed"] += ingest_job["completed"]
+        job["failed"] += ingest_job["failed"]
+        # 解析失敗的文件不會入庫，放棄其提取中的圖片
+        for path, entry in ingest_job["files"].items():
+            if entry["status"] == "failed":
+                discard_staged_images(path)
+
+
+def _remove_source(path: str, namespace: str, generation: str):
+    """從新世代移除來源文件的 chunk、圖片引用與產品資料"""
+    get_vector_store(namespace=namespace, generation=generation).delete(where={"source": path})
+    release_source_images(path, generation)
+    release_source_products(path, generation)
+
+
+def _catch_up(job: Dict, generation: str, current_sources: Callable[[], Dict[str, str]]):
+    """重建期間新增、修改或刪除的文件，依使用中的索引同步到新世代
+
+    同步後以本次看到的文件與修改時間作為下一次比對的基準，
+    因此可先在不持鎖時追趕大部分變動，切換前持鎖再追趕剩下的少量變動。
+    """
+    # 重建期間新建的命名空間沿用其 HNSW 參數
+    for item in list_namespaces():
+        get_vector_store(namespace=item["namespace"], hnsw=item.get("hnsw"), generation=generation)
+
+    latest = current_sources()
+    # 先記下修改時間與寫入序號再複製，複製期間又被寫入的文件下一次仍會被找出
+    mtimes = {path: _mtime(path) for path in latest}
+    writes = source_write_marks()
+    for path, namespace in job["sources"].items():
+        if path not in latest or latest[path] != namespace:
+            _remove_source(path, namespace, generation)
+    changed = {
+        path: namespace for path, namespace in latest.items()
+        if job["sources"].get(path) != namespace
+        or mtimes[path] != job["mtimes"].get(path)
+        or writes.get(path) != job["writes"].get(path)
+    }
+    for path, namespace in changed.items():
+        if not copy_source_chunks(path, namespace, generation, replace=True):
+            # 使用中的索引沒有這個文件（例如仍在處理中），新世代也不保留舊內容
+            _remove_source(path, namespace, generation)
+    job["sources"], job["mtimes"], job["writes"] = latest, mtimes, writes
+    if changed:
+        print(f"已同步重建期間變動的 {len(changed)} 個文件")
+
+
+def _finalize(job: Dict, generation: str, current_sources: Callable[[], Dict[str, str]]):
+    """持有寫入鎖追趕最後的變動並切換世代，期間使用中的索引沒有寫入，不會遺漏"""
+    with index_write_lock:
+        _catch_up(job, generation, current_sources)
+        job["previous_generation"] = current_generation()
+        activate_generation(generation)
+
+
+async def rebuild_index(job: Dict, current_sources: Callable[[], Dict[str, str]],
+                        extraction_method: str = "gpt4o") -> Dict:
+    """藍綠重建：在新的索引世代中重建所有文件，完成後原子切換
+
+    重建期間使用中的索引照常提供查詢與上傳。預設直接複製使用中索引的 chunk
+    （向量由嵌入快取取得），使用中索引缺少的文件或 reextract 時才重新解析上傳的原始文件。
+    任何文件失敗時放棄新世代，不切換。原本的世代保留，可用 rollback_generation 回滾。
+    """
+    job["status"] = "running"
+    generation = await asyncio.to_thread(create_generation)
+    job["generation"] = generation
+    try:
+        sources = job["sources"]
+        if not job["reextract"]:
+            sources = await _copy_sources(job, sources, generation)
+        if sources:
+            await _ingest_sources(job, sources, generation, extraction_method)
+        if job["failed"]:
+            raise RuntimeError(f"{job['failed']} 個文件重建失敗")
+
+        # 大部分變動先在不持鎖時追趕，縮短切換時阻擋寫入的時間
+        await asyncio.to_thread(_catch_up, job, generation, current_sources)
+        await asyncio.to_thread(_finalize, job, generation, current_sources)
+        job["status"] = "finished"
+    except Exception as e:
+        print(f"重建向量索引失敗: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+        discard_generation(generation)
+    finally:
+        job["finished_at"] = time.time()
+    return job
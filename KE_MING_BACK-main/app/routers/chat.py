@@ -5,15 +5,42 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.rag.engine import RAGEngine
+from app.rag.filters import normalize_filters
+from app.routers.upload import namespace_files
+from app.utils.responses import dumps
+from app.utils.vector_store import validate_namespace
 import asyncio
 
 router = APIRouter(prefix="/api", tags=["chat"])
 rag_engine = RAGEngine()
 
 
+def _parse_namespace(raw: Any) -> str:
+    try:
+        return validate_namespace(raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _parse_filters(raw: Any, namespace: str) -> Dict[str, Any]:
+    """檢查請求中的篩選條件，並把文件顯示名稱換成實際文件名"""
+    try:
+        filters = normalize_filters(raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "files" in filters:
+        files = namespace_files(namespace)
+        filters["files"] = [files.get(name, name) for name in filters["files"]]
+    return filters
+
+
 class ChatRequest(BaseModel):
     query: str
     history: Optional[List[Dict[str, str]]] = []
+    # 檢索篩選條件：categories、product_prefix、files（顯示名稱）、page_from、page_to
+    filters: Optional[Dict[str, Any]] = None
+    # 查詢的命名空間（品牌/客戶），未指定時使用預設命名空間
+    namespace: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
@@ -29,17 +56,24 @@ async def chat(request: Dict[str, Any]):
 
         if not query:
             raise HTTPException(status_code=400, detail="查詢不能為空")
+        namespace = _parse_namespace(request.get("namespace"))
+        filters = _parse_filters(request.get("filters"), namespace)
 
         # 增加診斷日誌
         print(f"接收到查詢: {query}")
 
-        response = rag_engine.process_query(query, history)
+        response = rag_engine.process_query(
+            query, history, filters=filters,
+            file_names=namespace_files(namespace), namespace=namespace,
+        )
 
         # 調試輸出
         print(f"返回答案: {response.get('answer', 'No answer')}")
         print(f"返回來源數量: {len(response.get('sources', []))}")
 
         return response
+    except HTTPException:
+        raise
     except Exception as e:
         # 捕獲並打印詳細錯誤信息
         error_msg = f"處理查詢時出錯: {str(e)}"
@@ -77,6 +111,8 @@ async def stream_chat(request: Dict[str, Any]):
 
         if not query:
             raise HTTPException(status_code=400, detail="查詢不能為空")
+        namespace = _parse_namespace(request.get("namespace"))
+        filters = _parse_filters(request.get("filters"), namespace)
 
         # 增加診斷日誌
         print(f"接收到流式查詢: {query}")
@@ -85,7 +121,10 @@ async def stream_chat(request: Dict[str, Any]):
         async def generate_response():
             try:
                 # 獲取完整回應
-                response = rag_engine.process_query(query, history)
+                response = rag_engine.process_query(
+                    query, history, filters=filters,
+                    file_names=namespace_files(namespace), namespace=namespace,
+                )
                 answer = response.get("answer", "")
                 sources = response.get("sources", [])
                 
@@ -98,8 +137,7 @@ async def stream_chat(request: Dict[str, Any]):
                     await asyncio.sleep(0.02)  # 控制輸出速度，稍微加快一點
                 
                 # 最後發送完整的來源信息
-                import json
-                yield f"data: [SOURCES]{json.dumps(sources)}[/SOURCES]\n\n"
+                yield f"data: [SOURCES]{dumps(sources)}[/SOURCES]\n\n"
                 
                 # 發送結束標記
                 yield "data: [DONE]\n\n"
@@ -119,6 +157,8 @@ async def stream_chat(request: Dict[str, Any]):
                 "Content-Type": "text/event-stream",
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"準備流式響應時出錯: {str(e)}"
         print(error_msg)
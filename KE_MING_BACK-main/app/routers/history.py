@@ -2,7 +2,8 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 from uuid import uuid4
 
-from fastapi import APIRouter, HTTPException
+from app.utils.data_version import bump_data_version, not_modified
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api", tags=["history"])
@@ -28,12 +29,17 @@ class CreateHistoryRequest(BaseModel):
 
 # 暫時使用內存存儲，實際應用中應該使用數據庫
 chat_histories: Dict[str, ChatHistory] = {}
+# 對話記錄只在本進程記憶體中，ETag 需區分進程（與重啟），不能只看共用的資料版本號
+BOOT_ID = uuid4().hex[:12]
 
 
 @router.get("/history", response_model=List[ChatHistory])
-async def get_all_histories():
-    """獲取所有對話歷史"""
+async def get_all_histories(request: Request, response: Response):
+    """獲取所有對話歷史（支援 If-None-Match / If-Modified-Since，未變動時回傳 304）"""
     try:
+        cached = not_modified(request, response, scope=BOOT_ID)
+        if cached is not None:
+            return cached
         return list(chat_histories.values())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取歷史記錄失敗: {str(e)}")
@@ -75,6 +81,7 @@ async def create_chat_history(request: CreateHistoryRequest):
         )
 
         chat_histories[chat_id] = new_chat
+        bump_data_version()
         print(f"對話記錄創建成功: {chat_id}")
         return new_chat
     except Exception as e:
@@ -89,6 +96,7 @@ async def delete_chat_history(chat_id: str):
         if chat_id not in chat_histories:
             raise HTTPException(status_code=404, detail="找不到指定的對話記錄")
         del chat_histories[chat_id]
+        bump_data_version()
         return {"status": "success", "message": "對話記錄已刪除"}
     except HTTPException as he:
         raise he
@@ -101,6 +109,7 @@ async def clear_history():
     """清空所有對話記錄"""
     try:
         chat_histories.clear()
+        bump_data_version()
         return {"status": "success", "message": "所有對話記錄已清空"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清空對話記錄失敗: {str(e)}")
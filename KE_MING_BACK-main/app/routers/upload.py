@@ -1,4 +1,6 @@
-import glob
+import asyncio
+import hashlib
+import json
 import os
 import shutil
 import time
@@ -6,103 +8,256 @@ import uuid
 from typing import Dict, Optional, List, Any
 from datetime import datetime
 
-from app.rag.document import process_document, remove_document
-from app.utils.vector_store import get_vector_store, reset_vector_store
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from app.rag.document import (
+    EXTRACTION_METHODS,
+    SUPPORTED_EXTENSIONS,
+    delete_document,
+    get_source_chunk_ids,
+    process_document,
+    remove_document,
+)
+from app.rag.ingest import ingest_files, new_ingest_job, scan_folder
+from app.rag.migration import cutover, migrate_embeddings, new_migration_job
+from app.rag.rebuild import new_rebuild_job, rebuild_index
+from app.utils import file_registry
+from app.utils.data_version import not_modified
+from app.utils.embedding_cache import get_embedding_cache_stats
+from app.utils.image_store import discard_staged_images, release_source_images
+from app.utils.product_store import release_source_products
+from app.utils.vector_snapshot import export_snapshot, import_snapshot
+from app.utils.vector_store import (
+    BASE_PATH,
+    create_namespace,
+    get_chunk_stats,
+    get_vector_store,
+    list_namespaces,
+    page_chunk_ids,
+    previous_generation,
+    reset_vector_store,
+    rollback_generation,
+    set_search_ef,
+    validate_namespace,
+    writable_store,
+)
+from fastapi import APIRouter, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
 router = APIRouter(prefix="/api", tags=["upload"])
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# 檔案列表每頁上限
+FILE_PAGE_MAX = 1000
 
-# 保存上傳文件的映射關係
-file_mappings: Dict[str, str] = {}  # 顯示名稱 -> 實際文件名
+# 上傳文件的顯示名稱、命名空間與處理狀態記錄在持久化的文件登記表（file_registry）
+
+
+class HnswConfig(BaseModel):
+    # 距離函數 l2 / cosine / ip，與 M、construction_ef 一樣只能在建立時指定
+    space: Optional[str] = None
+    M: Optional[int] = None
+    construction_ef: Optional[int] = None
+    # 查詢時的候選數，可隨時調整
+    search_ef: Optional[int] = None
+
+
+class NamespaceRequest(BaseModel):
+    namespace: str
+    hnsw: Optional[HnswConfig] = None
+
+
+class SearchEfRequest(BaseModel):
+    search_ef: int
+
+
+class EmbeddingMigrationRequest(BaseModel):
+    model: str
+    # text-embedding-3 系列可截短的向量維度，未指定時使用模型原生維度
+    dimensions: Optional[int] = None
+    # 雙讀比對期秒數，0 表示不比對直接切換
+    dual_read_seconds: int = 0
+    # False 時完成後等待手動呼叫 cutover
+    auto_cutover: bool = True
+
+
+def namespace_files(namespace: str) -> Dict[str, str]:
+    """命名空間中的文件：顯示名稱 -> 實際文件名"""
+    return file_registry.namespace_files(namespace)
+
+
+def _stage_file(namespace: str, display_name: str, extension: str):
+    """決定實際文件名：同名文件重新上傳時沿用原本的文件名（讓向量庫只更新有變動的 chunk）並先備份
+
+    回傳 (實際路徑, 原本的登記紀錄或 None)。
+    """
+    upload_dir = os.path.join(os.getcwd(), "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    previous = file_registry.find_file(namespace, display_name)
+    if previous and os.path.exists(os.path.join(upload_dir, previous["stored_name"])):
+        file_path = os.path.join(upload_dir, previous["stored_name"])
+        shutil.copy2(file_path, f"{file_path}.bak")
+        return file_path, previous
+    if previous:
+        file_registry.remove_file(previous["stored_name"])
+    return os.path.join(upload_dir, f"{uuid.uuid4()}{extension}"), None
+
+
+def _register_file(file_path: str, display_name: str, namespace: str):
+    """寫入向量庫前先登記為 processing"""
+    file_registry.begin_processing(
+        os.path.basename(file_path), display_name, namespace,
+        file_registry.file_hash(file_path), os.path.getsize(file_path), file_registry.page_count(file_path),
+    )
+
+
+def _commit_file(file_path: str, namespace: str, chunks: Optional[int] = None):
+    """向量庫寫入完成：記錄 chunk 數並設為 indexed，刪除備份"""
+    if chunks is None:
+        chunks = len(get_source_chunk_ids(get_vector_store(namespace=namespace), file_path))
+    file_registry.finish_processing(os.path.basename(file_path), chunks)
+    if os.path.exists(f"{file_path}.bak"):
+        os.remove(f"{file_path}.bak")
+
+
+def _rollback_file(file_path: str, previous: Optional[Dict]):
+    """處理失敗：重新上傳時還原舊版本文件與紀錄，新文件則連同紀錄一併移除"""
+    discard_staged_images(file_path)
+    if previous:
+        os.replace(f"{file_path}.bak", file_path)
+        file_registry.restore_file(previous)
+        return
+    with writable_store(sources=[file_path]):
+        release_source_images(file_path)
+        release_source_products(file_path)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    file_registry.remove_file(os.path.basename(file_path))
+
+
+def recover_file_registry():
+    """啟動時收尾上次中斷的處理與刪除，並登記舊版留在上傳目錄中的文件"""
+    if file_registry.needs_legacy_import():
+        # 舊版只有預設命名空間，chunk 數以向量庫的統計為準
+        chunk_counts = {item["filename"]: item["chunks"] for item in get_chunk_stats()["file_stats"]}
+        file_registry.import_legacy_uploads(UPLOAD_DIR, SUPPORTED_EXTENSIONS, chunk_counts)
+    for record in file_registry.interrupted_files():
+        # 向量庫中的 source 為絕對路徑
+        file_path = os.path.join(os.getcwd(), UPLOAD_DIR, record["stored_name"])
+        if record["status"] == file_registry.STATUS_DELETING:
+            delete_document(file_path, namespace=record["namespace"])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            file_registry.remove_file(record["stored_name"])
+            print(f"已完成中斷的刪除: {record['display_name']}")
+        else:
+            if os.path.exists(f"{file_path}.bak"):
+                os.replace(f"{file_path}.bak", file_path)
+            file_registry.mark_failed(record["stored_name"], "處理過程中服務中斷，請重新上傳")
+            print(f"文件處理中斷，已標記為失敗: {record['display_name']}")
+
+
+def _parse_namespace(namespace: Optional[str]) -> str:
+    try:
+        return validate_namespace(namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(
+    file: UploadFile = File(...),
+    extraction_method: str = Form("gpt4o"),
+    namespace: Optional[str] = Form(None),
+):
     """
-    上傳 PDF 文件並使用 GPT-4o 進行處理
+    上傳文件（PDF、TXT、DOCX、JSON）並進行處理
+
+    extraction_method: PDF 的提取方式，gpt4o（預設，GPT-4o）或 tesseract（本地 OCR）
+    namespace: 寫入的命名空間（品牌/客戶），未指定時使用預設命名空間
     """
     try:
         # 驗證文件類型
         file_extension = os.path.splitext(file.filename)[1].lower()
-        if file_extension != ".pdf":
-            raise HTTPException(status_code=400, detail="只支持 PDF 文件，請上傳 PDF 格式的文件")
-
-        # 創建上傳目錄
-        upload_dir = os.path.join(os.getcwd(), "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支持的文件格式，請上傳 {', '.join(sorted(SUPPORTED_EXTENSIONS))} 文件",
+            )
+
+        if extraction_method not in EXTRACTION_METHODS:
+            raise HTTPException(status_code=400, detail=f"不支持的提取方式: {extraction_method}")
+        namespace = _parse_namespace(namespace)
+        contents = await file.read()
 
-        # 生成唯一文件名
-        new_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, new_filename)
+        # 內容未變更的重新上傳不需再解析（PDF 解析需呼叫 GPT-4o，耗時且有費用）
+        previous = file_registry.find_file(namespace, file.filename)
+        if (previous and previous["status"] == file_registry.STATUS_INDEXED
+                and previous["hash"] == hashlib.sha256(contents).hexdigest()):
+            return {
+                "status": "success",
+                "filename": file.filename,
+                "namespace": namespace,
+                "extraction_method": extraction_method,
+                "message": "文件內容未變更，沿用現有索引",
+            }
 
-        # 保存文件
-        contents = await file.read()
+        # 覆蓋舊版本前先備份以便失敗時還原
+        file_path, previous = _stage_file(namespace, file.filename, file_extension)
         with open(file_path, "wb") as f:
             f.write(contents)
-
-        # 保存文件映射關係
-        file_mappings[file.filename] = new_filename
+        # 先登記為處理中再寫入向量庫，服務中斷時啟動可據此收尾
+        _register_file(file_path, file.filename, namespace)
 
         # 處理文件並添加到向量數據庫
         print(f"開始處理文件: {file_path}")
-        success = await process_document(file_path)
+        success = await process_document(
+            file_path, extraction_method=extraction_method, namespace=namespace
+        )
 
         if not success:
-            # 如果處理失敗，清理文件
-            os.remove(file_path)
-            del file_mappings[file.filename]
+            # 還原時可能等待寫入鎖（重建或遷移切換中），放到執行緒中避免卡住事件迴圈
+            await asyncio.to_thread(_rollback_file, file_path, previous)
             raise HTTPException(status_code=500, detail="文件處理失敗")
 
+        await asyncio.to_thread(_commit_file, file_path, namespace)
         print(f"文件處理完成: {file_path}")
         return {
             "status": "success",
             "filename": file.filename,
-            "message": "文件已上傳並使用 GPT-4o 處理完成"
+            "namespace": namespace,
+            "extraction_method": extraction_method,
+            "message": f"文件已上傳並使用 {extraction_method} 處理完成"
         }
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
         print(f"上傳文件時出錯: {str(e)}")
         raise HTTPException(status_code=500, detail=f"上傳失敗: {str(e)}")
 
 
 @router.delete("/files/{filename}")
-async def delete_file(filename: str):
-    """刪除文件"""
+async def delete_file(filename: str, namespace: Optional[str] = None):
+    """刪除文件（可用實際文件名，或以顯示名稱加上 namespace 指定）"""
     try:
-        # 首先檢查是否直接在uploads目錄中存在這個文件
-        file_path = os.path.join(os.getcwd(), "uploads", filename)
+        namespace = _parse_namespace(namespace)
+        record = file_registry.get_file(filename) or file_registry.find_file(namespace, filename)
+        file_path = os.path.join(os.getcwd(), "uploads", record["stored_name"] if record else filename)
+        if record is None and not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="找不到指定的文件")
+
+        if record is not None:
+            # 先標記刪除中再移除向量，服務中斷時啟動可據此完成刪除
+            file_registry.mark_deleting(record["stored_name"])
+            namespace = record["namespace"]
+        await remove_document(file_path, namespace=namespace)
         if os.path.exists(file_path):
-            # 從向量數據庫中移除文件
-            await remove_document(file_path)
-            # 刪除實際文件
             os.remove(file_path)
-            # 如果在映射中存在，也要移除
-            for display_name, actual_name in list(file_mappings.items()):
-                if actual_name == filename:
-                    del file_mappings[display_name]
-                    break
-            return {"status": "success", "message": "文件已刪除"}
-            
-        # 如果不是直接的UUID文件名，再嘗試從映射中查找
-        if filename in file_mappings:
-            actual_filename = file_mappings[filename]
-            file_path = os.path.join(os.getcwd(), "uploads", actual_filename)
-            
-            # 從向量數據庫中移除文件
-            await remove_document(file_path)
-            
-            # 刪除實際文件
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                
-            # 移除映射關係
-            del file_mappings[filename]
-            return {"status": "success", "message": "文件已刪除"}
-        else:
-            raise HTTPException(status_code=404, detail="找不到指定的文件")
+        if record is not None:
+            file_registry.remove_file(record["stored_name"])
+        return {"status": "success", "message": "文件已刪除"}
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -113,20 +268,23 @@ async def delete_file(filename: str):
 @router.delete("/files/clear")
 async def clear_all_files():
     """清空所有文件"""
+    running = _running_generation_job()
+    if running:
+        raise HTTPException(status_code=409, detail=f"重建或遷移任務進行中，請稍後再清空: {running}")
     try:
-        # 清空向量數據庫
-        vector_store = get_vector_store()
-        vector_store.delete(where={})  # 刪除所有文檔
+        # 切換到新的空索引世代（保留各命名空間與其 HNSW 參數），舊世代的圖片引用與產品資料隨之刪除
+        await asyncio.to_thread(reset_vector_store, True)
 
         # 刪除所有實際文件
         upload_dir = os.path.join(os.getcwd(), "uploads")
         for filename in os.listdir(upload_dir):
             file_path = os.path.join(upload_dir, filename)
             if os.path.isfile(file_path):
+                discard_staged_images(file_path)
                 os.remove(file_path)
 
-        # 清空文件映射
-        file_mappings.clear()
+        # 清空文件登記
+        file_registry.clear_files()
 
         return {"status": "success", "message": "所有文件已清空"}
     except Exception as e:
@@ -136,51 +294,15 @@ async def clear_all_files():
 @router.delete("/vector-store/clear")
 async def clear_vector_store():
     """徹底清空向量知識庫"""
+    running = _running_generation_job()
+    if running:
+        raise HTTPException(status_code=409, detail=f"重建或遷移任務進行中，請稍後再清空: {running}")
     try:
-        # 1. 關閉現有連接
-        reset_vector_store()
-
-        # 2. 清除文件
-        render_data_dir = os.path.join(os.getcwd(), ".render", "data")
-        vector_dir = os.path.join(render_data_dir, "chroma_new")
-        if os.path.exists(vector_dir):
-            # 確保所有文件句柄都已釋放
-            time.sleep(1)
+        # 1. 切換到新的空索引世代，舊目錄在背景刪除
+        await asyncio.to_thread(reset_vector_store)
 
-            try:
-                # 直接使用 shutil.rmtree 清除整個目錄
-                shutil.rmtree(vector_dir, ignore_errors=True)
-                os.makedirs(vector_dir, exist_ok=True)
-                os.chmod(vector_dir, 0o777)
-                print("已清空向量庫目錄")
-            except Exception as e:
-                print(f"清除目錄時出錯: {str(e)}")
-                # 如果直接刪除失敗，嘗試逐個刪除
-                for root, dirs, files in os.walk(vector_dir, topdown=False):
-                    for name in files:
-                        try:
-                            os.remove(os.path.join(root, name))
-                        except Exception as e:
-                            print(f"刪除文件失敗: {str(e)}")
-                    for name in dirs:
-                        try:
-                            os.rmdir(os.path.join(root, name))
-                        except Exception as e:
-                            print(f"刪除目錄失敗: {str(e)}")
-
-        # 確保創建目錄並設置權限
-        os.makedirs(vector_dir, exist_ok=True)
-        try:
-            os.chmod(render_data_dir, 0o777)
-            os.chmod(vector_dir, 0o777)
-        except Exception as e:
-            print(f"設置權限時出錯: {str(e)}")
-
-        # 3. 清空文件映射
-        file_mappings.clear()
-
-        # 4. 強制重新初始化向量庫
-        get_vector_store(force_new=True)
+        # 2. 清空文件登記
+        file_registry.clear_files()
 
         return {
             "status": "success",
@@ -192,163 +314,500 @@ async def clear_vector_store():
         raise HTTPException(status_code=500, detail=f"清空向量知識庫失敗: {str(e)}")
 
 
+# 資料夾匯入的進度紀錄: job_id -> 進度
+folder_jobs: Dict[str, Dict[str, Any]] = {}
+
+
+def _finish_folder_job(job: Dict[str, Any], namespace: str, previous: Dict[str, Optional[Dict]]):
+    """登記匯入完成的文件，清理（或還原）匯入失敗的文件"""
+    for dest_path, entry in job["files"].items():
+        try:
+            if entry["status"] == "indexed":
+                _commit_file(dest_path, namespace, entry["chunks"])
+            else:
+                _rollback_file(dest_path, previous.get(dest_path))
+        except Exception as e:
+            print(f"整理匯入文件 {dest_path} 時出錯: {str(e)}")
+
+
+def _folder_job_summary(job_id: str, job: Dict[str, Any], extraction_method: str) -> Dict[str, Any]:
+    processed_files = [e["name"] for e in job["files"].values() if e["status"] == "indexed"]
+    failed_files = [e["name"] for e in job["files"].values() if e["status"] == "failed"]
+    return {
+        "status": "success",
+        "job_id": job_id,
+        "job_status": job["status"],
+        "processed_files": processed_files,
+        "failed_files": failed_files,
+        "message": f"成功處理 {len(processed_files)} 個文件，失敗 {len(failed_files)} 個",
+        "extraction_method": extraction_method,
+    }
+
+
 @router.post("/upload/folder")
-async def upload_folder(folder_path: str, use_openai_ocr: bool = False):
-    """上傳本地資料夾中的所有支持的文件
+async def upload_folder(
+    folder_path: str,
+    extraction_method: str = "gpt4o",
+    use_openai_ocr: Optional[bool] = None,
+    wait: bool = True,
+    namespace: Optional[str] = None,
+):
+    """上傳本地資料夾中的所有支持的文件（PDF、TXT、DOCX、JSON）
     
     Args:
         folder_path: 本地資料夾路徑
-        use_openai_ocr: 是否使用 OpenAI Vision API 進行 OCR 處理 PDF
+        extraction_method: PDF 的提取方式，gpt4o 或 tesseract
+        use_openai_ocr: 舊參數，True 等同 gpt4o，False 等同 tesseract
+        wait: 是否等待全部處理完成；False 時立即回傳 job_id，可查詢進度
+        namespace: 寫入的命名空間，未指定時使用預設命名空間
     """
     try:
         if not folder_path or not os.path.exists(folder_path):
             raise HTTPException(status_code=400, detail="請提供有效的資料夾路徑")
 
-        # 支持的文件類型
-        supported_extensions = [".txt", ".pdf", ".docx"]
+        if use_openai_ocr is not None:
+            extraction_method = "gpt4o" if use_openai_ocr else "tesseract"
+        if extraction_method not in EXTRACTION_METHODS:
+            raise HTTPException(status_code=400, detail=f"不支持的提取方式: {extraction_method}")
+        namespace = _parse_namespace(namespace)
 
-        # 遞歸搜索所有支持的文件
-        all_files = []
-        for ext in supported_extensions:
-            files = glob.glob(os.path.join(folder_path, f"**/*{ext}"), recursive=True)
-            all_files.extend(files)
+        # 單次遍歷找出所有支持的文件
+        all_files = scan_folder(folder_path)
 
         if not all_files:
             raise HTTPException(status_code=400, detail="資料夾中沒有找到支持的文件")
 
-        # 處理每個文件
-        processed_files = []
-        failed_files = []
-
+        # 複製文件到上傳目錄並登記為處理中（同名文件沿用原本的文件名）
+        copied_files = []
+        previous: Dict[str, Optional[Dict]] = {}
         for file_path in all_files:
+            file_name = os.path.basename(file_path)
+            dest_path, previous[dest_path] = _stage_file(
+                namespace, file_name, os.path.splitext(file_name)[1].lower()
+            )
+            shutil.copy2(file_path, dest_path)
+            _register_file(dest_path, file_name, namespace)
+            copied_files.append((dest_path, file_name))
+
+        job_id = str(uuid.uuid4())
+        job = new_ingest_job(copied_files)
+        folder_jobs[job_id] = job
+
+        async def run_job():
             try:
-                # 複製文件到上傳目錄
-                file_name = os.path.basename(file_path)
-                new_filename = f"{uuid.uuid4()}{os.path.splitext(file_name)[1]}"
-                dest_path = os.path.join(os.getcwd(), "uploads", new_filename)
-
-                # 複製文件
-                import shutil
+                await ingest_files(job, extraction_method=extraction_method, namespace=namespace)
+            except Exception as e:
+                print(f"資料夾匯入 {job_id} 出錯: {str(e)}")
+                job["status"] = "failed"
+                job["error"] = str(e)
+            finally:
+                await asyncio.to_thread(_finish_folder_job, job, namespace, previous)
+
+        if not wait:
+            asyncio.create_task(run_job())
+            return {
+                "status": "accepted",
+                "job_id": job_id,
+                "total": job["total"],
+                "message": f"已開始處理 {job['total']} 個文件，可透過 /api/upload/folder/{job_id} 查詢進度",
+            }
 
-                shutil.copy2(file_path, dest_path)
+        await run_job()
+        return _folder_job_summary(job_id, job, extraction_method)
 
-                # 保存文件映射
-                file_mappings[file_name] = new_filename
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"處理資料夾時出錯: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"處理資料夾失敗: {str(e)}")
 
-                # 確定是否使用 OpenAI OCR
-                current_use_openai_ocr = use_openai_ocr
-                # 只對 PDF 文件使用 OpenAI OCR
-                is_pdf = os.path.splitext(file_name)[1].lower() == ".pdf"
-                if current_use_openai_ocr and not is_pdf:
-                    current_use_openai_ocr = False
 
-                # 處理文件
-                success = await process_document(dest_path, use_openai_ocr=current_use_openai_ocr)
+@router.get("/upload/folder/{job_id}")
+async def get_folder_job(job_id: str):
+    """查詢資料夾匯入進度"""
+    job = folder_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到指定的匯入任務")
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "elapsed_seconds": round((job["finished_at"] or time.time()) - job["started_at"], 2),
+        "files": list(job["files"].values()),
+    }
+
+
+@router.get("/namespaces")
+async def get_namespaces():
+    """列出所有命名空間"""
+    try:
+        return {"status": "success", "namespaces": list_namespaces()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取命名空間失敗: {str(e)}")
 
-                if success:
-                    processed_files.append(file_name)
-                else:
-                    failed_files.append(file_name)
-                    # 清理失敗的文件
-                    os.remove(dest_path)
-                    del file_mappings[file_name]
 
-            except Exception as e:
-                print(f"處理文件 {file_path} 時出錯: {str(e)}")
-                failed_files.append(file_name)
+@router.post("/namespaces")
+async def create_namespace_endpoint(request: NamespaceRequest):
+    """建立命名空間並指定 HNSW 參數（已存在時只能調整 search_ef）"""
+    namespace = _parse_namespace(request.namespace)
+    try:
+        hnsw = await asyncio.to_thread(
+            create_namespace, namespace, request.hnsw.model_dump() if request.hnsw else None
+        )
+        return {"status": "success", "namespace": namespace, "hnsw": hnsw}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"建立命名空間失敗: {str(e)}")
 
-        return {
-            "status": "success",
-            "processed_files": processed_files,
-            "failed_files": failed_files,
-            "message": f"成功處理 {len(processed_files)} 個文件，失敗 {len(failed_files)} 個",
-            "ocr_method": "OpenAI Vision" if use_openai_ocr else "傳統 OCR (僅 PDF)"
-        }
 
+@router.patch("/namespaces/{namespace}/hnsw")
+async def update_namespace_search_ef(namespace: str, request: SearchEfRequest):
+    """調整命名空間查詢時的 search_ef"""
+    namespace = _parse_namespace(namespace)
+    try:
+        return {"status": "success", "namespace": namespace, "hnsw": set_search_ef(namespace, request.search_ef)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"處理資料夾時出錯: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"處理資料夾失敗: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"調整 search_ef 失敗: {str(e)}")
 
 
 @router.get("/vector-store/stats")
-async def get_vector_store_stats():
-    """獲取向量知識庫統計信息和內容"""
+async def get_vector_store_stats(request: Request, response: Response, namespace: Optional[str] = None):
+    """獲取向量知識庫統計信息（寫入時即時累計，不讀取 chunk 內容；內容請用 /api/vector-store/chunks 分頁瀏覽）
+
+    支援 If-None-Match / If-Modified-Since，資料未變動時回傳 304。
+    """
+    namespace = _parse_namespace(namespace)
+    cached = not_modified(request, response)
+    if cached is not None:
+        return cached
     try:
-        vector_store = get_vector_store()
-        
-        # 獲取所有文檔
-        results = vector_store.get()
-        
-        if not results or not results['documents']:
-            return {
-                "status": "success",
-                "message": "向量庫是空的",
-                "total_chunks": 0,
-                "unique_files": 0,
-                "files": [],
-                "chunks": [],
-                "is_empty": True
-            }
-            
-        # 獲取所有文檔內容和元數據
-        documents = results['documents']
-        metadatas = results['metadatas']
-        
-        # 整理文件統計
-        file_stats = {}
-        chunks_content = []
-        
-        for doc, meta in zip(documents, metadatas):
-            filename = meta.get('filename', 'unknown')
-            if filename not in file_stats:
-                file_stats[filename] = 0
-            file_stats[filename] += 1
-            
-            # 添加chunk內容
-            chunks_content.append({
-                "content": doc,
-                "metadata": meta
-            })
-        
+        stats = await asyncio.to_thread(get_chunk_stats, namespace)
         return {
             "status": "success",
-            "total_chunks": len(documents),
-            "unique_files": len(file_stats),
-            "files": file_stats,
-            "chunks": chunks_content,
-            "is_empty": False
+            "message": "向量庫是空的" if not stats["chunks"] else None,
+            "total_chunks": stats["chunks"],
+            "unique_files": stats["files"],
+            "bytes": stats["bytes"],
+            "last_updated": stats["updated_at"],
+            "files": stats["file_stats"],
+            "is_empty": not stats["chunks"],
         }
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取統計信息失敗: {str(e)}")
 
 
+# 瀏覽 chunk 時每頁上限，以及每次向向量庫取內容的筆數
+CHUNK_PAGE_MAX = 1000
+CHUNK_FETCH_BATCH = 100
+
+
+@router.get("/vector-store/chunks")
+async def browse_chunks(
+    namespace: Optional[str] = None,
+    file: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+):
+    """
+    依 chunk ID 順序分頁瀏覽內容，結果以串流輸出
+
+    file: 只列出指定文件（顯示名稱）的 chunk
+    cursor: 上一頁回傳的 next_cursor，未指定時從頭開始；next_cursor 為 null 表示已到最後一頁
+    """
+    namespace = _parse_namespace(namespace)
+    if not 1 <= limit <= CHUNK_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit 必須在 1 到 {CHUNK_PAGE_MAX} 之間")
+    try:
+        ids = await asyncio.to_thread(page_chunk_ids, namespace, file, cursor, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"瀏覽 chunk 失敗: {str(e)}")
+    next_cursor = ids[-1] if len(ids) == limit else None
+    vector_store = get_vector_store(namespace=namespace)
+
+    def stream():
+        yield '{"status": "success", "chunks": ['
+        separator = ""
+        for start in range(0, len(ids), CHUNK_FETCH_BATCH):
+            batch = ids[start:start + CHUNK_FETCH_BATCH]
+            results = vector_store.get(ids=batch, include=["documents", "metadatas"])
+            found = {
+                chunk_id: (document, metadata)
+                for chunk_id, document, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+            }
+            items = [
+                json.dumps({"id": chunk_id, "content": found[chunk_id][0], "metadata": found[chunk_id][1]},
+                           ensure_ascii=False)
+                for chunk_id in batch if chunk_id in found
+            ]
+            if items:
+                yield separator + ",".join(items)
+                separator = ","
+        yield f'], "next_cursor": {json.dumps(next_cursor, ensure_ascii=False)}}}'
+
+    return StreamingResponse(stream(), media_type="application/json")
+
+
+@router.get("/embedding-cache/stats")
+async def embedding_cache_stats():
+    """獲取嵌入快取的命中率與容量"""
+    try:
+        return {"status": "success", **get_embedding_cache_stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取嵌入快取統計失敗: {str(e)}")
+
+
+# 索引重建的進度紀錄: job_id -> 進度
+rebuild_jobs: Dict[str, Dict[str, Any]] = {}
+
+
+def _upload_sources() -> Dict[str, str]:
+    """登記表中所有可索引的文件: 實際路徑 -> 命名空間"""
+    upload_dir = os.path.join(os.getcwd(), "uploads")
+    return {
+        os.path.join(upload_dir, stored_name): namespace
+        for stored_name, namespace in file_registry.source_namespaces().items()
+        if os.path.isfile(os.path.join(upload_dir, stored_name))
+    }
+
+
+def _running_generation_job() -> Optional[str]:
+    """進行中的重建、嵌入模型遷移或快照匯入（都會切換索引世代，同一時間只允許一個）"""
+    for job_id, job in {**rebuild_jobs, **migration_jobs, **import_jobs}.items():
+        if job["status"] in ("pending", "running", "ready", "dual_read"):
+            return job_id
+    return None
+
+
+def _rebuild_job_summary(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "reextract": job["reextract"],
+        "generation": job["generation"],
+        "previous_generation": job["previous_generation"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "error": job["error"],
+        "elapsed_seconds": round((job["finished_at"] or time.time()) - job["started_at"], 2),
+    }
+
+
+@router.post("/vector-store/rebuild")
+async def rebuild_vector_store(
+    extraction_method: str = Form("gpt4o"),
+    reextract: bool = Form(False),
+):
+    """
+    在背景建立新的索引世代並於完成後原子切換，重建期間照常服務
+
+    reextract: 為 True 時重新解析所有上傳的原始文件；預設沿用現有 chunk（向量由嵌入快取取得）
+    extraction_method: 需要重新解析 PDF 時使用的提取方式
+    """
+    if extraction_method not in EXTRACTION_METHODS:
+        raise HTTPException(status_code=400, detail=f"不支持的提取方式: {extraction_method}")
+    running = _running_generation_job()
+    if running:
+        raise HTTPException(status_code=409, detail=f"已有重建任務進行中: {running}")
+
+    job_id = str(uuid.uuid4())
+    job = new_rebuild_job(_upload_sources(), reextract=reextract)
+    rebuild_jobs[job_id] = job
+    asyncio.create_task(rebuild_index(job, _upload_sources, extraction_method=extraction_method))
+    return {
+        "status": "accepted",
+        "job_id": job_id,
+        "total": job["total"],
+        "message": f"已開始重建 {job['total']} 個文件的索引，可透過 /api/vector-store/rebuild/{job_id} 查詢進度",
+    }
+
+
+@router.get("/vector-store/rebuild/{job_id}")
+async def get_rebuild_job(job_id: str):
+    """查詢索引重建進度"""
+    job = rebuild_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到指定的重建任務")
+    return _rebuild_job_summary(job_id, job)
+
+
+@router.post("/vector-store/rollback")
+async def rollback_vector_store():
+    """切回重建前的索引世代（再呼叫一次可切回來）"""
+    try:
+        generation = await asyncio.to_thread(rollback_generation)
+        return {"status": "success", "generation": generation, "previous_generation": previous_generation()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"回滾失敗: {str(e)}")
+
+
 @router.post("/vector-store/hard-reset")
-async def hard_reset_vector_store():
-    """徹底重置向量庫（需要重啟服務）"""
+async def hard_reset_vector_store(
+    extraction_method: str = Form("gpt4o"),
+    reextract: bool = Form(False),
+):
+    """
+    徹底重建向量庫：在背景建立新索引，完成後切換，不需重啟服務
+
+    reextract: 為 True 時從上傳的原始文件重新解析（會再次呼叫 GPT-4o 等付費 API）；
+    預設沿用現有 chunk，只重建索引
+    """
+    return await rebuild_vector_store(extraction_method=extraction_method, reextract=reextract)
+
+
+# 嵌入模型遷移的進度紀錄: job_id -> 進度
+migration_jobs: Dict[str, Dict[str, Any]] = {}
+
+
+def _migration_job_summary(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "from": job["from"],
+        "to": {"model": job["model"], "dimensions": job["dimensions"]},
+        "generation": job["generation"],
+        "previous_generation": job["previous_generation"],
+        "total": job["total"],
+        "migrated": job["migrated"],
+        "coverage": round(job["coverage"], 4),
+        "namespaces": job["namespaces"],
+        "dual_read": {
+            "until": job["dual_read_until"],
+            "comparisons": job["comparisons"],
+            "mean_overlap": round(job["overlap_sum"] / job["comparisons"], 4) if job["comparisons"] else None,
+            "min_overlap": job["min_overlap"],
+        },
+        "error": job["error"],
+        "elapsed_seconds": round((job["finished_at"] or time.time()) - job["started_at"], 2),
+    }
+
+
+@router.post("/vector-store/embedding-migration")
+async def start_embedding_migration(request: EmbeddingMigrationRequest):
+    """
+    在背景以新的嵌入模型重新嵌入所有 chunk 到影子索引世代，完成後切換，遷移期間照常服務
+
+    進度中的 coverage 為影子索引已涵蓋的 chunk 比例，達 100% 才會切換；
+    切換後原本的世代保留，可用 /api/vector-store/rollback 回滾。
+    """
+    running = _running_generation_job()
+    if running:
+        raise HTTPException(status_code=409, detail=f"已有重建或遷移任務進行中: {running}")
+    if request.dual_read_seconds < 0:
+        raise HTTPException(status_code=400, detail="dual_read_seconds 不可為負數")
+
+    job_id = str(uuid.uuid4())
+    job = new_migration_job(
+        request.model, request.dimensions,
+        dual_read_seconds=request.dual_read_seconds, auto_cutover=request.auto_cutover,
+    )
+    migration_jobs[job_id] = job
+    asyncio.create_task(migrate_embeddings(job))
+    return {
+        "status": "accepted",
+        "job_id": job_id,
+        "message": f"已開始遷移到嵌入模型 {request.model}，可透過 /api/vector-store/embedding-migration/{job_id} 查詢進度",
+    }
+
+
+@router.get("/vector-store/embedding-migration/{job_id}")
+async def get_embedding_migration(job_id: str):
+    """查詢嵌入模型遷移進度與雙讀比對結果"""
+    job = migration_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到指定的遷移任務")
+    return _migration_job_summary(job_id, job)
+
+
+@router.post("/vector-store/embedding-migration/{job_id}/cutover")
+async def cutover_embedding_migration(job_id: str):
+    """手動切換到新嵌入模型的索引世代（須先完成重新嵌入）"""
+    job = migration_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到指定的遷移任務")
     try:
-        # 關閉當前所有連接
-        reset_vector_store()
+        await asyncio.to_thread(cutover, job)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _migration_job_summary(job_id, job)
 
-        # 寫入一個信號文件
-        with open("RESET_DB", "w") as f:
-            f.write(str(time.time()))
 
-        # 返回需要重啟的提示
-        return {
-            "status": "success",
-            "message": "已標記知識庫需要重置，請重啟服務以完成重置",
-        }
+# 快照匯出匯入的暫存目錄（與索引放在同一個持久化磁碟，避免 /tmp 空間不足）
+SNAPSHOT_DIR = os.path.join(BASE_PATH, "snapshots")
+# 快照匯入的紀錄: job_id -> 狀態，匯入期間不可開始重建或遷移
+import_jobs: Dict[str, Dict[str, Any]] = {}
+
+
+@router.get("/vector-store/export")
+async def export_vector_store(namespace: Optional[str] = None):
+    """
+    匯出使用中的索引（ids、內容、metadata、向量）為單一 zstd 壓縮快照，可用於複製環境與災難復原
+
+    namespace: 只匯出指定的命名空間，未指定時匯出全部
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    filename = f"vector_store_{datetime.now().strftime('%Y%m%d%H%M%S')}.kmvs.zst"
+    path = os.path.join(SNAPSHOT_DIR, f"{uuid.uuid4().hex}_{filename}")
+    namespaces = [_parse_namespace(namespace)] if namespace else None
+    try:
+        await asyncio.to_thread(export_snapshot, path, namespaces)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"重置標記失敗: {str(e)}")
+        if os.path.exists(path):
+            os.remove(path)
+        raise HTTPException(status_code=500, detail=f"匯出快照失敗: {str(e)}")
+    return FileResponse(
+        path, media_type="application/zstd", filename=filename, background=BackgroundTask(os.remove, path)
+    )
+
+
+@router.post("/vector-store/import")
+async def import_vector_store(file: UploadFile = File(...), activate: bool = Form(True)):
+    """
+    匯入快照到新的索引世代，直接寫入向量不需重新解析文件或呼叫嵌入 API
+
+    activate: 完成後是否切換到新世代（原世代保留，可用 /api/vector-store/rollback 回滾）
+    """
+    running = _running_generation_job()
+    if running:
+        raise HTTPException(status_code=409, detail=f"已有重建、遷移或匯入任務進行中: {running}")
+    # 檢查與登記之間沒有 await，其他請求不會插入
+    job_id = str(uuid.uuid4())
+    job = import_jobs[job_id] = {"status": "running", "started_at": time.time(), "finished_at": None}
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"import_{uuid.uuid4().hex}.kmvs.zst")
+    try:
+        # 分塊寫入磁碟，不把整個快照讀進記憶體
+        with open(path, "wb") as f:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, f, 8 * 1024 * 1024)
+        summary = await asyncio.to_thread(import_snapshot, path, activate)
+        job["status"] = "finished"
+        return {"status": "success", **summary}
+    except ValueError as e:
+        job["status"] = "failed"
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        job["status"] = "failed"
+        raise HTTPException(status_code=500, detail=f"匯入快照失敗: {str(e)}")
+    finally:
+        job["finished_at"] = time.time()
+        if os.path.exists(path):
+            os.remove(path)
 
 
 @router.post("/test/ocr")
 async def test_ocr(file: UploadFile = File(...), page_num: int = 0):
     """
-    測試 PaddleOCR 的中文識別功能
+    測試 Tesseract 的中文識別功能
     
-    上傳 PDF 文件並使用 PaddleOCR 對指定頁面進行 OCR 處理，但不將結果存入向量數據庫
+    上傳 PDF 文件並使用本地 Tesseract 對指定頁面進行 OCR 處理，但不將結果存入向量數據庫
     """
     try:
         # 驗證文件類型
@@ -371,10 +830,13 @@ async def test_ocr(file: UploadFile = File(...), page_num: int = 0):
                 f.write(contents)
             
             # 導入所需模組
-            from app.utils.paddle_ocr import PaddlePDFProcessor
+            from app.utils.tesseract_ocr import TesseractPDFProcessor, check_tesseract
+
+            # 確認 Tesseract 已安裝
+            tesseract_version = check_tesseract()
             
             # 創建處理器
-            processor = PaddlePDFProcessor(temp_file_path)
+            processor = TesseractPDFProcessor(temp_file_path)
             
             # 讀取 PDF，檢查頁數
             import fitz
@@ -393,8 +855,8 @@ async def test_ocr(file: UploadFile = File(...), page_num: int = 0):
             # 提取頁面圖像
             image = processor._extract_page_as_image(page)
             
-            # 使用 PaddleOCR 進行 OCR 處理
-            ocr_result = processor._ocr_with_paddle(image)
+            # 使用 Tesseract 進行 OCR 處理
+            ocr_result = await asyncio.to_thread(processor._ocr_with_tesseract, image)
             
             # 關閉 PDF
             pdf_document.close()
@@ -405,8 +867,8 @@ async def test_ocr(file: UploadFile = File(...), page_num: int = 0):
                 "page": page_num + 1,  # 顯示給用戶的頁碼從 1 開始
                 "total_pages": total_pages,
                 "ocr_result": ocr_result,
-                "ocr_method": "PaddleOCR",
-                "message": "PaddleOCR 測試完成"
+                "ocr_method": f"Tesseract {tesseract_version}",
+                "message": "Tesseract 測試完成"
             }
             
         finally:
@@ -414,8 +876,10 @@ async def test_ocr(file: UploadFile = File(...), page_num: int = 0):
             if os.path.exists(temp_file_path):
                 os.remove(temp_file_path)
             
+    except HTTPException as he:
+        raise he
     except Exception as e:
-        print(f"PaddleOCR 測試時出錯: {str(e)}")
+        print(f"Tesseract 測試時出錯: {str(e)}")
         import traceback
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"OCR 測試失敗: {str(e)}")
@@ -449,15 +913,16 @@ async def test_gpt_ocr(file: UploadFile = File(...)):
             # 導入所需模組
             from app.utils.gpt_processor import GPTDocumentProcessor
             
-            # 創建處理器並處理
+            # 創建處理器並處理（逐頁呼叫 GPT-4o，放到執行緒中避免卡住事件迴圈）
             processor = GPTDocumentProcessor(temp_file_path)
-            documents = processor.process()
+            documents = await asyncio.to_thread(processor.process)
             
             return {
                 "status": "success",
                 "filename": file.filename,
-                "content": documents[0].page_content if documents else "",
+                "content": "\n\n".join(doc.page_content for doc in documents),
                 "extraction_method": "gpt4o",
+                "report": processor.report,
                 "message": "GPT-4o 處理完成"
             }
             
@@ -474,34 +939,56 @@ async def test_gpt_ocr(file: UploadFile = File(...)):
 
 
 @router.get("/files", response_model=List[Dict[str, Any]])
-async def get_uploaded_files():
-    """獲取所有已上傳的檔案"""
+async def get_uploaded_files(
+    request: Request,
+    response: Response,
+    namespace: Optional[str] = None,
+    sort: str = "updated_at",
+    order: str = "desc",
+    offset: int = 0,
+    limit: Optional[int] = None,
+):
+    """
+    列出已上傳的檔案（讀取文件登記表，排序與分頁在資料庫中完成）
+
+    sort: updated_at / created_at / display_name / size / chunks / pages
+    order: desc 或 asc；limit 未指定時回傳全部，總筆數放在 X-Total-Count 回應標頭
+    index_status 為處理狀態（processing / indexed / failed / deleting）。
+    支援 If-None-Match / If-Modified-Since，資料未變動時回傳 304。
+    """
+    if namespace is not None:
+        namespace = _parse_namespace(namespace)
+    if sort not in file_registry.SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序欄位: {sort}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order 必須是 asc 或 desc")
+    if offset < 0 or (limit is not None and not 1 <= limit <= FILE_PAGE_MAX):
+        raise HTTPException(status_code=400, detail=f"offset 不可為負數，limit 必須在 1 到 {FILE_PAGE_MAX} 之間")
+    cached = not_modified(request, response)
+    if cached is not None:
+        return cached
     try:
-        files = []
-        for filename in os.listdir(UPLOAD_DIR):
-            # 獲取檔案路徑並確保是檔案而非目錄
-            file_path = os.path.join(UPLOAD_DIR, filename)
-            if os.path.isfile(file_path):
-                # 獲取檔案資訊
-                file_stats = os.stat(file_path)
-                
-                # 檢查文件是否在文件映射中
-                display_name = filename
-                for original_name, mapped_name in file_mappings.items():
-                    if mapped_name == filename:
-                        display_name = original_name
-                        break
-                
-                files.append({
-                    "name": filename,  # 使用UUID格式的實際文件名
-                    "display_name": display_name,  # 原始顯示名稱
-                    "size": file_stats.st_size,
-                    "lastModified": file_stats.st_mtime * 1000,  # 轉換為毫秒時間戳
-                    "uploadTime": datetime.fromtimestamp(file_stats.st_ctime).isoformat()
-                })
-        
-        # 根據修改時間排序，最新的在前面
-        files.sort(key=lambda x: x["lastModified"], reverse=True)
-        return files
+        records, total = await asyncio.to_thread(
+            file_registry.list_files, namespace, sort, order == "desc", offset, limit
+        )
+        response.headers["X-Total-Count"] = str(total)
+        return [
+            {
+                "name": record["stored_name"],  # 使用UUID格式的實際文件名
+                "display_name": record["display_name"],  # 原始顯示名稱
+                "namespace": record["namespace"],
+                "size": record["size"],
+                "hash": record["hash"],
+                "pages": record["pages"],
+                "chunks": record["chunks"],
+                # 前端以 status 欄位判斷上傳中的暫存項目，處理狀態改用 index_status
+                "index_status": record["status"],
+                "error": record["error"],
+                "lastModified": record["updated_at"] * 1000,  # 轉換為毫秒時間戳
+                "uploadTime": datetime.fromtimestamp(record["created_at"]).isoformat(),
+                "indexedTime": datetime.fromtimestamp(record["indexed_at"]).isoformat() if record["indexed_at"] else None,
+            }
+            for record in records
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取檔案列表失敗: {str(e)}")
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# 每個索引世代各自一份，隨世代切換與刪除
+CHUNK_STATS_FILE = "chunk_stats.sqlite3"
+
+
+@contextmanager
+def _connect(directory: str):
+    """開啟世代的 chunk 統計索引，離開時提交並關閉連線
+
+    chunks 每個 chunk 一列（不含內容），file_stats / namespace_stats 由觸發器隨 chunks 增刪即時累計，
+    統計查詢不需掃描 chunk。
+    """
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(directory, CHUNK_STATS_FILE), timeout=30)
+    conn.executescript(
+        "CREATE TABLE IF NOT EXISTS chunks ("
+        "namespace TEXT NOT NULL, id TEXT NOT NULL, filename TEXT NOT NULL, bytes INTEGER NOT NULL, "
+        "updated_at REAL NOT NULL, PRIMARY KEY (namespace, id));"
+        "CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks (namespace, filename, id);"
+        "CREATE TABLE IF NOT EXISTS file_stats ("
+        "namespace TEXT NOT NULL, filename TEXT NOT NULL, chunks INTEGER NOT NULL, bytes INTEGER NOT NULL, "
+        "updated_at REAL NOT NULL, PRIMARY KEY (namespace, filename));"
+        "CREATE TABLE IF NOT EXISTS namespace_stats ("
+        "namespace TEXT PRIMARY KEY, chunks INTEGER NOT NULL, bytes INTEGER NOT NULL, "
+        "files INTEGER NOT NULL, updated_at REAL NOT NULL);"
+        # 已完成初次統計的命名空間（舊索引第一次查詢統計時補算一次）
+        "CREATE TABLE IF NOT EXISTS tracked (namespace TEXT PRIMARY KEY);"
+        "CREATE TRIGGER IF NOT EXISTS chunk_added AFTER INSERT ON chunks BEGIN "
+        "  INSERT INTO namespace_stats (namespace, chunks, bytes, files, updated_at) "
+        "  VALUES (NEW.namespace, 1, NEW.bytes, 0, NEW.updated_at) "
+        "  ON CONFLICT (namespace) DO UPDATE SET chunks = chunks + 1, bytes = bytes + NEW.bytes, "
+        "  updated_at = NEW.updated_at; "
+        "  INSERT INTO file_stats (namespace, filename, chunks, bytes, updated_at) "
+        "  VALUES (NEW.namespace, NEW.filename, 1, NEW.bytes, NEW.updated_at) "
+        "  ON CONFLICT (namespace, filename) DO UPDATE SET chunks = chunks + 1, bytes = bytes + NEW.bytes, "
+        "  updated_at = NEW.updated_at; "
+        "END;"
+        "CREATE TRIGGER IF NOT EXISTS chunk_removed AFTER DELETE ON chunks BEGIN "
+        "  UPDATE namespace_stats SET chunks = chunks - 1, bytes = bytes - OLD.bytes, "
+        "  updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE namespace = OLD.namespace; "
+        "  UPDATE file_stats SET chunks = chunks - 1, bytes = bytes - OLD.bytes, "
+        "  updated_at = (julianday('now') - 2440587.5) * 86400.0 "
+        "  WHERE namespace = OLD.namespace AND filename = OLD.filename; "
+        "  DELETE FROM file_stats WHERE namespace = OLD.namespace AND filename = OLD.filename AND chunks <= 0; "
+        "END;"
+        "CREATE TRIGGER IF NOT EXISTS file_added AFTER INSERT ON file_stats BEGIN "
+        "  UPDATE namespace_stats SET files = files + 1 WHERE namespace = NEW.namespace; "
+        "END;"
+        "CREATE TRIGGER IF NOT EXISTS file_removed AFTER DELETE ON file_stats BEGIN "
+        "  UPDATE namespace_stats SET files = files - 1 WHERE namespace = OLD.namespace; "
+        "END;"
+    )
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def record_chunks(directory: str, namespace: str, ids: List[str], documents: Iterable[str],
+                  metadatas: Optional[Iterable[Dict]] = None):
+    """記錄寫入的 chunk；相同 ID 先移除舊紀錄（upsert），統計由觸發器累計"""
+    if not ids:
+        return
+    metadatas = metadatas if metadatas is not None else [None] * len(ids)
+    now = time.time()
+    rows = [
+        (namespace, chunk_id, (metadata or {}).get("filename", "unknown"), len((document or "").encode("utf-8")), now)
+        for chunk_id, document, metadata in zip(ids, documents, metadatas)
+    ]
+    with _connect(directory) as conn:
+        _delete_ids(conn, namespace, ids)
+        conn.executemany(
+            "INSERT OR IGNORE INTO chunks (namespace, id, filename, bytes, updated_at) VALUES (?, ?, ?, ?, ?)", rows
+        )
+
+
+def remove_chunks(directory: str, namespace: str, ids: List[str]):
+    if not ids:
+        return
+    with _connect(directory) as conn:
+        _delete_ids(conn, namespace, ids)
+
+
+def _delete_ids(conn, namespace: str, ids: List[str]):
+    for start in range(0, len(ids), 500):
+        batch = list(ids[start:start + 500])
+        conn.execute(
+            f"DELETE FROM chunks WHERE namespace = ? AND id IN ({','.join('?' * len(batch))})",
+            [namespace, *batch],
+        )
+
+
+def drop_namespace_stats(directory: str, namespace: str):
+    """清除命名空間的所有統計（集合被刪除或重建時）"""
+    if not os.path.exists(os.path.join(directory, CHUNK_STATS_FILE)):
+        return
+    with _connect(directory) as conn:
+        for table in ("chunks", "file_stats", "namespace_stats", "tracked"):
+            conn.execute(f"DELETE FROM {table} WHERE namespace = ?", (namespace,))
+
+
+def is_tracked(directory: str, namespace: str) -> bool:
+    with _connect(directory) as conn:
+        return conn.execute("SELECT 1 FROM tracked WHERE namespace = ?", (namespace,)).fetchone() is not None
+
+
+def mark_tracked(directory: str, namespace: str):
+    with _connect(directory) as conn:
+        conn.execute("INSERT OR IGNORE INTO tracked (namespace) VALUES (?)", (namespace,))
+
+
+def namespace_stats(directory: str, namespace: str) -> Dict:
+    """命名空間的總 chunk 數、文件數、內容位元組數與最後更新時間"""
+    with _connect(directory) as conn:
+        row = conn.execute(
+            "SELECT chunks, files, bytes, updated_at FROM namespace_stats WHERE namespace = ?", (namespace,)
+        ).fetchone()
+    if row is None:
+        return {"chunks": 0, "files": 0, "bytes": 0, "updated_at": None}
+    return {"chunks": row[0], "files": row[1], "bytes": row[2], "updated_at": row[3]}
+
+
+def file_stats(directory: str, namespace: str) -> List[Dict]:
+    with _connect(directory) as conn:
+        rows = conn.execute(
+            "SELECT filename, chunks, bytes, updated_at FROM file_stats WHERE namespace = ? ORDER BY filename",
+            (namespace,),
+        ).fetchall()
+    return [{"filename": row[0], "chunks": row[1], "bytes": row[2], "updated_at": row[3]} for row in rows]
+
+
+def page_chunk_ids(directory: str, namespace: str, filename: Optional[str] = None,
+                   after: Optional[str] = None, limit: int = 100) -> List[str]:
+    """依 ID 排序的鍵集分頁（after 為上一頁最後一個 ID），翻到後面的頁也不需跳過前面的列"""
+    clauses, params = ["namespace = ?"], [namespace]
+    if filename is not None:
+        clauses.append("filename = ?")
+        params.append(filename)
+    if after is not None:
+        clauses.append("id > ?")
+        params.append(after)
+    with _connect(directory) as conn:
+        rows = conn.execute(
+            f"SELECT id FROM chunks WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?", [*params, limit]
+        ).fetchall()
+    return [row[0] for row in rows]
@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request, Response
+
+# 資料版本號：文件、向量庫或對話記錄有任何變動就遞增，輪詢的端點以此產生 ETag，
+# 多個工作進程共用同一個計數器
+BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
+DATA_VERSION_PATH = os.path.join(BASE_PATH, 'data_version.sqlite3')
+
+
+@contextmanager
+def _connect():
+    """開啟資料版本計數器，離開時提交並關閉連線"""
+    os.makedirs(os.path.dirname(DATA_VERSION_PATH), exist_ok=True)
+    conn = sqlite3.connect(DATA_VERSION_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS data_version ("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL, updated_at REAL NOT NULL)"
+    )
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def bump_data_version() -> int:
+    """資料有變動時遞增版本號，回傳新的版本號"""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO data_version (id, value, updated_at) VALUES (1, 1, ?) "
+            "ON CONFLICT (id) DO UPDATE SET value = value + 1, updated_at = excluded.updated_at",
+            (now,),
+        )
+        return conn.execute("SELECT value FROM data_version WHERE id = 1").fetchone()[0]
+
+
+def current_data_version() -> Tuple[int, float]:
+    """目前的 (版本號, 最後變動時間)；從未變動時為 (0, 建立計數器的時間)"""
+    with _connect() as conn:
+        row = conn.execute("SELECT value, updated_at FROM data_version WHERE id = 1").fetchone()
+        if row is None:
+            now = time.time()
+            conn.execute("INSERT OR IGNORE INTO data_version (id, value, updated_at) VALUES (1, 0, ?)", (now,))
+            return 0, now
+    return row[0], row[1]
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # 弱比較：忽略 W/ 前綴
+    return "*" in tags or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+
+def not_modified(request: Request, response: Response, scope: Optional[str] = None) -> Optional[Response]:
+    """在回應加上以資料版本號產生的 ETag / Last-Modified；客戶端快取仍有效時回傳 304 回應
+
+    版本號在產生內容前讀取，內容產生期間資料若有變動，下次輪詢會因版本號不同而重新取得。
+    scope 用於只存在單一進程記憶體中的資料（例如對話記錄）：ETag 加上 scope，
+    請求落到其他進程或重啟後不會誤判為未變動；此時不提供 Last-Modified，只以 ETag 驗證。
+    """
+    version, updated_at = current_data_version()
+    headers = {
+        "ETag": f'W/"{scope}-{version}"' if scope else f'W/"{version}"',
+        # 允許快取，但每次都需向伺服器驗證
+        "Cache-Control": "no-cache",
+        "X-Data-Version": str(version),
+    }
+    if not scope:
+        headers["Last-Modified"] = formatdate(updated_at, usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, headers["ETag"])
+    elif scope:
+        fresh = False
+    else:
+        fresh = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                fresh = int(updated_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                fresh = False
+    return Response(status_code=304, headers=headers) if fresh else None
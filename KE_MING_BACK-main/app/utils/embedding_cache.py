@@ -0,0 +1,179 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 嵌入向量快取：以 (模型, 維度, 文字雜湊) 為鍵持久化保存，重建索引時不必再呼叫 API
+BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(BASE_PATH, "embedding_cache.sqlite3")
+)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# 容量上限，超過時依最近使用時間淘汰到上限的 90%
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+
+# SQLite 單一語句可用的參數數量有限，查詢時分批
+_LOOKUP_BATCH = 500
+
+# 全部實例共用的統計數據
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+@contextmanager
+def _connect():
+    """開啟快取資料庫，離開時提交並關閉連線"""
+    os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        "key TEXT PRIMARY KEY, model TEXT NOT NULL, dimensions INTEGER NOT NULL, "
+        "vector BLOB NOT NULL, last_used REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+    conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('total_bytes', 0)")
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def embedding_cache_key(model: str, dimensions: Optional[int], text: str) -> str:
+    raw = f"{model}\0{dimensions or 0}\0{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_embedding_cache_stats() -> Dict:
+    """快取統計：命中率、條目數與佔用空間"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+
+    with _connect() as conn:
+        stats["entries"] = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        stats["bytes"] = conn.execute(
+            "SELECT value FROM cache_meta WHERE name = 'total_bytes'"
+        ).fetchone()[0]
+    stats["max_bytes"] = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+    stats["enabled"] = EMBEDDING_CACHE_ENABLED
+    return stats
+
+
+class CachedEmbeddings(Embeddings):
+    """包在嵌入模型外層的持久化快取，只有未命中的文字才會呼叫底層模型"""
+
+    def __init__(self, embeddings: Embeddings, model: str, dimensions: Optional[int] = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.dimensions = dimensions
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        with _connect() as conn:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key, _ in rows],
+                )
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        now = time.time()
+        rows = [
+            (key, self.model, self.dimensions or len(vector),
+             np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in vectors.items()
+        ]
+        with _connect() as conn:
+            added_bytes = 0
+            for row in rows:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, model, dimensions, vector, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    row,
+                )
+                if cursor.rowcount:
+                    added_bytes += len(row[3])
+            conn.execute(
+                "UPDATE cache_meta SET value = value + ? WHERE name = 'total_bytes'", (added_bytes,)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """超過容量上限時淘汰最久未使用的條目"""
+        max_bytes = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+        total = conn.execute("SELECT value FROM cache_meta WHERE name = 'total_bytes'").fetchone()[0]
+        if total <= max_bytes:
+            return
+
+        target = int(max_bytes * 0.9)
+        evicted = 0
+        freed = 0
+        while total - freed > target:
+            rows = conn.execute(
+                "SELECT key, length(vector) FROM embeddings ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            batch = []
+            for key, size in rows:
+                batch.append((key,))
+                freed += size
+                if total - freed <= target:
+                    break
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", batch)
+            evicted += len(batch)
+
+        conn.execute(
+            "UPDATE cache_meta SET value = value - ? WHERE name = 'total_bytes'", (freed,)
+        )
+        with _stats_lock:
+            _stats["evictions"] += evicted
+        print(f"嵌入快取已淘汰 {evicted} 筆，釋放 {freed / 1024 / 1024:.1f} MB")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model, self.dimensions, text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # 只對未命中的文字（去重後）呼叫嵌入模型
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            # 統一以 float32 精度回傳，讓首次計算與快取命中的結果完全一致
+            computed = {
+                key: np.asarray(vector, dtype=np.float32).tolist()
+                for key, vector in zip(missing.keys(), vectors)
+            }
+            self._store(computed)
+            cached.update(computed)
+
+        with _stats_lock:
+            _stats["misses"] += len(missing)
+            _stats["hits"] += len(texts) - len(missing)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # 查詢多半只出現一次，不寫入快取（避免每次查詢都寫入提交，也不灌水命中率）
+        return np.asarray(self.embeddings.embed_query(text), dtype=np.float32).tolist()
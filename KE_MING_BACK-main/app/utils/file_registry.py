@@ -0,0 +1,254 @@
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.data_version import bump_data_version
+
+# 上傳文件登記表：顯示名稱 <-> 實際文件名、內容雜湊、大小、頁數、chunk 數與處理狀態，重啟後仍保留
+BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
+FILE_REGISTRY_PATH = os.path.join(BASE_PATH, 'file_registry.sqlite3')
+
+# 狀態：processing（寫入向量庫中）、indexed（完成）、failed（處理中斷）、deleting（移除向量中）
+# processing / deleting 是寫入向量庫前先記下的意圖，服務中斷後啟動時據此收尾，兩邊不會長期不一致
+STATUS_PROCESSING = "processing"
+STATUS_INDEXED = "indexed"
+STATUS_FAILED = "failed"
+STATUS_DELETING = "deleting"
+
+# 列表可排序的欄位: 參數名稱 -> 資料表欄位
+SORT_COLUMNS = {
+    "updated_at": "updated_at",
+    "created_at": "created_at",
+    "display_name": "display_name",
+    "size": "size",
+    "chunks": "chunks",
+    "pages": "pages",
+}
+
+_COLUMNS = (
+    "stored_name", "display_name", "namespace", "hash", "size", "pages", "chunks",
+    "status", "error", "created_at", "updated_at", "indexed_at",
+)
+
+
+@contextmanager
+def _connect():
+    """開啟文件登記表，離開時提交並關閉連線"""
+    os.makedirs(os.path.dirname(FILE_REGISTRY_PATH), exist_ok=True)
+    conn = sqlite3.connect(FILE_REGISTRY_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS files ("
+        "stored_name TEXT PRIMARY KEY, display_name TEXT NOT NULL, namespace TEXT NOT NULL, "
+        "hash TEXT, size INTEGER NOT NULL DEFAULT 0, pages INTEGER, chunks INTEGER NOT NULL DEFAULT 0, "
+        "status TEXT NOT NULL, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, indexed_at REAL)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_files_display ON files (namespace, display_name)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_updated ON files (namespace, updated_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files (hash)")
+    conn.execute("CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value TEXT)")
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _row_to_dict(row) -> Dict:
+    return dict(zip(_COLUMNS, row))
+
+
+def file_hash(path: str) -> str:
+    """分塊計算文件內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_count(path: str) -> Optional[int]:
+    """PDF 的頁數（只讀取目錄結構），其他格式回傳 None"""
+    if not path.lower().endswith(".pdf"):
+        return None
+    try:
+        import fitz
+
+        with fitz.open(path) as document:
+            return len(document)
+    except Exception as e:
+        print(f"讀取 PDF 頁數失敗: {str(e)}")
+        return None
+
+
+def get_file(stored_name: str) -> Optional[Dict]:
+    with _connect() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM files WHERE stored_name = ?", (stored_name,)
+        ).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def find_file(namespace: str, display_name: str) -> Optional[Dict]:
+    with _connect() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM files WHERE namespace = ? AND display_name = ?",
+            (namespace, display_name),
+        ).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def begin_processing(stored_name: str, display_name: str, namespace: str, content_hash: Optional[str],
+                     size: int, pages: Optional[int] = None):
+    """寫入向量庫前登記文件（新文件或重新上傳），狀態設為 processing"""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO files (stored_name, display_name, namespace, hash, size, pages, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (stored_name) DO UPDATE SET display_name = excluded.display_name, "
+            "namespace = excluded.namespace, hash = excluded.hash, size = excluded.size, pages = excluded.pages, "
+            "status = excluded.status, error = NULL, updated_at = excluded.updated_at",
+            (stored_name, display_name, namespace, content_hash, size, pages, STATUS_PROCESSING, now, now),
+        )
+    bump_data_version()
+
+
+def finish_processing(stored_name: str, chunks: int, pages: Optional[int] = None):
+    """向量庫寫入完成，記錄 chunk 數並設為 indexed"""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE files SET status = ?, chunks = ?, pages = COALESCE(?, pages), error = NULL, "
+            "updated_at = ?, indexed_at = ? WHERE stored_name = ?",
+            (STATUS_INDEXED, chunks, pages, now, now, stored_name),
+        )
+    bump_data_version()
+
+
+def restore_file(record: Dict):
+    """重新上傳失敗時還原為原本的紀錄"""
+    with _connect() as conn:
+        conn.execute(
+            f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            [record[column] for column in _COLUMNS],
+        )
+    bump_data_version()
+
+
+def mark_deleting(stored_name: str):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE files SET status = ?, updated_at = ? WHERE stored_name = ?",
+            (STATUS_DELETING, time.time(), stored_name),
+        )
+    bump_data_version()
+
+
+def remove_file(stored_name: str):
+    with _connect() as conn:
+        conn.execute("DELETE FROM files WHERE stored_name = ?", (stored_name,))
+    bump_data_version()
+
+
+def clear_files():
+    with _connect() as conn:
+        conn.execute("DELETE FROM files")
+    bump_data_version()
+
+
+def namespace_files(namespace: str) -> Dict[str, str]:
+    """命名空間中已完成索引的文件：顯示名稱 -> 實際文件名"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT display_name, stored_name FROM files WHERE namespace = ? AND status = ?",
+            (namespace, STATUS_INDEXED),
+        ).fetchall()
+    return dict(rows)
+
+
+def source_namespaces() -> Dict[str, str]:
+    """所有未在刪除中的文件：實際文件名 -> 命名空間"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT stored_name, namespace FROM files WHERE status != ?", (STATUS_DELETING,)
+        ).fetchall()
+    return dict(rows)
+
+
+def list_files(namespace: Optional[str] = None, sort: str = "updated_at", descending: bool = True,
+               offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """分頁列出文件，排序在資料庫中完成；limit 為 None 時列出全部，回傳 (本頁文件, 總數)"""
+    column = SORT_COLUMNS[sort]
+    where, params = ("WHERE namespace = ?", [namespace]) if namespace is not None else ("", [])
+    with _connect() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM files {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM files {where} "
+            f"ORDER BY {column} {'DESC' if descending else 'ASC'}, stored_name LIMIT ? OFFSET ?",
+            # SQLite 的 LIMIT -1 代表不限筆數
+            [*params, -1 if limit is None else limit, offset],
+        ).fetchall()
+    return [_row_to_dict(row) for row in rows], total
+
+
+def interrupted_files() -> List[Dict]:
+    """上次服務中斷時仍在處理或刪除中的文件"""
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM files WHERE status IN (?, ?)",
+            (STATUS_PROCESSING, STATUS_DELETING),
+        ).fetchall()
+    return [_row_to_dict(row) for row in rows]
+
+
+def mark_failed(stored_name: str, error: str):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE files SET status = ?, error = ?, updated_at = ? WHERE stored_name = ?",
+            (STATUS_FAILED, error, time.time(), stored_name),
+        )
+    bump_data_version()
+
+
+def needs_legacy_import() -> bool:
+    """是否尚未登記過舊版留在上傳目錄中的文件"""
+    with _connect() as conn:
+        return conn.execute("SELECT 1 FROM registry_meta WHERE key = 'legacy_imported'").fetchone() is None
+
+
+def import_legacy_uploads(upload_dir: str, extensions, chunk_counts: Dict[str, int]) -> int:
+    """第一次啟用登記表時，把上傳目錄中既有的文件登記進來（原本的映射只在記憶體中，顯示名稱已遺失）
+
+    chunk_counts 為向量庫中各文件（實際文件名）的 chunk 數；向量庫中找不到的文件登記為 failed，
+    不會把從未成功索引的文件顯示為已完成。
+    """
+    with _connect() as conn:
+        if conn.execute("SELECT 1 FROM registry_meta WHERE key = 'legacy_imported'").fetchone():
+            return 0
+        imported = 0
+        for filename in sorted(os.listdir(upload_dir)):
+            path = os.path.join(upload_dir, filename)
+            if not os.path.isfile(path) or os.path.splitext(filename)[1].lower() not in extensions:
+                continue
+            stat = os.stat(path)
+            chunks = chunk_counts.get(filename, 0)
+            status, error = (STATUS_INDEXED, None) if chunks else (STATUS_FAILED, "向量庫中沒有這個文件的內容，請重新上傳")
+            conn.execute(
+                "INSERT OR IGNORE INTO files (stored_name, display_name, namespace, hash, size, pages, chunks, "
+                "status, error, created_at, updated_at, indexed_at) "
+                "VALUES (?, ?, 'default', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, filename, file_hash(path), stat.st_size, page_count(path), chunks, status, error,
+                 stat.st_ctime, stat.st_mtime, stat.st_mtime if chunks else None),
+            )
+            imported += 1
+        conn.execute("INSERT INTO registry_meta (key, value) VALUES ('legacy_imported', ?)", (str(time.time()),))
+    if imported:
+        bump_data_version()
+        print(f"已將上傳目錄中 {imported} 個既有文件登記到文件登記表")
+    return imported
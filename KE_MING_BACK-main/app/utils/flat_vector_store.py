@@ -0,0 +1,557 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain.schema import Document
+
+# 記憶體映射的平面向量索引：向量以矩陣形式存在分段文件中，精確 top-k 以 NumPy 矩陣乘法計算
+# 每個分段最多的向量數，寫滿後開新分段
+FLAT_SEGMENT_ROWS = int(os.getenv("FLAT_SEGMENT_ROWS", "100000"))
+# 向量儲存精度：float32、float16（記憶體減半）或 int8（每筆向量一個縮放係數的純量量化，記憶體約 1/4）
+FLAT_VECTOR_DTYPE = os.getenv("FLAT_VECTOR_DTYPE", "float32").lower()
+# 量化儲存時另存一份 float32 向量在磁碟上（不常駐記憶體），用來重新計分候選結果
+FLAT_KEEP_FULL_PRECISION = os.getenv("FLAT_KEEP_FULL_PRECISION", "true").lower() == "true"
+# 量化向量先取 k × 此倍數的候選，再以完整精度重新計分取前 k 筆
+FLAT_RESCORE_FACTOR = int(os.getenv("FLAT_RESCORE_FACTOR", "4"))
+# 已刪除（墓碑）向量比例超過此值時自動壓縮
+FLAT_COMPACT_RATIO = float(os.getenv("FLAT_COMPACT_RATIO", "0.3"))
+# 計分時每次轉換與相乘的列數，限制暫存記憶體
+FLAT_SCAN_BLOCK_ROWS = int(os.getenv("FLAT_SCAN_BLOCK_ROWS", "16384"))
+
+_SEGMENT_FILE = re.compile(r"^seg_(\d{6})\.(bin|scale|full)$")
+_SUPPORTED_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# where 子句的比較運算子
+_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _where_to_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """將 Chroma 格式的 where 子句轉為以 json_extract 查詢 metadata 的 SQL 條件"""
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_to_sql(sub) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+
+        field = "json_extract(metadata, ?)"
+        path = '$."' + key.replace('"', '\\"') + '"'
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in ("$in", "$nin"):
+                if not value:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                placeholders = ",".join("?" * len(value))
+                negate = "NOT " if op == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({placeholders})")
+                params.extend([path, *value])
+            elif op in _OPERATORS:
+                clauses.append(f"{field} {_OPERATORS[op]} ?")
+                params.extend([path, value])
+            else:
+                raise ValueError(f"不支持的 where 運算子: {op}")
+    if not clauses:
+        return "1", []
+    return " AND ".join(clauses), params
+
+
+class FlatVectorStore(VectorStore):
+    """單一進程內的平面向量存儲，介面與 LangChain 的 Chroma 相同
+
+    目錄結構：
+        manifest.json    向量維度、儲存精度與是否保留完整精度
+        meta.sqlite3     每筆向量的 ID、內容、metadata、所在分段與位置、是否已刪除
+        seg_000001.bin   只追加的向量分段（row-major 矩陣，已正規化為單位向量）
+        seg_000001.scale int8 量化時每筆向量的縮放係數（float32）
+        seg_000001.full  量化時保留的 float32 向量，只在重新計分時讀取候選列
+    刪除與覆寫只標記墓碑，墓碑比例過高時壓縮成新的分段。
+    回傳的分數為餘弦距離（1 - 餘弦相似度，越小越相似）。
+    """
+
+    def __init__(self, directory: str, embedding_function: Embeddings, dtype: Optional[str] = None,
+                 keep_full_precision: Optional[bool] = None):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._db_path = os.path.join(directory, "meta.sqlite3")
+        self._manifest_path = os.path.join(directory, "manifest.json")
+
+        manifest = self._read_manifest()
+        self.dim: Optional[int] = manifest.get("dim")
+        dtype = manifest.get("dtype") or dtype or FLAT_VECTOR_DTYPE
+        if dtype not in _SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的向量精度: {dtype}")
+        self.dtype = dtype
+        self._np_dtype = _SUPPORTED_DTYPES[dtype]
+        if "full_precision" in manifest:
+            self.full_precision = manifest["full_precision"]
+        else:
+            keep = FLAT_KEEP_FULL_PRECISION if keep_full_precision is None else keep_full_precision
+            self.full_precision = keep and dtype != "float32"
+
+        # 每個分段的記憶體映射、墓碑遮罩與對應的 SQLite 列號
+        self._segments: Dict[int, Dict[str, Any]] = {}
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    # ---- 持久化 ----
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _write_manifest(self):
+        temp_path = f"{self._manifest_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "full_precision": self.full_precision}, f)
+        os.replace(temp_path, self._manifest_path)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "row INTEGER PRIMARY KEY, id TEXT NOT NULL, segment INTEGER NOT NULL, "
+            "offset INTEGER NOT NULL, document TEXT, metadata TEXT NOT NULL, "
+            "deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_vectors_live_id ON vectors (id) WHERE deleted = 0"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_position ON vectors (segment, offset)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_vectors_source "
+            "ON vectors (json_extract(metadata, '$.source'))"
+        )
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _segment_path(self, segment: int, kind: str = "bin") -> str:
+        return os.path.join(self.directory, f"seg_{segment:06d}.{kind}")
+
+    def _layouts(self) -> Dict[str, Tuple[Any, int]]:
+        """每種分段文件的 (資料型別, 每列元素數)"""
+        layouts = {"bin": (self._np_dtype, self.dim)}
+        if self.dtype == "int8":
+            layouts["scale"] = (np.float32, 1)
+        if self.full_precision:
+            layouts["full"] = (np.float32, self.dim)
+        return layouts
+
+    def _encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        """將正規化後的 float32 向量轉為各分段文件的內容"""
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            encoded = {
+                "bin": np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8),
+                "scale": scales.astype(np.float32),
+            }
+        else:
+            encoded = {"bin": vectors.astype(self._np_dtype)}
+        if self.full_precision:
+            encoded["full"] = vectors.astype(np.float32)
+        return encoded
+
+    def _load(self):
+        """依 SQLite 紀錄重建分段狀態，清除未完成寫入留下的多餘資料"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT segment, offset, row, deleted FROM vectors ORDER BY segment, offset"
+            ).fetchall()
+
+        by_segment: Dict[int, List[Tuple[int, int, int]]] = {}
+        for segment, offset, row, deleted in rows:
+            by_segment.setdefault(segment, []).append((offset, row, deleted))
+
+        self._segments = {}
+        for segment, entries in by_segment.items():
+            count = entries[-1][0] + 1
+            row_ids = np.full(count, -1, dtype=np.int64)
+            live = np.zeros(count, dtype=bool)
+            for offset, row, deleted in entries:
+                row_ids[offset] = row
+                live[offset] = not deleted
+            # 向量已寫入但 SQLite 尚未提交的部分視為無效，截斷
+            for kind, (dtype, width) in self._layouts().items():
+                path = self._segment_path(segment, kind)
+                size = count * width * np.dtype(dtype).itemsize
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+            self._segments[segment] = {"count": count, "row_ids": row_ids, "live": live, "maps": {}}
+
+        # 刪除不再被引用的舊分段（例如壓縮完成後尚未刪除的文件）
+        for filename in sorted(os.listdir(self.directory)):
+            match = _SEGMENT_FILE.match(filename)
+            if match and int(match.group(1)) not in self._segments:
+                os.remove(os.path.join(self.directory, filename))
+
+    def _matrix(self, segment: int, kind: str = "bin") -> np.ndarray:
+        """取得分段文件的唯讀記憶體映射，分段有新資料追加時重新映射"""
+        state = self._segments[segment]
+        matrix = state["maps"].get(kind)
+        if matrix is None or matrix.shape[0] != state["count"]:
+            dtype, width = self._layouts()[kind]
+            shape = (state["count"], width) if width > 1 else (state["count"],)
+            matrix = np.memmap(self._segment_path(segment, kind), dtype=dtype, mode="r", shape=shape)
+            state["maps"][kind] = matrix
+        return matrix
+
+    def release(self):
+        """解除所有分段的記憶體映射（存儲被關閉時呼叫，之後存取會重新映射）"""
+        with self._lock:
+            for state in self._segments.values():
+                state["maps"] = {}
+
+    def _decode(self, segment: int, offsets) -> np.ndarray:
+        """讀出指定列的 float32 向量（有完整精度時直接讀取，否則由量化值還原）"""
+        if self.full_precision:
+            return np.asarray(self._matrix(segment, "full")[offsets], dtype=np.float32)
+        vectors = np.asarray(self._matrix(segment)[offsets], dtype=np.float32)
+        if self.dtype == "int8":
+            vectors *= np.asarray(self._matrix(segment, "scale")[offsets])[..., None]
+        return vectors
+
+    # ---- 寫入 ----
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[Dict]] = None,
+                       ids: Optional[List[str]] = None) -> List[str]:
+        """寫入已計算好的向量；相同 ID 的舊向量標記為墓碑（upsert）"""
+        if not texts:
+            return []
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_manifest()
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量維度 {vectors.shape[1]} 與索引維度 {self.dim} 不符")
+
+            # 同一批中重複的 ID 只保留最後一筆
+            latest = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            keep = sorted(latest.values())
+
+            self._tombstone_ids([ids[i] for i in keep])
+
+            written = 0
+            while written < len(keep):
+                segment = max(self._segments, default=0)
+                if not segment or self._segments[segment]["count"] >= FLAT_SEGMENT_ROWS:
+                    segment += 1
+                    self._segments[segment] = {
+                        "count": 0, "row_ids": np.empty(0, dtype=np.int64),
+                        "live": np.empty(0, dtype=bool), "maps": {},
+                    }
+                state = self._segments[segment]
+                batch = keep[written:written + FLAT_SEGMENT_ROWS - state["count"]]
+                start = state["count"]
+
+                for kind, data in self._encode(vectors[batch]).items():
+                    with open(self._segment_path(segment, kind), "ab") as f:
+                        f.write(data.tobytes())
+
+                with self._connect() as conn:
+                    row_ids = []
+                    for position, i in enumerate(batch):
+                        cursor = conn.execute(
+                            "INSERT INTO vectors (id, segment, offset, document, metadata) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (ids[i], segment, start + position, texts[i],
+                             json.dumps(metadatas[i] or {}, ensure_ascii=False)),
+                        )
+                        row_ids.append(cursor.lastrowid)
+
+                state["count"] += len(batch)
+                state["row_ids"] = np.concatenate([state["row_ids"], np.asarray(row_ids, dtype=np.int64)])
+                state["live"] = np.concatenate([state["live"], np.ones(len(batch), dtype=bool)])
+                written += len(batch)
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict]] = None, *,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+    def _tombstone_rows(self, positions: List[Tuple[int, int]]):
+        for segment, offset in positions:
+            state = self._segments.get(segment)
+            if state is not None and offset < state["count"]:
+                state["live"][offset] = False
+
+    def _tombstone_ids(self, ids: List[str]) -> int:
+        removed = 0
+        with self._connect() as conn:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                positions = conn.execute(
+                    f"SELECT segment, offset FROM vectors WHERE deleted = 0 AND id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                conn.execute(
+                    f"UPDATE vectors SET deleted = 1 WHERE deleted = 0 AND id IN ({placeholders})", batch
+                )
+                self._tombstone_rows(positions)
+                removed += len(positions)
+        return removed
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+               **kwargs: Any) -> Optional[bool]:
+        """以 ID 或 where 條件刪除（標記墓碑），墓碑比例過高時自動壓縮"""
+        with self._lock:
+            if ids:
+                self._tombstone_ids(list(ids))
+            elif where is not None:
+                sql, params = _where_to_sql(where)
+                with self._connect() as conn:
+                    positions = conn.execute(
+                        f"SELECT segment, offset FROM vectors WHERE deleted = 0 AND {sql}", params
+                    ).fetchall()
+                    conn.execute(f"UPDATE vectors SET deleted = 1 WHERE deleted = 0 AND {sql}", params)
+                    self._tombstone_rows(positions)
+
+            total = sum(state["count"] for state in self._segments.values())
+            dead = total - self.count()
+            if total and dead / total > FLAT_COMPACT_RATIO:
+                self.compact()
+        return True
+
+    def compact(self) -> Dict[str, int]:
+        """把存活的向量重寫到新分段，移除墓碑並釋放磁碟空間"""
+        with self._lock:
+            old_segments = sorted(self._segments)
+            next_segment = max(old_segments, default=0) + 1
+            moved: List[Tuple[int, int, int]] = []  # (row, 新分段, 新位置)
+            kinds = list(self._layouts())
+
+            out_segment, out_count, out_files = next_segment, 0, None
+            try:
+                for segment in old_segments:
+                    state = self._segments[segment]
+                    live_offsets = np.flatnonzero(state["live"])
+                    for start in range(0, len(live_offsets), FLAT_SCAN_BLOCK_ROWS):
+                        block = live_offsets[start:start + FLAT_SCAN_BLOCK_ROWS]
+                        position = 0
+                        while position < len(block):
+                            if out_files is None or out_count >= FLAT_SEGMENT_ROWS:
+                                if out_files is not None:
+                                    for f in out_files.values():
+                                        f.close()
+                                    out_segment += 1
+                                out_files = {kind: open(self._segment_path(out_segment, kind), "wb") for kind in kinds}
+                                out_count = 0
+                            take = block[position:position + FLAT_SEGMENT_ROWS - out_count]
+                            for kind in kinds:
+                                out_files[kind].write(np.ascontiguousarray(self._matrix(segment, kind)[take]).tobytes())
+                            for i, offset in enumerate(take):
+                                moved.append((int(state["row_ids"][offset]), out_segment, out_count + i))
+                            out_count += len(take)
+                            position += len(take)
+            finally:
+                for f in (out_files or {}).values():
+                    f.close()
+
+            # 一次交易切換所有紀錄到新分段，之後才刪除舊分段
+            with self._connect() as conn:
+                conn.execute("DELETE FROM vectors WHERE deleted = 1")
+                conn.executemany(
+                    "UPDATE vectors SET segment = ?, offset = ? WHERE row = ?",
+                    [(segment, offset, row) for row, segment, offset in moved],
+                )
+            removed = sum(state["count"] for state in self._segments.values()) - len(moved)
+            for segment in old_segments:
+                self._segments[segment]["maps"] = {}
+            self._load()
+            print(f"平面向量索引壓縮完成: 保留 {len(moved)} 筆，清除 {removed} 筆")
+            return {"kept": len(moved), "removed": removed}
+
+    # ---- 查詢 ----
+
+    def count(self) -> int:
+        return int(sum(state["live"].sum() for state in self._segments.values()))
+
+    def _filter_mask(self, where: Optional[Dict]) -> Optional[Dict[int, np.ndarray]]:
+        """在 SQLite 中計算符合 where 條件的位置，回傳各分段的布林遮罩"""
+        if not where:
+            return None
+        sql, params = _where_to_sql(where)
+        masks = {segment: np.zeros(state["count"], dtype=bool) for segment, state in self._segments.items()}
+        with self._connect() as conn:
+            for segment, offset in conn.execute(
+                f"SELECT segment, offset FROM vectors WHERE deleted = 0 AND {sql}", params
+            ):
+                masks[segment][offset] = True
+        return masks
+
+    def _scan(self, query: np.ndarray, k: int, masks: Optional[Dict[int, np.ndarray]]
+              ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """逐分段以矩陣乘法計算相似度，回傳前 k 筆的 (分數, 分段, 位置)"""
+        best_scores = np.empty(0, dtype=np.float32)
+        best_segments = np.empty(0, dtype=np.int64)
+        best_offsets = np.empty(0, dtype=np.int64)
+
+        for segment, state in self._segments.items():
+            matrix = self._matrix(segment)
+            scales = self._matrix(segment, "scale") if self.dtype == "int8" else None
+            allowed = state["live"] if masks is None else state["live"] & masks[segment]
+            for start in range(0, state["count"], FLAT_SCAN_BLOCK_ROWS):
+                stop = start + FLAT_SCAN_BLOCK_ROWS
+                block_allowed = allowed[start:stop]
+                if not block_allowed.any():
+                    continue
+                scores = np.asarray(matrix[start:stop], dtype=np.float32) @ query
+                if scales is not None:
+                    scores *= scales[start:stop]
+                scores[~block_allowed] = -np.inf
+                take = min(k, int(block_allowed.sum()))
+                top = np.argpartition(-scores, take - 1)[:take]
+                best_scores = np.concatenate([best_scores, scores[top]])
+                best_segments = np.concatenate([best_segments, np.full(take, segment, dtype=np.int64)])
+                best_offsets = np.concatenate([best_offsets, start + top])
+                if len(best_scores) > k:
+                    keep = np.argpartition(-best_scores, k - 1)[:k]
+                    best_scores, best_segments, best_offsets = (
+                        best_scores[keep], best_segments[keep], best_offsets[keep]
+                    )
+        return best_scores, best_segments, best_offsets
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None
+                                               ) -> List[Tuple[Document, float]]:
+        """top-k 檢索：未量化時為精確結果；量化時先取較多候選，再以完整精度重新計分"""
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        with self._lock:
+            if self.dim is None or not self._segments:
+                return []
+            masks = self._filter_mask(filter)
+            rescore = self.full_precision and FLAT_RESCORE_FACTOR > 1
+            scores, segments, offsets = self._scan(query, k * FLAT_RESCORE_FACTOR if rescore else k, masks)
+            if rescore:
+                for segment in np.unique(segments):
+                    picked = segments == segment
+                    scores[picked] = self._decode(int(segment), offsets[picked]) @ query
+            rows = np.asarray([
+                self._segments[int(segment)]["row_ids"][offset] for segment, offset in zip(segments, offsets)
+            ], dtype=np.int64)
+
+        order = np.argsort(-scores)[:k]
+        rows = [int(rows[i]) for i in order]
+        scores = [float(scores[i]) for i in order]
+        if not rows:
+            return []
+
+        with self._connect() as conn:
+            placeholders = ",".join("?" * len(rows))
+            records = {
+                row: (document, metadata)
+                for row, document, metadata in conn.execute(
+                    f"SELECT row, document, metadata FROM vectors WHERE row IN ({placeholders})", rows
+                )
+            }
+        results = []
+        for row, score in zip(rows, scores):
+            if row in records:
+                document, metadata = records[row]
+                results.append((Document(page_content=document, metadata=json.loads(metadata)), 1.0 - score))
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                 **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(doc, 1.0 - distance)
+                for doc, distance in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None, **kwargs: Any) -> Dict[str, Any]:
+        """與 Chroma collection.get 相同格式的查詢，include 可為 documents、metadatas、embeddings"""
+        include = ["documents", "metadatas"] if include is None else include
+        clauses, params = ["deleted = 0"], []
+        if ids is not None:
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": [], "embeddings": None}
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        if where:
+            sql, where_params = _where_to_sql(where)
+            clauses.append(sql)
+            params.extend(where_params)
+        sql = f"SELECT id, document, metadata, segment, offset FROM vectors WHERE {' AND '.join(clauses)} ORDER BY row"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit if limit is not None else -1, offset or 0])
+
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            embeddings = None
+            if "embeddings" in include:
+                embeddings = [self._decode(segment, position).tolist() for _, _, _, segment, position in rows]
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows] if "documents" in include else None,
+            "metadatas": [json.loads(row[2]) for row in rows] if "metadatas" in include else None,
+            "embeddings": embeddings,
+        }
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """常駐記憶體（檢索時掃描的分段）與只在重新計分時讀取的完整精度資料大小"""
+        rows = sum(state["count"] for state in self._segments.values())
+        stats = {"dtype": self.dtype, "dimensions": self.dim, "rows": rows, "scan_bytes": 0, "rescore_bytes": 0}
+        if self.dim:
+            for kind, (dtype, width) in self._layouts().items():
+                key = "rescore_bytes" if kind == "full" else "scan_bytes"
+                stats[key] += rows * width * np.dtype(dtype).itemsize
+        return stats
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[Dict]] = None,
+                   *, ids: Optional[List[str]] = None, directory: Optional[str] = None,
+                   **kwargs: Any) -> "FlatVectorStore":
+        if directory is None:
+            raise ValueError("FlatVectorStore 需要指定 directory")
+        store = cls(directory, embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -1,7 +1,12 @@
 import os
 import base64
+import re
+import tempfile
+import time
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from openai import OpenAI
-from typing import List
+from typing import Dict, List, Tuple
 from langchain.schema import Document
 from dotenv import load_dotenv
 import fitz  # PyMuPDF
@@ -9,8 +14,126 @@ import io
 from PIL import Image
 import json
 
+from app.utils.image_store import extract_pdf_images, stage_source_images
+from app.utils.page_renderer import render_pages
+
 load_dotenv()
 
+# 文字層快速通道設定：文字足夠且未亂碼的頁面在本地解析，其餘頁面才送 GPT-4o
+TEXT_LAYER_FAST_PATH = os.getenv("TEXT_LAYER_FAST_PATH", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+TEXT_LAYER_MAX_GARBLED_RATIO = float(os.getenv("TEXT_LAYER_MAX_GARBLED_RATIO", "0.05"))
+TEXT_LAYER_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.85"))
+
+# 視覺頁面的輸入方式：images 為逐頁渲染成圖片送出，pdf 為上傳子 PDF 文件
+VISION_INPUT_MODE = os.getenv("VISION_INPUT_MODE", "images").lower()
+# 同時進行的 GPT-4o 頁面請求數
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4"))
+
+# 結構化輸出：單筆紀錄驗證失敗時個別重試的次數
+SCHEMA_MAX_RETRIES = int(os.getenv("SCHEMA_MAX_RETRIES", "2"))
+
+PRODUCT_PROMPT = """請擷取這份產品目錄中的所有產品資訊，依指定的 JSON 結構輸出：
+
+- model: 產品型號（例如 HK-2189）
+- name: 產品名稱
+- description: 產品描述，包含配件和電池資訊
+- dimensions: 尺寸規格，沒有則為 null
+- pack_quantity: 裝箱數量（整數），沒有則為 null
+- price: 建議售價原文（例如 "NT$1,299"），沒有則為 null
+- page: 產品所在的 PDF 頁碼
+- image_refs: 產品對應的圖片編號（該頁圖片依出現順序從 1 開始編號），沒有則為空陣列
+
+page_text 填入頁面上不屬於任何產品的其他文字（標題、說明、注意事項），沒有則為空字串。
+只輸出頁面上實際出現的資訊，不要推測。"""
+
+# 單筆產品紀錄的 JSON Schema（strict 模式要求所有欄位必填，可缺值的欄位允許 null）
+PRODUCT_RECORD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "model": {"type": "string"},
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "dimensions": {"type": ["string", "null"]},
+        "pack_quantity": {"type": ["integer", "null"]},
+        "price": {"type": ["string", "null"]},
+        "page": {"type": "integer"},
+        "image_refs": {"type": "array", "items": {"type": "integer"}},
+    },
+    "required": [
+        "model", "name", "description", "dimensions", "pack_quantity", "price", "page", "image_refs",
+    ],
+    "additionalProperties": False,
+}
+
+PRODUCT_PAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "products": {"type": "array", "items": PRODUCT_RECORD_SCHEMA},
+        "page_text": {"type": "string"},
+    },
+    "required": ["products", "page_text"],
+    "additionalProperties": False,
+}
+
+
+def validate_product_record(record: Dict, pages: List[int], image_counts: Dict[int, int]) -> List[str]:
+    """檢查單筆產品紀錄，回傳錯誤訊息列表（空列表表示通過）"""
+    errors = []
+    for field in ("model", "name"):
+        if not isinstance(record.get(field), str) or not record[field].strip():
+            errors.append(f"{field} 不可為空")
+    if not isinstance(record.get("description"), str):
+        errors.append("description 必須是字串")
+    page = record.get("page")
+    if not isinstance(page, int) or page not in pages:
+        errors.append(f"page 必須是 {pages[0]} 到 {pages[-1]} 之間的頁碼")
+    quantity = record.get("pack_quantity")
+    if quantity is not None and (not isinstance(quantity, int) or quantity <= 0):
+        errors.append("pack_quantity 必須是正整數或 null")
+    refs = record.get("image_refs")
+    if not isinstance(refs, list):
+        errors.append("image_refs 必須是陣列")
+    elif isinstance(page, int):
+        count = image_counts.get(page, 0)
+        invalid = [ref for ref in refs if not isinstance(ref, int) or not 0 < ref <= count]
+        if invalid:
+            errors.append(f"image_refs 超出範圍（第{page}頁共有 {count} 張圖片）: {invalid}")
+    return errors
+
+
+def format_product_record(record: Dict) -> str:
+    """將產品紀錄轉為入庫用的文字"""
+    lines = [
+        f"### {record['model']} (第{record['page']}頁)",
+        f"- **產品名稱**: {record['name']}",
+        f"- **產品描述**: {record['description']}",
+    ]
+    if record.get("dimensions"):
+        lines.append(f"- **尺寸規格**: {record['dimensions']}")
+    if record.get("pack_quantity") is not None:
+        lines.append(f"- **裝箱數量**: {record['pack_quantity']}")
+    if record.get("price"):
+        lines.append(f"- **建議售價**: {record['price']}")
+    return "\n".join(lines)
+
+
+def _is_garbled_char(char: str) -> bool:
+    """判斷字元是否為字型對應錯誤產生的亂碼（私用區、替代字元、未指派的碼位）
+
+    CJK 擴充區的罕用字是正體中文目錄中實際會出現的字，不視為亂碼。
+    """
+    return char == "\ufffd" or unicodedata.category(char) in ("Co", "Cn")
+
+
+def _garbled_ratio(text: str) -> float:
+    """計算文字中亂碼字元的比例"""
+    chars = "".join(text.split())
+    if not chars:
+        return 0.0
+    return sum(1 for c in chars if _is_garbled_char(c)) / len(chars)
+
+
 class GPTDocumentProcessor:
     def __init__(self, pdf_path: str):
         self.pdf_path = pdf_path
@@ -18,110 +141,348 @@ class GPTDocumentProcessor:
         # 確保靜態文件目錄存在
         self.static_dir = os.path.join(os.getcwd(), "static", "images", "products")
         os.makedirs(self.static_dir, exist_ok=True)
+        # 各頁處理路徑的統計報告
+        self.report: Dict = {}
     
     def extract_images(self):
-        """從 PDF 提取圖片"""
-        images = {}
-        pdf = fitz.open(self.pdf_path)
-        
-        for page_num in range(len(pdf)):
-            page = pdf[page_num]
-            image_list = page.get_images()
-            
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                base_image = pdf.extract_image(xref)
-                image_bytes = base_image["image"]
-                
-                # 將圖片保存到指定目錄
-                image_filename = f"product_{page_num+1}_{img_index+1}.png"
-                image_path = os.path.join(self.static_dir, image_filename)
-                
-                # 保存圖片
-                with open(image_path, "wb") as image_file:
-                    image_file.write(image_bytes)
-                
-                # 記錄圖片路徑和頁碼
-                images[f"page_{page_num+1}_{img_index+1}"] = {
-                    "path": f"/images/products/{image_filename}",
-                    "page": page_num + 1
-                }
-        
-        return images
-    
-    def process(self) -> list[Document]:
-        """處理 PDF 文件"""
+        """從 PDF 提取圖片，以內容雜湊存入圖片庫"""
+        return extract_pdf_images(self.pdf_path)
+
+    def classify_page(self, page) -> Tuple[str, Dict]:
+        """依文字密度判斷頁面走文字層 (text_layer) 或視覺模型 (vision)"""
+        text = page.get_text()
+        chars = len("".join(text.split()))
+        garbled = _garbled_ratio(text)
+
+        # 計算圖片覆蓋頁面的比例，整頁掃描圖通常接近 1
+        page_area = abs(page.rect) or 1
+        image_area = 0.0
+        for info in page.get_image_info():
+            image_area += abs(fitz.Rect(info["bbox"]) & page.rect)
+        coverage = min(image_area / page_area, 1.0)
+
+        stats = {
+            "chars": chars,
+            "garbled_ratio": round(garbled, 4),
+            "image_coverage": round(coverage, 4),
+        }
+
+        if not TEXT_LAYER_FAST_PATH:
+            return "vision", stats
+        if chars < TEXT_LAYER_MIN_CHARS:
+            return "vision", stats
+        if garbled > TEXT_LAYER_MAX_GARBLED_RATIO:
+            return "vision", stats
+        if coverage > TEXT_LAYER_MAX_IMAGE_COVERAGE:
+            return "vision", stats
+        return "text_layer", stats
+
+    def extract_page_text(self, page) -> str:
+        """以版面順序在本地解析頁面文字，表格轉為 Markdown"""
+        parts = []
+        table_rects = []
+
+        # 先擷取表格，保留欄列結構
         try:
-            # 先上傳文件
-            with open(self.pdf_path, "rb") as file:
-                response = self.client.files.create(
-                    file=file,
-                    purpose="user_data"
+            for table in page.find_tables().tables:
+                markdown = table.to_markdown().strip()
+                if markdown:
+                    parts.append((table.bbox[1], table.bbox[0], markdown))
+                    table_rects.append(fitz.Rect(table.bbox))
+        except Exception as e:
+            print(f"解析第 {page.number + 1} 頁表格時出錯（略過）: {str(e)}")
+
+        # 其餘文字區塊依閱讀順序（由上而下、由左而右）排列
+        for x0, y0, x1, y1, block_text, _, block_type in page.get_text("blocks", sort=True):
+            if block_type != 0:
+                continue
+            block_rect = fitz.Rect(x0, y0, x1, y1)
+            if any(block_rect.intersects(rect) for rect in table_rects):
+                continue
+            # 去除整行都是亂碼的裝飾文字
+            lines = [
+                line.strip()
+                for line in block_text.splitlines()
+                if line.strip() and _garbled_ratio(line) <= 0.5
+            ]
+            if lines:
+                parts.append((y0, x0, "\n".join(lines)))
+
+        parts.sort(key=lambda part: (round(part[0]), part[1]))
+        body = "\n\n".join(part[2] for part in parts)
+        return f"## (第{page.number + 1}頁)\n\n{body}"
+
+    def _build_vision_pdf(self, pdf, page_numbers: List[int]) -> str:
+        """將需送往視覺模型的頁面另存為臨時 PDF"""
+        with fitz.open() as subset:
+            for page_number in page_numbers:
+                subset.insert_pdf(pdf, from_page=page_number - 1, to_page=page_number - 1)
+            fd, subset_path = tempfile.mkstemp(suffix=".pdf", prefix="vision_")
+            os.close(fd)
+            subset.save(subset_path)
+        return subset_path
+
+    def _request_structured(self, content: List[Dict], schema_name: str, schema: Dict) -> Dict:
+        """以 JSON Schema 限制 GPT-4o 的輸出格式，回傳解析後的物件"""
+        response = self.client.chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": content}],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": schema_name, "strict": True, "schema": schema},
+            },
+        )
+        return json.loads(response.choices[0].message.content)
+
+    def _extract_records(self, source_part: Dict, intro: str, pages: List[int],
+                         image_counts: Dict[int, int]) -> Dict:
+        """擷取結構化產品紀錄並逐筆驗證，不合格的紀錄個別重試
+
+        回傳 {"products": [...], "page_text": str, "retried": int, "dropped": int}。
+        """
+        result = self._request_structured(
+            [source_part, {"type": "text", "text": f"{intro}\n\n{PRODUCT_PROMPT}"}],
+            "product_page",
+            PRODUCT_PAGE_SCHEMA,
+        )
+
+        records = []
+        retried = dropped = 0
+        for record in result["products"]:
+            attempt = 0
+            while True:
+                # 單頁請求的頁碼是已知的，不依賴模型填寫
+                if len(pages) == 1:
+                    record["page"] = pages[0]
+                errors = validate_product_record(record, pages, image_counts)
+                if not errors or attempt >= SCHEMA_MAX_RETRIES:
+                    break
+                attempt += 1
+                retried += 1
+                print(f"產品紀錄 {record.get('model')} 驗證失敗，第 {attempt} 次重試: {'；'.join(errors)}")
+                retry_text = (
+                    f"{intro}\n\n以下這筆產品紀錄未通過驗證：\n"
+                    f"{json.dumps(record, ensure_ascii=False)}\n\n"
+                    f"錯誤：{'；'.join(errors)}\n\n"
+                    f"請對照文件只重新擷取這一筆產品。\n\n{PRODUCT_PROMPT}"
+                )
+                record = self._request_structured(
+                    [source_part, {"type": "text", "text": retry_text}],
+                    "product_record",
+                    PRODUCT_RECORD_SCHEMA,
                 )
-                file_id = response.id
-            
-            # 使用文件 ID 進行處理
-            text = """請詳細描述這個產品目錄中的所有產品資訊，並標註每個產品在PDF中的頁碼，格式如下：
-
-### [產品型號] (第X頁)
-- **產品名稱**: [名稱]
-- **產品描述**: [描述，包含配件和電池資訊]
-- **尺寸規格**: [尺寸]
-- **裝箱數量**: [數量]
-- **建議售價**: [價格]
-
-請確保每個產品資訊都標註所在頁碼。"""
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "file",
-                                "file": {
-                                    "file_id": file_id
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": text
-                            }
-                        ]
-                    }
-                ]
+            if errors:
+                dropped += 1
+                print(f"捨棄無效的產品紀錄 {record.get('model')}: {'；'.join(errors)}")
+                continue
+            records.append(record)
+
+        return {
+            "products": records,
+            "page_text": result["page_text"].strip(),
+            "retried": retried,
+            "dropped": dropped,
+        }
+
+    def _process_with_gpt(self, pdf_path: str, image_counts: Dict[int, int]) -> Dict:
+        """上傳 PDF 至 GPT-4o 並取得結構化產品紀錄（頁碼為上傳文件中的頁碼）"""
+        # 先上傳文件
+        with open(pdf_path, "rb") as file:
+            response = self.client.files.create(
+                file=file,
+                purpose="user_data"
+            )
+            file_id = response.id
+
+        # 使用文件 ID 進行處理，重試時沿用同一個文件
+        try:
+            with fitz.open(pdf_path) as pdf:
+                pages = list(range(1, len(pdf) + 1))
+            return self._extract_records(
+                {"type": "file", "file": {"file_id": file_id}},
+                f"這份產品目錄共 {len(pages)} 頁。",
+                pages,
+                image_counts,
             )
-            
+        finally:
             # 處理完成後刪除上傳的文件
             try:
                 self.client.files.delete(file_id)
             except Exception as e:
                 print(f"刪除文件時出錯: {str(e)}")
-            
-            # 提取圖片
-            images = self.extract_images()
-            
-            # 將圖片信息轉換為字符串格式
-            images_str = {}
-            for key, value in images.items():
-                images_str[key] = f"{value['path']}|{value['page']}"
-            
-            # 將圖片資訊加入 metadata
-            doc = Document(
-                page_content=response.choices[0].message.content,
-                metadata={
-                    "source": self.pdf_path,
-                    "filename": os.path.basename(self.pdf_path),
-                    "extraction_method": "gpt4o",
-                    "images": json.dumps(images_str)  # 將字典轉換為 JSON 字符串
+
+    def _ocr_page_image(self, rendered: Dict, image_count: int) -> Dict:
+        """將渲染好的單頁圖片送 GPT-4o 取得結構化產品紀錄"""
+        encoded = base64.b64encode(rendered["data"]).decode("utf-8")
+        page_number = rendered["page"]
+        return self._extract_records(
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{rendered['mime_type']};base64,{encoded}",
+                    "detail": "high"
+                }
+            },
+            f"這是產品目錄的第{page_number}頁，頁面上共有 {image_count} 張圖片。",
+            [page_number],
+            {page_number: image_count},
+        )
+
+    def _process_pages_as_images(self, page_numbers: List[int],
+                                 image_counts: Dict[int, int]) -> Dict[int, Dict]:
+        """邊渲染邊送出：渲染階段產出一頁就交給 GPT-4o，在途請求數有上限"""
+        results = {}
+        with ThreadPoolExecutor(max_workers=VISION_CONCURRENCY) as executor:
+            pending = {}
+            for rendered in render_pages(self.pdf_path, page_numbers, profile="vision"):
+                # 請求已滿時先等待，渲染端也隨之暫停，避免圖片堆積在記憶體中
+                while len(pending) >= VISION_CONCURRENCY:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[pending.pop(future)] = future.result()
+                future = executor.submit(
+                    self._ocr_page_image, rendered, image_counts.get(rendered["page"], 0)
+                )
+                pending[future] = rendered["page"]
+
+            for future in list(pending):
+                results[pending.pop(future)] = future.result()
+        return results
+
+    def _records_to_documents(self, result: Dict, page_number=None) -> List[Document]:
+        """將結構化擷取結果轉為文檔：每筆產品一個文檔，頁面其他文字另成一個文檔"""
+        base_metadata = {
+            "source": self.pdf_path,
+            "filename": os.path.basename(self.pdf_path),
+            "extraction_method": "gpt4o",
+        }
+        documents = []
+        for record in result["products"]:
+            metadata = {
+                **base_metadata,
+                "record_type": "product",
+                "page": record["page"],
+                "product_model": record["model"],
+                "product_prefix": record["model"].split("-")[0].strip().upper(),
+                "product_name": record["name"],
+                # 產品對應的圖片鍵，查詢時只附上這些圖片
+                "image_refs": ",".join(f"page_{record['page']}_{ref}" for ref in record["image_refs"]),
+            }
+            if record.get("pack_quantity") is not None:
+                metadata["pack_quantity"] = record["pack_quantity"]
+            if record.get("price"):
+                metadata["price"] = record["price"]
+            documents.append(Document(page_content=format_product_record(record), metadata=metadata))
+
+        if result["page_text"]:
+            metadata = {**base_metadata, "record_type": "page_text"}
+            content = result["page_text"]
+            if page_number is not None:
+                metadata["page"] = page_number
+                content = f"## (第{page_number}頁)\n\n{content}"
+            documents.append(Document(page_content=content, metadata=metadata))
+        return documents
+
+    def process(self) -> list[Document]:
+        """處理 PDF 文件：文字層頁面本地解析，圖像頁面送 GPT-4o"""
+        image_executor = ProcessPoolExecutor(max_workers=1)
+        try:
+            start_time = time.time()
+
+            # 圖片提取在獨立進程中與頁面解析、GPT-4o 請求同時進行
+            images_future = image_executor.submit(extract_pdf_images, self.pdf_path)
+
+            with fitz.open(self.pdf_path) as pdf:
+                # 逐頁分類
+                text_pages = []
+                vision_pages = []
+                page_stats = {}
+                for page in pdf:
+                    route, stats = self.classify_page(page)
+                    page_stats[page.number + 1] = {"route": route, **stats}
+                    if route == "text_layer":
+                        text_pages.append(page.number + 1)
+                    else:
+                        vision_pages.append(page.number + 1)
+
+                documents = []
+
+                # 文字層頁面：本地解析，每頁一個文檔
+                for page_number in text_pages:
+                    documents.append(Document(
+                        page_content=self.extract_page_text(pdf[page_number - 1]),
+                        metadata={
+                            "source": self.pdf_path,
+                            "filename": os.path.basename(self.pdf_path),
+                            "extraction_method": "text_layer",
+                            "page": page_number,
+                        },
+                    ))
+
+                # 每頁圖片數量，讓模型以編號指出產品對應的圖片
+                image_counts = {
+                    page_number: len(pdf[page_number - 1].get_images()) for page_number in vision_pages
                 }
+                structured_stats = {"products": 0, "retried": 0, "dropped": 0}
+
+                def collect(result: Dict, page_number=None):
+                    structured_stats["products"] += len(result["products"])
+                    structured_stats["retried"] += result["retried"]
+                    structured_stats["dropped"] += result["dropped"]
+                    documents.extend(self._records_to_documents(result, page_number))
+
+                # 圖像頁面：逐頁渲染後送 GPT-4o 擷取結構化產品紀錄
+                if vision_pages and VISION_INPUT_MODE == "images":
+                    page_results = self._process_pages_as_images(vision_pages, image_counts)
+                    for page_number in vision_pages:
+                        collect(page_results[page_number], page_number)
+
+                # 圖像頁面：上傳 PDF 文件送 GPT-4o 處理
+                elif vision_pages:
+                    if len(vision_pages) == len(pdf):
+                        result = self._process_with_gpt(self.pdf_path, image_counts)
+                    else:
+                        subset_path = self._build_vision_pdf(pdf, vision_pages)
+                        try:
+                            result = self._process_with_gpt(
+                                subset_path,
+                                {i + 1: image_counts[page] for i, page in enumerate(vision_pages)},
+                            )
+                        finally:
+                            os.remove(subset_path)
+                        # 子文件的頁碼換回原文件頁碼
+                        for record in result["products"]:
+                            record["page"] = vision_pages[record["page"] - 1]
+                    collect(result)
+
+                # 等待圖片提取完成並登記引用，圖片與 chunk 的對應於入庫時建立
+                images = images_future.result()
+                stage_source_images(self.pdf_path, images)
+
+                total_pages = len(pdf)
+
+            self.report = {
+                "total_pages": total_pages,
+                "text_layer_pages": len(text_pages),
+                "vision_pages": len(vision_pages),
+                "text_layer_page_numbers": text_pages,
+                "vision_page_numbers": vision_pages,
+                "structured_records": structured_stats,
+                "elapsed_seconds": round(time.time() - start_time, 2),
+                "pages": page_stats,
+            }
+            print(
+                f"頁面處理路徑: 共 {total_pages} 頁，文字層 {len(text_pages)} 頁，"
+                f"GPT-4o {len(vision_pages)} 頁，耗時 {self.report['elapsed_seconds']} 秒"
             )
-            
-            return [doc]
-            
+
+            return documents
+
         except Exception as e:
             print(f"GPT-4o 處理時出錯: {str(e)}")
             raise
+        finally:
+            image_executor.shutdown(wait=False, cancel_futures=True)
 
 def process_pdf_with_gpt(pdf_path: str) -> List[Document]:
     """使用 GPT-4o 處理 PDF 文件的便捷函數"""
@@ -0,0 +1,592 @@
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from app.utils.vector_store import current_generation, generation_path
+
+# 圖片以內容雜湊命名存放，相同圖片在不同頁面、不同文件之間只存一份
+IMAGE_DIR = os.path.join(os.getcwd(), "static", "images", "products")
+IMAGE_URL_PREFIX = "/images/products"
+BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
+IMAGE_INDEX_PATH = os.path.join(BASE_PATH, 'image_store.sqlite3')
+
+# 瀏覽器可直接顯示的格式，其餘格式（jpx、jbig2、tiff 等）轉為 PNG
+WEB_IMAGE_EXTENSIONS = {"png", "jpeg", "jpg", "gif", "webp", "bmp"}
+
+# 入庫時預先產生的 WebP 版本：名稱 -> 長邊上限（None 表示原尺寸）
+IMAGE_VARIANTS = {
+    "thumb": 256,
+    "medium": 800,
+    "original": None,
+}
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", str(os.cpu_count() or 1)))
+
+
+# 依索引世代區分的表（舊版沒有 generation 欄位，首次開啟時歸入使用中的世代）
+_GENERATION_TABLES = {
+    "image_refs": "source, hash",
+    "source_images": "source, image_key, hash, page",
+    "chunk_pages": "chunk_id, source, page",
+}
+
+
+def _migrate_generation_tables(conn: sqlite3.Connection):
+    """舊版的引用表沒有 generation 欄位：改名保留，建立新表後歸入使用中的世代"""
+    for table in _GENERATION_TABLES:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if columns and "generation" not in columns:
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            for index in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (f"{table}_legacy",),
+            ).fetchall():
+                conn.execute(f"DROP INDEX {index[0]}")
+
+
+def _adopt_legacy_tables(conn: sqlite3.Connection):
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    generation = None
+    for table, columns in _GENERATION_TABLES.items():
+        if f"{table}_legacy" not in existing:
+            continue
+        generation = generation or current_generation()
+        conn.execute(
+            f"INSERT OR IGNORE INTO {table} (generation, {columns}) "
+            f"SELECT ?, {columns} FROM {table}_legacy",
+            (generation,),
+        )
+        conn.execute(f"DROP TABLE {table}_legacy")
+    if generation:
+        print(f"已將舊版圖片引用歸入索引世代 {generation}")
+
+
+@contextmanager
+def _connect():
+    """開啟圖片引用索引，離開時提交並關閉連線
+
+    圖片檔與版本由內容雜湊共用；引用、頁面位置與 chunk 頁碼則依索引世代各自記錄，
+    背景重建或遷移寫入新世代時不影響使用中的世代，切換後舊世代的紀錄隨世代刪除。
+    """
+    os.makedirs(os.path.dirname(IMAGE_INDEX_PATH), exist_ok=True)
+    conn = sqlite3.connect(IMAGE_INDEX_PATH, timeout=30)
+    _migrate_generation_tables(conn)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS images ("
+        "hash TEXT PRIMARY KEY, path TEXT NOT NULL, ext TEXT NOT NULL, size INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS image_refs ("
+        "generation TEXT NOT NULL, source TEXT NOT NULL, hash TEXT NOT NULL, "
+        "PRIMARY KEY (generation, source, hash))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_refs_hash ON image_refs (hash)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS image_variants ("
+        "hash TEXT NOT NULL, variant TEXT NOT NULL, path TEXT NOT NULL, "
+        "width INTEGER NOT NULL, height INTEGER NOT NULL, size INTEGER NOT NULL, "
+        "PRIMARY KEY (hash, variant))"
+    )
+    # 來源文件中每張圖片出現的位置（同一張圖可出現在多頁）
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS source_images ("
+        "generation TEXT NOT NULL, source TEXT NOT NULL, image_key TEXT NOT NULL, "
+        "hash TEXT NOT NULL, page INTEGER NOT NULL, "
+        "PRIMARY KEY (generation, source, image_key))"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_source_images_page ON source_images (generation, source, page)"
+    )
+    # 旁路索引：每個 chunk 涵蓋的頁碼，查詢時據此取出該 chunk 自己頁面上的圖片
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunk_pages ("
+        "generation TEXT NOT NULL, chunk_id TEXT NOT NULL, source TEXT NOT NULL, page INTEGER NOT NULL, "
+        "PRIMARY KEY (generation, chunk_id, page))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_pages_source ON chunk_pages (generation, source)")
+    # 提取中的圖片：寫入圖片檔前先登記，登記引用（commit_source_images）時移除，
+    # 回收時視同引用，避免並行刪除其他文件時刪掉即將被引用的共用圖片
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS image_leases ("
+        "source TEXT NOT NULL, hash TEXT NOT NULL, ext TEXT NOT NULL, created_at REAL NOT NULL, "
+        "PRIMARY KEY (source, hash))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_leases_hash ON image_leases (hash)")
+    # 提取完成、尚未寫入索引的圖片位置；入庫時才登記到寫入的世代
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS staged_images ("
+        "source TEXT NOT NULL, image_key TEXT NOT NULL, hash TEXT NOT NULL, page INTEGER NOT NULL, "
+        "PRIMARY KEY (source, image_key))"
+    )
+    _adopt_legacy_tables(conn)
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def image_relative_path(digest: str, ext: str) -> str:
+    """依雜湊前兩碼分目錄，避免單一目錄檔案過多"""
+    return f"{digest[:2]}/{digest}.{ext}"
+
+
+def variant_relative_path(digest: str, variant: str) -> str:
+    return f"{digest[:2]}/{digest}_{variant}.webp"
+
+
+def generate_variants(digest: str, ext: str) -> Dict[str, Dict]:
+    """為單張圖片產生各尺寸的 WebP 版本，已存在的版本不重複產生"""
+    with Image.open(os.path.join(IMAGE_DIR, image_relative_path(digest, ext))) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        variants = {}
+        for variant, max_side in IMAGE_VARIANTS.items():
+            resized = image
+            if max_side and max(image.size) > max_side:
+                resized = image.copy()
+                resized.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            # 原圖已小於版本上限時不另存一份，直接指向原尺寸版本
+            relative_path = variant_relative_path(
+                digest, variant if resized is not image else "original"
+            )
+            variant_path = os.path.join(IMAGE_DIR, relative_path)
+
+            if not os.path.exists(variant_path):
+                buffered = io.BytesIO()
+                resized.save(buffered, format="WEBP", quality=IMAGE_VARIANT_QUALITY, method=4)
+                temp_path = f"{variant_path}.{os.getpid()}.tmp"
+                with open(temp_path, "wb") as variant_file:
+                    variant_file.write(buffered.getvalue())
+                os.replace(temp_path, variant_path)
+
+            variants[variant] = {
+                "path": f"{IMAGE_URL_PREFIX}/{relative_path}",
+                "width": resized.width,
+                "height": resized.height,
+                "size": os.path.getsize(variant_path),
+            }
+    return variants
+
+
+def _generate_variants_safe(digest: str, ext: str) -> Dict[str, Dict]:
+    try:
+        return generate_variants(digest, ext)
+    except Exception as e:
+        print(f"產生圖片版本時出錯 {digest}（略過）: {str(e)}")
+        return {}
+
+
+def generate_all_variants(images: Iterable[Dict]) -> Dict[str, Dict]:
+    """在進程池中為多張圖片產生 WebP 版本，回傳 {雜湊: 各版本資訊}"""
+    unique = {image["hash"]: image["ext"] for image in images}
+    if not unique:
+        return {}
+
+    digests = list(unique)
+    workers = min(max(1, IMAGE_VARIANT_WORKERS), len(digests))
+    if workers == 1:
+        return {digest: _generate_variants_safe(digest, unique[digest]) for digest in digests}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _generate_variants_safe, digests, [unique[d] for d in digests], chunksize=4
+        )
+        return dict(zip(digests, results))
+
+
+def _lease_image(source: str, digest: str, ext: str):
+    """寫入圖片檔前先登記提取中的圖片（提交後回收就不會刪除這張圖片）"""
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO image_leases (source, hash, ext, created_at) VALUES (?, ?, ?, ?)",
+            (source, digest, ext, time.time()),
+        )
+
+
+def save_image_bytes(image_bytes: bytes, ext: str, source: Optional[str] = None) -> Dict:
+    """以內容雜湊保存圖片，內容相同時不重複寫入
+
+    source 指定時先登記為該來源提取中的圖片再寫入，之後由 commit_source_images 轉為正式引用。
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    relative_path = image_relative_path(digest, ext)
+    image_path = os.path.join(IMAGE_DIR, relative_path)
+    if source is not None:
+        _lease_image(source, digest, ext)
+
+    if not os.path.exists(image_path):
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        # 先寫臨時檔再改名，並行寫入相同圖片時也不會出現半個檔案
+        temp_path = f"{image_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as image_file:
+            image_file.write(image_bytes)
+        os.replace(temp_path, image_path)
+
+    return {
+        "hash": digest,
+        "ext": ext,
+        "size": len(image_bytes),
+        "path": f"{IMAGE_URL_PREFIX}/{relative_path}",
+    }
+
+
+def _extract_xref(pdf, xref: int, smask: int):
+    """提取單張內嵌圖片，回傳 (圖片位元組, 副檔名)"""
+    base_image = pdf.extract_image(xref)
+    ext = base_image["ext"].lower()
+
+    # 帶透明遮罩或瀏覽器不支持的格式，重新編碼為 PNG
+    if smask or ext not in WEB_IMAGE_EXTENSIONS:
+        pix = fitz.Pixmap(pdf, xref)
+        if smask:
+            pix = fitz.Pixmap(pix, fitz.Pixmap(pdf, smask))
+        if pix.colorspace and pix.colorspace.n > 3:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        return pix.tobytes("png"), "png"
+
+    return base_image["image"], "jpeg" if ext == "jpg" else ext
+
+
+def extract_pdf_images(pdf_path: str) -> Dict[str, Dict]:
+    """從 PDF 提取圖片並存入圖片庫
+
+    同一個 xref 只提取一次，但在每個出現的頁面都會記錄一筆。
+    回傳 {"page_{頁碼}_{序號}": {"path", "page", "hash", "ext", "size"}}。
+    """
+    images = {}
+    extracted = {}
+    pdf = fitz.open(pdf_path)
+
+    try:
+        for page_num in range(len(pdf)):
+            page = pdf[page_num]
+
+            for img_index, img in enumerate(page.get_images()):
+                xref, smask = img[0], img[1]
+                if xref not in extracted:
+                    try:
+                        image_bytes, ext = _extract_xref(pdf, xref, smask)
+                        extracted[xref] = save_image_bytes(image_bytes, ext, source=pdf_path)
+                    except Exception as e:
+                        print(f"提取圖片 xref={xref} 時出錯（略過）: {str(e)}")
+                        extracted[xref] = None
+                if extracted[xref] is None:
+                    continue
+
+                # 記錄圖片路徑和頁碼
+                images[f"page_{page_num+1}_{img_index+1}"] = {
+                    **extracted[xref],
+                    "page": page_num + 1,
+                }
+    finally:
+        pdf.close()
+
+    # 為新圖片產生縮圖等版本，並把尺寸資訊附到每筆紀錄上
+    variants = generate_all_variants(image for image in extracted.values() if image)
+    for image in images.values():
+        image_variants = variants.get(image["hash"], {})
+        image["variants"] = image_variants
+        if "original" in image_variants:
+            image["width"] = image_variants["original"]["width"]
+            image["height"] = image_variants["original"]["height"]
+
+    return images
+
+
+def stage_source_images(source: str, images: Dict[str, Dict]):
+    """登記本次提取結果，等文件寫入索引時（commit_source_images）才成為該世代的圖片引用
+
+    images 為 extract_pdf_images 的回傳值：{圖片鍵: 圖片資訊}；提取中的登記保留到入庫或放棄為止。
+    """
+    unique = {image["hash"]: image for image in images.values()}
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO images (hash, path, ext, size) VALUES (?, ?, ?, ?)",
+            [(h, image["path"], image["ext"], image["size"]) for h, image in unique.items()],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO image_variants (hash, variant, path, width, height, size) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (h, variant, info["path"], info["width"], info["height"], info["size"])
+                for h, image in unique.items()
+                for variant, info in image.get("variants", {}).items()
+            ],
+        )
+        conn.execute("DELETE FROM staged_images WHERE source = ?", (source,))
+        conn.executemany(
+            "INSERT INTO staged_images (source, image_key, hash, page) VALUES (?, ?, ?, ?)",
+            [(source, key, image["hash"], image["page"]) for key, image in images.items()],
+        )
+
+
+def _replace_source_images(conn: sqlite3.Connection, source: str, generation: str,
+                           layout: List[Tuple[str, str, int]]) -> set:
+    """以 [(圖片鍵, 雜湊, 頁碼)] 取代來源文件在世代中的圖片，回傳原本引用的雜湊"""
+    old_hashes = {
+        row[0] for row in conn.execute(
+            "SELECT hash FROM image_refs WHERE generation = ? AND source = ?", (generation, source)
+        )
+    }
+    conn.execute("DELETE FROM image_refs WHERE generation = ? AND source = ?", (generation, source))
+    conn.executemany(
+        "INSERT OR IGNORE INTO image_refs (generation, source, hash) VALUES (?, ?, ?)",
+        [(generation, source, digest) for _, digest, _ in layout],
+    )
+    conn.execute("DELETE FROM source_images WHERE generation = ? AND source = ?", (generation, source))
+    conn.executemany(
+        "INSERT INTO source_images (generation, source, image_key, hash, page) VALUES (?, ?, ?, ?, ?)",
+        [(generation, source, key, digest, page) for key, digest, page in layout],
+    )
+    return old_hashes
+
+
+def commit_source_images(source: str, generation: Optional[str] = None) -> bool:
+    """文件寫入索引後，把提取時登記的圖片轉為世代的正式引用，並回收不再被引用的圖片
+
+    沒有登記中的提取結果（例如非 PDF 或本地 OCR）時不變更，回傳是否有登記。
+    """
+    generation = generation or current_generation()
+    with _connect() as conn:
+        layout = conn.execute(
+            "SELECT image_key, hash, page FROM staged_images WHERE source = ?", (source,)
+        ).fetchall()
+        leased = _release_leases(conn, source)
+        if not layout and not leased:
+            return False
+        conn.execute("DELETE FROM staged_images WHERE source = ?", (source,))
+        old_hashes = _replace_source_images(conn, source, generation, layout)
+        _collect_garbage(conn, (old_hashes | set(leased)) - {digest for _, digest, _ in layout}, leased)
+    return True
+
+
+def discard_staged_images(source: str) -> int:
+    """放棄來源文件尚未入庫的提取結果（處理失敗時），回傳刪除的圖片數"""
+    with _connect() as conn:
+        staged = {
+            row[0] for row in conn.execute("SELECT hash FROM staged_images WHERE source = ?", (source,))
+        }
+        conn.execute("DELETE FROM staged_images WHERE source = ?", (source,))
+        leased = _release_leases(conn, source)
+        removed = _collect_garbage(conn, staged | set(leased), leased)
+    return sum(1 for path in removed if "_" not in os.path.basename(path))
+
+
+def set_source_images(source: str, images: Dict[str, Dict], generation: Optional[str] = None):
+    """以提取結果直接取代來源文件在世代中的圖片引用（提取後立即入庫時使用）"""
+    stage_source_images(source, images)
+    commit_source_images(source, generation)
+
+
+def copy_source_images(from_generation: str, to_generation: str, sources: Optional[Iterable[str]] = None):
+    """把來源文件的圖片引用與 chunk 頁碼從一個世代複製到另一個世代（取代目標世代中這些來源的紀錄）
+
+    sources 未指定時複製全部來源。
+    """
+    with _connect() as conn:
+        if sources is None:
+            sources = [
+                row[0] for row in conn.execute(
+                    "SELECT DISTINCT source FROM source_images WHERE generation = ? UNION "
+                    "SELECT DISTINCT source FROM chunk_pages WHERE generation = ?",
+                    (from_generation, from_generation),
+                )
+            ]
+        old_hashes = set()
+        for source in sources:
+            layout = conn.execute(
+                "SELECT image_key, hash, page FROM source_images WHERE generation = ? AND source = ?",
+                (from_generation, source),
+            ).fetchall()
+            old_hashes |= _replace_source_images(conn, source, to_generation, layout)
+            conn.execute(
+                "DELETE FROM chunk_pages WHERE generation = ? AND source = ?", (to_generation, source)
+            )
+            conn.execute(
+                "INSERT INTO chunk_pages (generation, chunk_id, source, page) "
+                "SELECT ?, chunk_id, source, page FROM chunk_pages WHERE generation = ? AND source = ?",
+                (to_generation, from_generation, source),
+            )
+        _collect_garbage(conn, old_hashes)
+
+
+def release_source_images(source: str, generation: Optional[str] = None) -> int:
+    """移除來源文件在世代中的圖片引用，刪除引用數歸零的圖片，回傳刪除的圖片數
+
+    未指定世代時（文件被刪除）移除使用中世代的引用，並一併放棄提取中的登記。
+    """
+    with _connect() as conn:
+        leased, staged = {}, set()
+        if generation is None:
+            staged = {
+                row[0] for row in conn.execute("SELECT hash FROM staged_images WHERE source = ?", (source,))
+            }
+            conn.execute("DELETE FROM staged_images WHERE source = ?", (source,))
+            leased = _release_leases(conn, source)
+        generation = generation or current_generation()
+        hashes = {
+            row[0] for row in conn.execute(
+                "SELECT hash FROM image_refs WHERE generation = ? AND source = ?", (generation, source)
+            )
+        }
+        conn.execute("DELETE FROM image_refs WHERE generation = ? AND source = ?", (generation, source))
+        conn.execute("DELETE FROM source_images WHERE generation = ? AND source = ?", (generation, source))
+        conn.execute("DELETE FROM chunk_pages WHERE generation = ? AND source = ?", (generation, source))
+        removed = _collect_garbage(conn, hashes | staged | set(leased), leased)
+    return sum(1 for path in removed if "_" not in os.path.basename(path))
+
+
+def drop_generation_images(generation: str) -> int:
+    """移除整個世代的圖片引用與 chunk 頁碼（世代被放棄或刪除時），回傳刪除的圖片數"""
+    with _connect() as conn:
+        hashes = {
+            row[0] for row in conn.execute("SELECT DISTINCT hash FROM image_refs WHERE generation = ?", (generation,))
+        }
+        conn.execute("DELETE FROM image_refs WHERE generation = ?", (generation,))
+        conn.execute("DELETE FROM source_images WHERE generation = ?", (generation,))
+        conn.execute("DELETE FROM chunk_pages WHERE generation = ?", (generation,))
+        removed = _collect_garbage(conn, hashes)
+    return sum(1 for path in removed if "_" not in os.path.basename(path))
+
+
+def drop_orphaned_generation_images():
+    """移除目錄已不存在的世代留下的紀錄（例如刪除世代途中服務中斷）"""
+    with _connect() as conn:
+        generations = [
+            row[0] for row in conn.execute(
+                "SELECT generation FROM image_refs UNION SELECT generation FROM chunk_pages"
+            )
+        ]
+    for generation in generations:
+        if generation != current_generation() and not os.path.isdir(generation_path(generation)):
+            removed = drop_generation_images(generation)
+            print(f"已移除已刪除世代 {generation} 的圖片紀錄，回收 {removed} 張圖片")
+
+
+def set_chunk_pages(source: str, chunk_pages: Dict[str, Iterable[int]], generation: Optional[str] = None):
+    """登記來源文件各 chunk 涵蓋的頁碼，取代該來源在世代中先前的紀錄"""
+    generation = generation or current_generation()
+    with _connect() as conn:
+        conn.execute("DELETE FROM chunk_pages WHERE generation = ? AND source = ?", (generation, source))
+        conn.executemany(
+            "INSERT OR IGNORE INTO chunk_pages (generation, chunk_id, source, page) VALUES (?, ?, ?, ?)",
+            [
+                (generation, chunk_id, source, page)
+                for chunk_id, pages in chunk_pages.items()
+                for page in pages
+            ],
+        )
+
+
+def get_chunk_images(chunk_ids: Iterable[str], generation: Optional[str] = None) -> Dict[str, List[Dict]]:
+    """一次查出多個 chunk 各自頁面上的圖片（使用中的世代），回傳 {chunk_id: [圖片資訊]}"""
+    chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id]
+    if not chunk_ids:
+        return {}
+
+    generation = generation or current_generation()
+    placeholders = ",".join("?" * len(chunk_ids))
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT cp.chunk_id, si.image_key, si.page, i.path, "
+            "v.variant, v.path, v.width, v.height, v.size "
+            "FROM chunk_pages cp "
+            "JOIN source_images si ON si.generation = cp.generation AND si.source = cp.source "
+            "AND si.page = cp.page "
+            "JOIN images i ON i.hash = si.hash "
+            "LEFT JOIN image_variants v ON v.hash = si.hash "
+            f"WHERE cp.generation = ? AND cp.chunk_id IN ({placeholders}) "
+            "ORDER BY cp.chunk_id, si.page, si.rowid",
+            [generation, *chunk_ids],
+        ).fetchall()
+
+    result: Dict[str, List[Dict]] = {}
+    entries: Dict[Tuple[str, str], Dict] = {}
+    for chunk_id, key, page, path, variant, variant_path, width, height, size in rows:
+        entry = entries.get((chunk_id, key))
+        if entry is None:
+            entry = {"key": key, "path": path, "page": page, "variants": {}}
+            entries[(chunk_id, key)] = entry
+            result.setdefault(chunk_id, []).append(entry)
+        if variant:
+            entry["variants"][variant] = {
+                "path": variant_path,
+                "width": width,
+                "height": height,
+                "size": size,
+            }
+            if variant == "original":
+                entry["width"] = width
+                entry["height"] = height
+    return result
+
+
+def image_ref_count(digest: str) -> int:
+    """查詢圖片被多少份文件引用（各世代合計）"""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT COUNT(DISTINCT source) FROM image_refs WHERE hash = ?", (digest,)
+        ).fetchone()
+    return row[0]
+
+
+def _release_leases(conn: sqlite3.Connection, source: str) -> Dict[str, str]:
+    """移除來源提取中的圖片登記，回傳 {雜湊: 副檔名}"""
+    leases = dict(conn.execute("SELECT hash, ext FROM image_leases WHERE source = ?", (source,)).fetchall())
+    conn.execute("DELETE FROM image_leases WHERE source = ?", (source,))
+    return leases
+
+
+def _collect_garbage(conn: sqlite3.Connection, hashes: Iterable[str],
+                     extensions: Optional[Dict[str, str]] = None) -> List[str]:
+    """從索引中移除沒有任何引用的圖片並刪除檔案，回傳刪除的相對路徑
+
+    任一世代仍引用或仍在提取中的圖片都會保留。
+    檔案在同一交易中（提交前）刪除：登記提取中的圖片需要等這個交易結束，
+    因此不會發生「檢查時圖片還在、登記後才被刪除」的情況。
+    extensions 提供尚未寫入 images 表（只登記為提取中）的圖片副檔名。
+    """
+    extensions = extensions or {}
+    removed = []
+    for digest in hashes:
+        referenced = conn.execute(
+            "SELECT 1 FROM image_refs WHERE hash = ? UNION ALL "
+            "SELECT 1 FROM image_leases WHERE hash = ? LIMIT 1",
+            (digest, digest),
+        ).fetchone()
+        if referenced:
+            continue
+        row = conn.execute("SELECT ext FROM images WHERE hash = ?", (digest,)).fetchone()
+        ext = row[0] if row else extensions.get(digest)
+        if row:
+            conn.execute("DELETE FROM images WHERE hash = ?", (digest,))
+        if ext:
+            removed.append(image_relative_path(digest, ext))
+        conn.execute("DELETE FROM image_variants WHERE hash = ?", (digest,))
+        # 提取後尚未登記的圖片也可能已產生版本檔，依名稱全部嘗試刪除
+        removed.extend(variant_relative_path(digest, variant) for variant in IMAGE_VARIANTS)
+    _unlink_images(removed)
+    return removed
+
+
+def _unlink_images(relative_paths: Iterable[str]):
+    for relative_path in relative_paths:
+        image_path = os.path.join(IMAGE_DIR, relative_path)
+        try:
+            if os.path.exists(image_path):
+                os.remove(image_path)
+        except Exception as e:
+            print(f"刪除圖片失敗 {image_path}: {str(e)}")
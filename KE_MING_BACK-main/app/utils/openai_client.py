@@ -4,9 +4,26 @@ import time
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings  # 使用最新的包
 
+from app.utils.embedding_cache import EMBEDDING_CACHE_ENABLED, CachedEmbeddings
+
 # 確保載入環境變數
 load_dotenv()
 
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-3-small")
+# text-embedding-3 系列支援以 dimensions 參數截短向量（Matryoshka），未設定時使用模型原生維度
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+# 各嵌入模型的原生維度，未知模型以 1536 估算
+NATIVE_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def embedding_dimensions(model_name: str, dimensions: int = None) -> int:
+    """嵌入向量的實際維度：有指定截短維度時為該維度，否則為模型原生維度"""
+    return dimensions or NATIVE_EMBEDDING_DIMENSIONS.get(model_name, 1536)
+
 
 def get_openai_client():
     """獲取OpenAI客戶端實例"""
@@ -15,30 +32,36 @@ def get_openai_client():
     return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 
-def get_embeddings_model():
-    """獲取 OpenAI 嵌入模型"""
+def get_embeddings_model(model_name: str = None, dimensions: int = None):
+    """獲取 OpenAI 嵌入模型（外層包持久化快取），未指定時使用環境變數設定的模型與維度"""
     api_key = os.getenv("OPENAI_API_KEY")
 
     if not api_key:
         raise ValueError("找不到 OPENAI_API_KEY 環境變數")
 
-    print(
-        f"使用嵌入模型: {os.getenv('EMBEDDING_MODEL_NAME', 'text-embedding-3-small')}"
-    )
+    if model_name is None:
+        model_name, dimensions = EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSIONS
+    print(f"使用嵌入模型: {model_name}" + (f"，維度: {dimensions}" if dimensions else ""))
 
     # 添加重試和延遲機制
     try:
-        return OpenAIEmbeddings(
-            model=os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-3-small"),
+        embeddings = OpenAIEmbeddings(
+            model=model_name,
             openai_api_key=api_key,
+            dimensions=dimensions,
             request_timeout=60,  # 增加超時時間
         )
     except Exception as e:
         print(f"創建嵌入模型時出錯: {str(e)}")
         time.sleep(2)  # 延遲嘗試
         # 再次嘗試
-        return OpenAIEmbeddings(
-            model=os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-3-small"),
+        embeddings = OpenAIEmbeddings(
+            model=model_name,
             openai_api_key=api_key,
+            dimensions=dimensions,
             request_timeout=60,
         )
+
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, model=model_name, dimensions=embeddings.dimensions)
@@ -0,0 +1,160 @@
+import io
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+# 頁面渲染設定
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+RENDER_FORMAT = os.getenv("RENDER_FORMAT", "jpeg").lower()  # jpeg 或 webp
+RENDER_QUALITY = int(os.getenv("RENDER_QUALITY", "80"))
+# 同時在途（已提交但尚未被取走）的頁面上限，決定峰值記憶體
+RENDER_MAX_INFLIGHT = int(os.getenv("RENDER_MAX_INFLIGHT", str(RENDER_WORKERS * 2)))
+
+# 渲染參數組合：視覺模型的 high detail 會縮到 2048 以內，Tesseract 則需要較高 DPI
+RENDER_PROFILES = {
+    "vision": {"min_dpi": 96, "max_dpi": 200, "max_long_side": 2048},
+    "ocr": {"min_dpi": 200, "max_dpi": 400, "max_long_side": 4096},
+}
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+# 每個工作進程各自開啟一次 PDF
+_worker_pdf = None
+
+
+def choose_dpi(page, min_dpi: int, max_dpi: int, max_long_side: int) -> int:
+    """依頁面內容決定渲染 DPI：小字需要高解析度，照片或掃描頁用較低解析度"""
+    smallest_font = None
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                if span["text"].strip():
+                    size = span["size"]
+                    if smallest_font is None or size < smallest_font:
+                        smallest_font = size
+
+    if smallest_font is not None:
+        # 讓最小的字至少約 20 像素高
+        dpi = 20 * 72 / max(smallest_font, 1)
+    else:
+        # 沒有文字層：以內嵌掃描圖的原始解析度為準
+        dpi = min_dpi
+        for info in page.get_image_info():
+            bbox = fitz.Rect(info["bbox"])
+            if bbox.width > 0:
+                dpi = max(dpi, info["width"] * 72 / bbox.width)
+
+    dpi = max(min_dpi, min(max_dpi, dpi))
+
+    # 限制長邊像素數
+    long_side_points = max(page.rect.width, page.rect.height)
+    if long_side_points > 0:
+        dpi = min(dpi, max_long_side * 72 / long_side_points)
+    return int(dpi)
+
+
+def encode_pixmap(pix, image_format: str, quality: int) -> bytes:
+    """將 Pixmap 編碼為精簡的 JPEG/WebP"""
+    if image_format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if image_format == "png":
+        return pix.tobytes("png")
+
+    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    buffered = io.BytesIO()
+    image.save(buffered, format="WEBP", quality=quality, method=4)
+    return buffered.getvalue()
+
+
+def _init_worker(pdf_path: str):
+    global _worker_pdf
+    _worker_pdf = fitz.open(pdf_path)
+
+
+def _render_page(page_number: int, profile: str, image_format: str, quality: int) -> Dict:
+    """渲染單頁（頁碼從 1 開始），在工作進程中執行"""
+    return _render_document_page(_worker_pdf, page_number, profile, image_format, quality)
+
+
+def _render_document_page(pdf, page_number: int, profile: str, image_format: str, quality: int) -> Dict:
+    page = pdf[page_number - 1]
+    settings = RENDER_PROFILES[profile]
+    dpi = choose_dpi(page, settings["min_dpi"], settings["max_dpi"], settings["max_long_side"])
+
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+    data = encode_pixmap(pix, image_format, quality)
+
+    return {
+        "page": page_number,
+        "dpi": dpi,
+        "width": pix.width,
+        "height": pix.height,
+        "mime_type": MIME_TYPES[image_format],
+        "data": data,
+    }
+
+
+def render_pages(
+    pdf_path: str,
+    page_numbers: Optional[List[int]] = None,
+    profile: str = "vision",
+    image_format: Optional[str] = None,
+    quality: Optional[int] = None,
+    workers: Optional[int] = None,
+    max_inflight: Optional[int] = None,
+) -> Iterator[Dict]:
+    """在進程池中平行渲染頁面，完成一頁即產出一頁
+
+    同時在途的頁面數量受 max_inflight 限制，消費端處理較慢時渲染會自動暫停，
+    因此峰值記憶體與文件頁數無關。產出順序為完成順序，請以 "page" 欄位辨識頁碼。
+    """
+    image_format = (image_format or RENDER_FORMAT).lower()
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"不支持的圖片格式: {image_format}")
+    quality = quality or RENDER_QUALITY
+    workers = max(1, workers or RENDER_WORKERS)
+    max_inflight = max(1, max_inflight or RENDER_MAX_INFLIGHT)
+
+    if page_numbers is None:
+        with fitz.open(pdf_path) as pdf:
+            page_numbers = list(range(1, len(pdf) + 1))
+    if not page_numbers:
+        return
+
+    # 頁數少或只有一個工作進程時直接在本進程渲染，省去啟動進程池的成本
+    # 文件在產生器結束（或被提前關閉）時關閉
+    if workers == 1 or len(page_numbers) == 1:
+        with fitz.open(pdf_path) as pdf:
+            for page_number in page_numbers:
+                yield _render_document_page(pdf, page_number, profile, image_format, quality)
+        return
+
+    workers = min(workers, len(page_numbers))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(pdf_path,)
+    ) as executor:
+        pending = set()
+        remaining = iter(page_numbers)
+
+        def submit_next() -> bool:
+            page_number = next(remaining, None)
+            if page_number is None:
+                return False
+            pending.add(
+                executor.submit(_render_page, page_number, profile, image_format, quality)
+            )
+            return True
+
+        for _ in range(max_inflight):
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                yield future.result()
+                submit_next()
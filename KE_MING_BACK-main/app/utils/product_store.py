@@ -0,0 +1,338 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from app.utils.vector_store import current_generation, generation_path
+
+# 結構化產品資料：JSON 產品入庫時同步寫入，屬性篩選類問題直接以 SQL 回答
+# 與 chunk 統計一樣每個索引世代各自一份，重建、遷移與清空時隨世代切換
+BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
+PRODUCT_DB_NAME = 'products.sqlite3'
+# 舊版所有世代共用的產品資料庫，首次存取時移入使用中的世代
+LEGACY_PRODUCT_DB_PATH = os.path.join(BASE_PATH, PRODUCT_DB_NAME)
+
+# 規格值開頭的數字，例如 "1000流明" -> 1000，用於數值範圍篩選
+_LEADING_NUMBER = re.compile(r"^\s*(-?\d+(?:\.\d+)?)")
+_legacy_lock = threading.Lock()
+# 已建立資料表的資料庫路徑，每個世代的資料庫只需執行一次建表與移入舊版資料
+_initialized = set()
+_schema_lock = threading.Lock()
+
+
+def product_db_path(generation: Optional[str] = None) -> str:
+    return os.path.join(generation_path(generation), PRODUCT_DB_NAME)
+
+
+def _adopt_legacy_db(path: str):
+    """把舊版共用的產品資料庫（先合併 WAL）移入使用中的世代"""
+    with _legacy_lock:
+        if not os.path.exists(LEGACY_PRODUCT_DB_PATH) or os.path.exists(path):
+            return
+        conn = sqlite3.connect(LEGACY_PRODUCT_DB_PATH, timeout=30)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        os.replace(LEGACY_PRODUCT_DB_PATH, path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(LEGACY_PRODUCT_DB_PATH + suffix):
+                os.remove(LEGACY_PRODUCT_DB_PATH + suffix)
+        print(f"已將舊版產品資料庫移入索引世代: {path}")
+
+
+def _init_schema(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS products ("
+        "source TEXT NOT NULL, product_id TEXT NOT NULL, name TEXT NOT NULL, "
+        "description TEXT, price REAL, category TEXT, data TEXT NOT NULL, "
+        "run TEXT NOT NULL, namespace TEXT NOT NULL DEFAULT 'default', "
+        "PRIMARY KEY (source, product_id))"
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    if "namespace" not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN namespace TEXT NOT NULL DEFAULT 'default'")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_namespace_category "
+        "ON products (namespace, category, price)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_id ON products (product_id)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS product_specs ("
+        "source TEXT NOT NULL, product_id TEXT NOT NULL, spec_key TEXT NOT NULL, "
+        "value_text TEXT NOT NULL, value_num REAL, "
+        "PRIMARY KEY (source, product_id, spec_key))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_specs_text ON product_specs (spec_key, value_text)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_specs_num ON product_specs (spec_key, value_num)")
+    # 各命名空間的類別與規格名稱，每次查詢都要用來解析條件，隨寫入維護而不在查詢時掃描產品表
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS product_vocabulary ("
+        "namespace TEXT NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, "
+        "PRIMARY KEY (namespace, kind, value))"
+    )
+    if (conn.execute("SELECT 1 FROM products LIMIT 1").fetchone()
+            and not conn.execute("SELECT 1 FROM product_vocabulary LIMIT 1").fetchone()):
+        _rebuild_vocabulary(conn)
+    conn.commit()
+
+
+@contextmanager
+def _connect(generation: Optional[str] = None):
+    """開啟世代的產品資料庫（未指定時為使用中的世代），離開時提交並關閉連線"""
+    generation = generation or current_generation()
+    path = product_db_path(generation)
+    if path not in _initialized or not os.path.exists(path):
+        with _schema_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if generation == current_generation():
+                _adopt_legacy_db(path)
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                _init_schema(conn)
+            finally:
+                conn.close()
+            _initialized.add(path)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _rebuild_vocabulary(conn: sqlite3.Connection, namespaces: Optional[Iterable[str]] = None):
+    """重新計算命名空間的類別與規格名稱（刪除產品後），未指定時重算全部"""
+    if namespaces is None:
+        condition, params = "", []
+    else:
+        namespaces = list(namespaces)
+        if not namespaces:
+            return
+        condition = f" WHERE namespace IN ({','.join('?' * len(namespaces))})"
+        params = namespaces
+    conn.execute(f"DELETE FROM product_vocabulary{condition}", params)
+    conn.execute(
+        "INSERT OR IGNORE INTO product_vocabulary (namespace, kind, value) "
+        f"SELECT DISTINCT namespace, 'category', category FROM products{condition}"
+        f"{' AND' if condition else ' WHERE'} category IS NOT NULL",
+        params,
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO product_vocabulary (namespace, kind, value) "
+        "SELECT DISTINCT p.namespace, 'spec_key', s.spec_key FROM product_specs s JOIN products p "
+        "ON p.source = s.source AND p.product_id = s.product_id"
+        + (f" WHERE p.namespace IN ({','.join('?' * len(params))})" if condition else ""),
+        params,
+    )
+
+
+def _source_namespaces(conn: sqlite3.Connection, source: str) -> List[str]:
+    return [row[0] for row in conn.execute("SELECT DISTINCT namespace FROM products WHERE source = ?", (source,))]
+
+
+def _to_number(value) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _LEADING_NUMBER.match(str(value))
+    return float(match.group(1)) if match else None
+
+
+def upsert_products(source: str, products: Iterable[Dict], run: str, namespace: str = "default",
+                    generation: Optional[str] = None):
+    """寫入一批產品（同來源同 ID 覆蓋），run 標記本次匯入以便之後清除過期產品"""
+    product_rows = []
+    spec_rows = []
+    for product in products:
+        product_id = str(product["id"])
+        product_rows.append((
+            source, product_id, product["name"], product.get("description"),
+            _to_number(product.get("price")), product.get("category"),
+            json.dumps(product, ensure_ascii=False), run, namespace,
+        ))
+        for key, value in (product.get("specifications") or {}).items():
+            spec_rows.append((source, product_id, key, str(value), _to_number(value)))
+
+    with _connect(generation) as conn:
+        conn.executemany(
+            "DELETE FROM product_specs WHERE source = ? AND product_id = ?",
+            [(row[0], row[1]) for row in product_rows],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO products "
+            "(source, product_id, name, description, price, category, data, run, namespace) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            product_rows,
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO product_specs "
+            "(source, product_id, spec_key, value_text, value_num) VALUES (?, ?, ?, ?, ?)",
+            spec_rows,
+        )
+        # 新增的類別與規格名稱直接加入；同來源同 ID 覆蓋後不再出現的名稱在匯入結束（remove_stale_products）時重算
+        conn.executemany(
+            "INSERT OR IGNORE INTO product_vocabulary (namespace, kind, value) VALUES (?, ?, ?)",
+            {(namespace, "category", row[5]) for row in product_rows if row[5] is not None}
+            | {(namespace, "spec_key", row[2]) for row in spec_rows},
+        )
+
+
+def remove_stale_products(source: str, run: str, generation: Optional[str] = None) -> int:
+    """刪除來源文件中不屬於本次匯入的產品，回傳刪除數量"""
+    with _connect(generation) as conn:
+        namespaces = _source_namespaces(conn, source)
+        conn.execute(
+            "DELETE FROM product_specs WHERE source = ? AND product_id IN "
+            "(SELECT product_id FROM products WHERE source = ? AND run != ?)",
+            (source, source, run),
+        )
+        removed = conn.execute(
+            "DELETE FROM products WHERE source = ? AND run != ?", (source, run)
+        ).rowcount
+        _rebuild_vocabulary(conn, namespaces)
+        return removed
+
+
+def release_source_products(source: str, generation: Optional[str] = None) -> int:
+    """移除來源文件的所有產品，回傳刪除數量"""
+    with _connect(generation) as conn:
+        namespaces = _source_namespaces(conn, source)
+        conn.execute("DELETE FROM product_specs WHERE source = ?", (source,))
+        removed = conn.execute("DELETE FROM products WHERE source = ?", (source,)).rowcount
+        if removed:
+            _rebuild_vocabulary(conn, namespaces)
+        return removed
+
+
+def copy_products(from_generation: str, to_generation: str, sources: Optional[Iterable[str]] = None):
+    """把來源文件的產品從一個世代複製到另一個世代（取代目標世代中這些來源的產品）
+
+    sources 未指定時複製全部產品。
+    """
+    # 先開啟一次來源資料庫，確保資料表存在（使用中的世代也在此移入舊版資料庫）
+    with _connect(from_generation):
+        pass
+    with _connect(to_generation) as conn:
+        conn.execute("ATTACH DATABASE ? AS src", (product_db_path(from_generation),))
+        try:
+            if sources is None:
+                condition, params = "", []
+                conn.execute("DELETE FROM product_specs")
+                conn.execute("DELETE FROM products")
+            else:
+                sources = list(sources)
+                if not sources:
+                    return
+                condition = f" WHERE source IN ({','.join('?' * len(sources))})"
+                params = sources
+                conn.execute(f"DELETE FROM product_specs{condition}", params)
+                conn.execute(f"DELETE FROM products{condition}", params)
+            conn.execute(
+                "INSERT INTO products (source, product_id, name, description, price, category, data, run, namespace) "
+                "SELECT source, product_id, name, description, price, category, data, run, namespace "
+                f"FROM src.products{condition}",
+                params,
+            )
+            conn.execute(
+                "INSERT INTO product_specs (source, product_id, spec_key, value_text, value_num) "
+                f"SELECT source, product_id, spec_key, value_text, value_num FROM src.product_specs{condition}",
+                params,
+            )
+            _rebuild_vocabulary(conn)
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE src")
+
+
+def get_product_vocabulary(namespace: str = "default") -> Dict[str, List[str]]:
+    """命名空間中出現過的類別與規格名稱，供解析查詢條件使用（讀取寫入時維護的詞彙表）"""
+    vocabulary = {"category": [], "spec_key": []}
+    with _connect() as conn:
+        for kind, value in conn.execute(
+            "SELECT kind, value FROM product_vocabulary WHERE namespace = ? ORDER BY kind, value", (namespace,)
+        ):
+            vocabulary[kind].append(value)
+    return {"categories": vocabulary["category"], "spec_keys": vocabulary["spec_key"]}
+
+
+def find_spec_key_by_unit(unit: str, namespace: str = "default") -> Optional[str]:
+    """找出命名空間中數值以指定單位結尾的規格名稱，例如「流明」對應「亮度」"""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT s.spec_key FROM product_specs s JOIN products p "
+            "ON p.source = s.source AND p.product_id = s.product_id "
+            "WHERE p.namespace = ? AND s.value_num IS NOT NULL AND s.value_text LIKE ? "
+            "GROUP BY s.spec_key ORDER BY COUNT(*) DESC LIMIT 1",
+            (namespace, f"%{unit}"),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def query_products(
+    categories: Optional[List[str]] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    id_prefix: Optional[str] = None,
+    spec_values: Optional[List[str]] = None,
+    spec_ranges: Optional[List[Dict]] = None,
+    limit: int = 50,
+    namespace: str = "default",
+) -> List[Dict]:
+    """依屬性條件篩選產品，依價格排序
+
+    spec_values: 規格值需包含的字串（任一規格欄位符合即可），例如 ["IP65"]
+    spec_ranges: 數值規格範圍，例如 [{"key": "亮度", "min": 1000}]
+    """
+    clauses = ["p.namespace = ?"]
+    params: List = [namespace]
+    if categories:
+        clauses.append(f"p.category IN ({','.join('?' * len(categories))})")
+        params.extend(categories)
+    if min_price is not None:
+        clauses.append("p.price >= ?")
+        params.append(min_price)
+    if max_price is not None:
+        clauses.append("p.price <= ?")
+        params.append(max_price)
+    if id_prefix:
+        clauses.append("p.product_id LIKE ?")
+        params.append(f"{id_prefix}%")
+    for value in spec_values or []:
+        clauses.append(
+            "EXISTS (SELECT 1 FROM product_specs s WHERE s.source = p.source "
+            "AND s.product_id = p.product_id AND s.value_text LIKE ?)"
+        )
+        params.append(f"%{value}%")
+    for spec_range in spec_ranges or []:
+        condition = "s.spec_key = ?"
+        params_range = [spec_range["key"]]
+        if spec_range.get("min") is not None:
+            condition += " AND s.value_num >= ?"
+            params_range.append(spec_range["min"])
+        if spec_range.get("max") is not None:
+            condition += " AND s.value_num <= ?"
+            params_range.append(spec_range["max"])
+        clauses.append(
+            "EXISTS (SELECT 1 FROM product_specs s WHERE s.source = p.source "
+            f"AND s.product_id = p.product_id AND {condition})"
+        )
+        params.extend(params_range)
+
+    where = f"WHERE {' AND '.join(clauses)}"
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT p.source, p.data FROM products p {where} "
+            "ORDER BY p.price IS NULL, p.price, p.product_id LIMIT ?",
+            [*params, limit],
+        ).fetchall()
+    results = []
+    for source, data in rows:
+        product = json.loads(data)
+        product["source"] = source
+        results.append(product)
+    return results
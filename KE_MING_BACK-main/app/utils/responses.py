@@ -0,0 +1,146 @@
+import os
+import zlib
+from typing import Any, Optional
+
+import orjson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import brotli
+except ImportError:  # 未安裝 brotli 時只提供 gzip
+    brotli = None
+
+# 小於此大小的回應不壓縮（壓縮的 CPU 成本高於節省的傳輸量）
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# 可壓縮的內容類型；圖片、zstd 快照等已壓縮的內容直接傳送
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml")
+_SSE_TYPE = "text/event-stream"
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content: Any) -> str:
+    """以 orjson 序列化為字串（非 ASCII 字元不轉義，numpy 數值可直接序列化）"""
+    return orjson.dumps(content, option=ORJSON_OPTIONS).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """以 orjson 序列化的 JSON 回應，設為全域預設的回應類別"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+def _negotiate(accept_encoding: str) -> Optional[str]:
+    """依 Accept-Encoding 選擇壓縮方式，優先 br，其次 gzip；q=0 表示拒絕"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        """壓縮一段串流資料並立即送出（不等待後續資料）"""
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """依 Accept-Encoding 以 brotli 或 gzip 壓縮回應
+
+    超過 COMPRESSION_MIN_BYTES 的一般回應整體壓縮；分段輸出的串流回應逐段壓縮。
+    SSE（text/event-stream）一律不壓縮，避免緩衝造成逐字輸出延遲。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # 等到第一段內容才決定是否壓縮
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if passthrough is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or content_type.startswith(_SSE_TYPE)
+                    or not content_type.startswith(_COMPRESSIBLE_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                )
+                if passthrough:
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = compressor.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                await send(start_message)
+                await send({"type": "http.response.body", "body": compressor.compress(body), "more_body": True})
+                return
+
+            if passthrough:
+                await send(message)
+                return
+            data = compressor.compress(body) if more_body else compressor.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,33 @@
+import os
+import re
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+# 以內容雜湊命名的檔案（例如 <sha256>.jpeg、<sha256>_thumb.webp），內容永不改變
+CONTENT_HASH_PATTERN = re.compile(r"^(?P<digest>[0-9a-f]{64})(?:_(?P<variant>\w+))?\.\w+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+
+
+class ImageStaticFiles(StaticFiles):
+    """圖片靜態檔案：雜湊命名的檔案使用強 ETag 與長期不可變快取"""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        match = CONTENT_HASH_PATTERN.match(os.path.basename(full_path))
+        if match:
+            # 內容雜湊本身就是最準確的強 ETag
+            response.headers["etag"] = f'"{match.group("digest")}-{match.group("variant") or "raw"}"'
+            response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["cache-control"] = DEFAULT_CACHE_CONTROL
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
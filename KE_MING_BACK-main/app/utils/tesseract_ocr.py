@@ -0,0 +1,171 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+
+import fitz  # PyMuPDF
+from langchain.schema import Document
+from PIL import Image
+
+from app.utils.page_renderer import RENDER_PROFILES, choose_dpi
+
+# Tesseract 設定
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "chi_tra+eng")
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "--oem 1 --psm 3")
+# 預設每個 CPU 核心一個工作進程
+TESSERACT_WORKERS = int(os.getenv("TESSERACT_WORKERS", str(os.cpu_count() or 1)))
+
+# 每個工作進程各自開啟一次 PDF
+_worker_pdf = None
+
+
+def _init_worker(pdf_path: str):
+    """進程池工作進程的初始化，只在工作進程中執行"""
+    global _worker_pdf
+    # 一個進程佔一個核心，避免 Tesseract 內部的 OpenMP 再開多執行緒搶核心
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    _worker_pdf = fitz.open(pdf_path)
+
+
+def _page_to_image(page) -> Image.Image:
+    """以 OCR 用的解析度將頁面渲染為灰階圖像"""
+    settings = RENDER_PROFILES["ocr"]
+    dpi = choose_dpi(page, settings["min_dpi"], settings["max_dpi"], settings["max_long_side"])
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def _ocr_image(image: Image.Image) -> str:
+    import pytesseract
+
+    return pytesseract.image_to_string(image, lang=TESSERACT_LANG, config=TESSERACT_CONFIG)
+
+
+def _ocr_page(page_number: int) -> Dict:
+    """渲染並辨識單頁（頁碼從 1 開始），在工作進程中執行"""
+    return _ocr_document_page(_worker_pdf, page_number)
+
+
+def _ocr_document_page(pdf, page_number: int) -> Dict:
+    start_time = time.time()
+    text = _ocr_image(_page_to_image(pdf[page_number - 1]))
+    return {
+        "page": page_number,
+        "text": text.strip(),
+        "elapsed_seconds": time.time() - start_time,
+    }
+
+
+def check_tesseract() -> str:
+    """確認 Tesseract 與所需語言包已安裝，回傳版本號"""
+    try:
+        import pytesseract
+
+        version = str(pytesseract.get_tesseract_version())
+        languages = set(pytesseract.get_languages(config=""))
+    except Exception as e:
+        raise RuntimeError(f"找不到 Tesseract，請先安裝 tesseract-ocr: {str(e)}")
+
+    missing = [lang for lang in TESSERACT_LANG.split("+") if lang not in languages]
+    if missing:
+        raise RuntimeError(f"Tesseract 缺少語言包: {', '.join(missing)}")
+    return version
+
+
+class TesseractPDFProcessor:
+    """使用本地 Tesseract 對 PDF 進行 OCR，不需呼叫任何外部 API"""
+
+    def __init__(self, pdf_path: str, workers: Optional[int] = None):
+        self.pdf_path = pdf_path
+        self.workers = max(1, workers or TESSERACT_WORKERS)
+        # 處理統計報告
+        self.report: Dict = {}
+
+    def _extract_page_as_image(self, page) -> Image.Image:
+        """提取頁面圖像"""
+        return _page_to_image(page)
+
+    def _ocr_with_tesseract(self, image: Image.Image) -> str:
+        """對單張圖像進行 OCR"""
+        return _ocr_image(image).strip()
+
+    def ocr_pages(self, page_numbers: Optional[List[int]] = None) -> Iterator[Dict]:
+        """在進程池中平行辨識頁面，完成一頁即產出一頁（依完成順序）"""
+        if page_numbers is None:
+            with fitz.open(self.pdf_path) as pdf:
+                page_numbers = list(range(1, len(pdf) + 1))
+        if not page_numbers:
+            return
+
+        workers = min(self.workers, len(page_numbers))
+        # 單一進程時在本進程辨識，不修改本進程的 OMP_THREAD_LIMIT（Tesseract 可使用多執行緒）
+        if workers == 1:
+            with fitz.open(self.pdf_path) as pdf:
+                for page_number in page_numbers:
+                    yield _ocr_document_page(pdf, page_number)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(self.pdf_path,)
+        ) as executor:
+            pending = set()
+            remaining = iter(page_numbers)
+
+            # 在途頁數限制為工作進程數的兩倍，結果取走後才送出下一頁
+            for page_number in remaining:
+                pending.add(executor.submit(_ocr_page, page_number))
+                if len(pending) >= workers * 2:
+                    break
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    yield future.result()
+                    page_number = next(remaining, None)
+                    if page_number is not None:
+                        pending.add(executor.submit(_ocr_page, page_number))
+
+    def process(self) -> List[Document]:
+        """辨識整份 PDF，每頁一個文檔"""
+        check_tesseract()
+        start_time = time.time()
+
+        results = sorted(self.ocr_pages(), key=lambda result: result["page"])
+        documents = [
+            Document(
+                page_content=f"## (第{result['page']}頁)\n\n{result['text']}",
+                metadata={
+                    "source": self.pdf_path,
+                    "filename": os.path.basename(self.pdf_path),
+                    "extraction_method": "tesseract",
+                    "page": result["page"],
+                },
+            )
+            for result in results
+            if result["text"]
+        ]
+
+        elapsed = time.time() - start_time
+        pages = len(results)
+        self.report = {
+            "total_pages": pages,
+            "workers": min(self.workers, pages) if pages else 0,
+            "elapsed_seconds": round(elapsed, 2),
+            "pages_per_second": round(pages / elapsed, 3) if elapsed > 0 else 0,
+        }
+        if self.report["workers"]:
+            self.report["pages_per_second_per_core"] = round(
+                self.report["pages_per_second"] / self.report["workers"], 3
+            )
+        print(
+            f"Tesseract OCR 完成: 共 {pages} 頁，{self.report['workers']} 個進程，"
+            f"耗時 {self.report['elapsed_seconds']} 秒"
+        )
+        return documents
+
+
+def process_pdf_with_tesseract(pdf_path: str) -> List[Document]:
+    """使用本地 Tesseract 處理 PDF 文件的便捷函數"""
+    processor = TesseractPDFProcessor(pdf_path)
+    return processor.process()
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import struct
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import zstandard
+
+from app.utils.image_store import copy_source_images
+from app.utils.product_store import copy_products
+from app.utils.vector_store import (
+    activate_generation,
+    create_generation,
+    current_generation,
+    discard_generation,
+    generation_embedding,
+    get_vector_store,
+    index_write_lock,
+    list_namespaces,
+    page_chunk_ids,
+    store_add_embeddings,
+    store_count,
+)
+
+# 快照格式：zstd 串流壓縮，內容為連續的紀錄
+#   紀錄 = 類型 (1 byte) + JSON 長度 (uint32) + JSON + 原始資料長度 (uint64) + 原始資料
+#   H 檔頭（嵌入模型、命名空間）、N 命名空間開始、B 一批 chunk（向量為原始 little-endian float32）、E 結尾
+SNAPSHOT_MAGIC = b"KMVS\x01"
+SNAPSHOT_VERSION = 1
+# 每批讀寫的 chunk 數，決定匯出匯入時的記憶體上限（1000 筆 1536 維約 6 MB）
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "1000"))
+SNAPSHOT_ZSTD_LEVEL = int(os.getenv("SNAPSHOT_ZSTD_LEVEL", "3"))
+_RECORD_HEADER = struct.Struct("<cI")
+_PAYLOAD_SIZE = struct.Struct("<Q")
+
+
+def _write_record(writer, kind: bytes, header: Dict, payload: bytes = b""):
+    data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    writer.write(_RECORD_HEADER.pack(kind, len(data)))
+    writer.write(data)
+    writer.write(_PAYLOAD_SIZE.pack(len(payload)))
+    if payload:
+        writer.write(payload)
+
+
+def _read_exact(reader, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = reader.read(size)
+        if not chunk:
+            raise ValueError("快照檔案不完整")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _read_record(reader):
+    kind, length = _RECORD_HEADER.unpack(_read_exact(reader, _RECORD_HEADER.size))
+    header = json.loads(_read_exact(reader, length).decode("utf-8"))
+    (payload_size,) = _PAYLOAD_SIZE.unpack(_read_exact(reader, _PAYLOAD_SIZE.size))
+    payload = _read_exact(reader, payload_size) if payload_size else b""
+    return kind, header, payload
+
+
+def export_snapshot(path: str, namespaces: Optional[List[str]] = None) -> Dict:
+    """把使用中索引的 ids、內容、metadata 與向量匯出成單一壓縮檔
+
+    依 chunk ID 排序分批讀取寫出（以上一批最後一個 ID 為游標），匯出期間有寫入也不會
+    因位移跳過或重複 chunk；記憶體用量與索引大小無關，先寫入暫存檔，完成後才改名。
+    """
+    start = time.time()
+    items = [item for item in list_namespaces() if namespaces is None or item["namespace"] in namespaces]
+    counts = {}
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        compressor = zstandard.ZstdCompressor(level=SNAPSHOT_ZSTD_LEVEL, threads=-1)
+        with compressor.stream_writer(f, closefd=False) as writer:
+            _write_record(writer, b"H", {
+                "version": SNAPSHOT_VERSION,
+                "generation": current_generation(),
+                "embedding": generation_embedding(),
+                "created_at": time.time(),
+                "namespaces": [item["namespace"] for item in items],
+            })
+            for item in items:
+                namespace = item["namespace"]
+                store = get_vector_store(namespace=namespace)
+                _write_record(writer, b"N", {"namespace": namespace, "hnsw": item.get("hnsw"),
+                                             "count": store_count(store)})
+                exported = 0
+                after = None
+                while True:
+                    ids = page_chunk_ids(namespace, after=after, limit=SNAPSHOT_BATCH_SIZE)
+                    if not ids:
+                        break
+                    after = ids[-1]
+                    batch = store.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+                    if not batch["ids"]:
+                        # 這一頁在讀取前已全部被刪除
+                        continue
+                    vectors = np.ascontiguousarray(batch["embeddings"], dtype="<f4")
+                    _write_record(writer, b"B", {
+                        "ids": batch["ids"],
+                        "documents": batch["documents"],
+                        "metadatas": batch["metadatas"],
+                        "dim": vectors.shape[1],
+                    }, vectors.tobytes())
+                    exported += len(batch["ids"])
+                counts[namespace] = exported
+                print(f"快照匯出 [{namespace}] {exported} 筆")
+            _write_record(writer, b"E", {"counts": counts})
+    os.replace(temp_path, path)
+    summary = {
+        "path": path,
+        "namespaces": counts,
+        "chunks": sum(counts.values()),
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.time() - start, 2),
+    }
+    print(f"快照匯出完成: {summary}")
+    return summary
+
+
+def import_snapshot(path: str, activate: bool = True) -> Dict:
+    """串流匯入快照到新的索引世代，直接寫入向量不呼叫嵌入 API
+
+    新世代沿用快照記錄的嵌入模型；activate 為 True 時完成後原子切換（原世代保留可回滾），
+    否則只建立世代並回傳名稱。任何錯誤都會放棄新世代，使用中的索引不受影響。
+    """
+    start = time.time()
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("不是有效的向量庫快照檔案")
+        with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            kind, header, _ = _read_record(reader)
+            if kind != b"H" or header.get("version") != SNAPSHOT_VERSION:
+                raise ValueError("不支援的快照版本")
+
+            generation = create_generation(header["embedding"])
+            counts = {}
+            sources = set()
+            try:
+                store, namespace = None, None
+                while True:
+                    kind, record, payload = _read_record(reader)
+                    if kind == b"N":
+                        namespace = record["namespace"]
+                        store = get_vector_store(namespace=namespace, hnsw=record.get("hnsw"),
+                                                 generation=generation)
+                        counts[namespace] = 0
+                    elif kind == b"B":
+                        vectors = np.frombuffer(payload, dtype="<f4").reshape(len(record["ids"]), record["dim"])
+                        store_add_embeddings(store, record["ids"], record["documents"], record["metadatas"],
+                                             vectors)
+                        counts[namespace] += len(record["ids"])
+                        sources.update(m["source"] for m in record["metadatas"] if m and m.get("source"))
+                    elif kind == b"E":
+                        if record["counts"] != counts:
+                            raise ValueError(f"快照內容與結尾紀錄不符: {counts} != {record['counts']}")
+                        break
+                    else:
+                        raise ValueError(f"未知的快照紀錄類型: {kind!r}")
+                for namespace, count in counts.items():
+                    print(f"快照匯入 [{namespace}] {count} 筆")
+                # 快照只含向量，圖片引用與產品資料沿用本機使用中世代裡相同來源的紀錄（若有）
+                with index_write_lock:
+                    copy_source_images(current_generation(), generation, sources)
+                    copy_products(current_generation(), generation, sources)
+                    previous = activate_generation(generation) if activate else None
+            except Exception:
+                discard_generation(generation)
+                raise
+
+    summary = {
+        "generation": generation,
+        "activated": activate,
+        "previous_generation": previous,
+        "embedding": header["embedding"],
+        "namespaces": counts,
+        "chunks": sum(counts.values()),
+        "seconds": round(time.time() - start, 2),
+    }
+    print(f"快照匯入完成: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量庫快照匯出 / 匯入（環境複製與災難復原）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="匯出使用中的索引")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--namespace", action="append", help="只匯出指定命名空間，可重複指定")
+    import_parser = subparsers.add_parser("import", help="匯入快照到新的索引世代並切換")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--no-activate", action="store_true", help="只建立世代，不切換")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.path, args.namespace)
+    else:
+        import_snapshot(args.path, activate=not args.no_activate)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,131 +1,850 @@
+import json
 import os
+import re
 import shutil
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
 
-from app.utils.openai_client import get_embeddings_model
+import chromadb
+from app.utils import chunk_stats
+from app.utils.data_version import bump_data_version
+from app.utils.flat_vector_store import FlatVectorStore
+from app.utils.openai_client import EMBEDDING_DIMENSIONS as EMBEDDING_REQUEST_DIMENSIONS
+from app.utils.openai_client import EMBEDDING_MODEL_NAME, embedding_dimensions, get_embeddings_model
 from langchain_chroma import Chroma
 from chromadb.config import Settings
 
 # 從環境變數獲取基礎路徑
 # 使用環境變量或使用Render平台支持寫入的目錄
 BASE_PATH = os.getenv('DATA_PATH', os.path.join(os.getcwd(), '.render', 'data'))
-CHROMA_PATH = os.path.join(BASE_PATH, 'chroma_new')
 
-# 保存全局實例以避免多次創建
-_vector_store_instance = None
+# 向量索引世代：使用中的資料目錄名稱記錄在 GENERATION_FILE，重置時直接切換到新的空目錄，
+# 舊目錄改名後在背景刪除，不需逐筆刪除文檔也不需重啟服務
+GENERATION_FILE = os.path.join(BASE_PATH, 'vector_generation')
+# 尚未切換過世代時沿用原本的 Chroma 目錄
+DEFAULT_GENERATION = 'chroma_new'
+# 重建切換後保留的上一個世代，可用來回滾
+PREVIOUS_GENERATION_FILE = os.path.join(BASE_PATH, 'vector_generation.previous')
+# 每個世代記錄建立時使用的嵌入模型，查詢一律使用該模型，更換環境變數不會讓既有索引失效
+EMBEDDING_RECORD_FILE = 'embedding.json'
+_TRASH_SUFFIX = '.trash'
 
+# 向量存儲後端：chroma（HNSW 近似檢索）或 flat（記憶體映射矩陣，精確檢索，適合單進程、百萬筆以內）
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
 
-def get_vector_store(force_new=False):
-    """獲取向量存儲"""
-    global _vector_store_instance
+# 命名空間：每個品牌/客戶各自一個 Chroma 集合，互不干擾
+DEFAULT_NAMESPACE = "default"
+# 預設命名空間沿用 LangChain 的預設集合名稱，既有資料不需搬移
+DEFAULT_COLLECTION = "langchain"
+_NAMESPACE_PATTERN = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_-]{1,61}[a-zA-Z0-9]$")
 
-    if force_new:
-        reset_vector_store()
-        _vector_store_instance = None
+# 同時保持開啟的集合數上限與估計記憶體預算，超過時關閉最久未使用的集合。
+# 平面後端關閉集合即解除記憶體映射；Chroma 後端的實際記憶體由 Rust 端依同一預算
+# （chroma_memory_limit_bytes）以 LRU 淘汰 HNSW 分段，關閉集合只丟棄 Python 端物件
+VECTOR_STORE_MAX_OPEN = int(os.getenv("VECTOR_STORE_MAX_OPEN", "16"))
+VECTOR_STORE_MEMORY_MB = float(os.getenv("VECTOR_STORE_MEMORY_MB", "1024"))
+# 閒置超過此秒數的集合會被關閉（背景執行緒定期檢查，沒有新查詢時也會關閉）
+VECTOR_STORE_IDLE_SECONDS = int(os.getenv("VECTOR_STORE_IDLE_SECONDS", "900"))
 
-    if _vector_store_instance is None:
-        persist_directory = CHROMA_PATH
-        
-        # 確保目錄存在
-        os.makedirs(persist_directory, exist_ok=True)
-        
-        # 設置目錄權限
-        try:
-            os.chmod(persist_directory, 0o777)
-            
-            # 確保數據庫文件權限
-            db_path = os.path.join(persist_directory, "chroma.sqlite3")
-            if os.path.exists(db_path):
-                os.chmod(db_path, 0o777)
-                
-            # 設置父目錄權限
-            parent_dir = os.path.dirname(persist_directory)
-            if os.path.exists(parent_dir):
-                os.chmod(parent_dir, 0o777)
-        except Exception as e:
-            print(f"設置權限時出錯: {str(e)}")
-            
-        embedding_function = get_embeddings_model()
-        
-        # 使用SQLite配置
+# 新建集合的 HNSW 預設參數（與 Chroma 預設相同），可在建立命名空間時個別指定
+# space: 距離函數 l2 / cosine / ip；M: 每個節點的鄰居數；construction_ef / search_ef: 建圖與查詢時的候選數
+HNSW_SPACES = ("l2", "cosine", "ip")
+HNSW_DEFAULTS = {
+    "space": os.getenv("HNSW_SPACE", "l2"),
+    "M": int(os.getenv("HNSW_M", "16")),
+    "construction_ef": int(os.getenv("HNSW_CONSTRUCTION_EF", "100")),
+    "search_ef": int(os.getenv("HNSW_SEARCH_EF", "100")),
+}
+# 建立後不可變更的參數（變更需重建集合）
+HNSW_IMMUTABLE_KEYS = ("space", "M", "construction_ef")
+
+# 共用的 Chroma 客戶端、各嵌入模型實例與已開啟的集合（LRU 順序，最近使用的在最後）
+_client = None
+_embedding_functions: Dict[tuple, object] = {}
+_open_stores: "OrderedDict[str, Dict]" = OrderedDict()
+# 背景重建中、尚未啟用的世代各自的客戶端與存儲
+_generation_clients: Dict[str, object] = {}
+_generation_stores: Dict[tuple, object] = {}
+# 已釋放但可能仍被進行中的請求使用的 Chroma 系統實例，交出去的存儲都被回收後才停止
+_retired_systems: List[Dict] = []
+# 定期關閉閒置集合的背景執行緒（有開啟的集合時才執行）
+_idle_sweeper: Optional[threading.Thread] = None
+_lock = threading.RLock()
+# 寫入使用中索引（含圖片、產品旁路資料）時持有；重建與遷移在最後一次追趕同步到切換世代期間持有，
+# 期間的上傳與刪除會等切換完成後寫入新世代，不會寫進即將被換下的世代而遺失
+index_write_lock = threading.Lock()
+# 使用中索引各來源文件最後一次寫入的序號，重建與遷移追趕時據此找出期間寫入過的文件
+_source_writes: Dict[str, int] = {}
+_write_serial = 0
+
+
+def validate_namespace(namespace: Optional[str]) -> str:
+    """檢查命名空間名稱，未指定時回傳預設命名空間"""
+    if not namespace:
+        return DEFAULT_NAMESPACE
+    if not _NAMESPACE_PATTERN.match(namespace):
+        raise ValueError("命名空間須為 3-63 個英數字、底線或連字號，且以英數字開頭結尾")
+    return namespace
+
+
+def collection_name(namespace: str) -> str:
+    if namespace == DEFAULT_NAMESPACE:
+        return DEFAULT_COLLECTION
+    return f"ns_{namespace}"
+
+
+def normalize_hnsw_config(raw: Optional[Dict]) -> Dict:
+    """檢查 HNSW 參數並補上預設值，格式錯誤時拋出 ValueError"""
+    raw = raw or {}
+    unknown = set(raw) - set(HNSW_DEFAULTS)
+    if unknown:
+        raise ValueError(f"不支持的 HNSW 參數: {', '.join(sorted(unknown))}")
+    config = {**HNSW_DEFAULTS, **{key: value for key, value in raw.items() if value is not None}}
+    if config["space"] not in HNSW_SPACES:
+        raise ValueError(f"space 必須是 {' / '.join(HNSW_SPACES)} 之一")
+    for key in ("M", "construction_ef", "search_ef"):
+        if not isinstance(config[key], int) or isinstance(config[key], bool) or config[key] < 2:
+            raise ValueError(f"{key} 必須是大於 1 的整數")
+    return config
+
+
+def _chroma_configuration(config: Dict) -> Dict:
+    return {
+        "hnsw": {
+            "space": config["space"],
+            "max_neighbors": config["M"],
+            "ef_construction": config["construction_ef"],
+            "ef_search": config["search_ef"],
+        }
+    }
+
+
+def _hnsw_from_collection(collection) -> Optional[Dict]:
+    """讀取集合建立時記錄的 HNSW 參數"""
+    hnsw = (collection.configuration or {}).get("hnsw")
+    if not hnsw:
+        return None
+    return {
+        "space": hnsw.get("space"),
+        "M": hnsw.get("max_neighbors"),
+        "construction_ef": hnsw.get("ef_construction"),
+        "search_ef": hnsw.get("ef_search"),
+    }
+
+
+def current_generation() -> str:
+    """目前使用中的索引世代（資料目錄名稱）"""
+    try:
+        with open(GENERATION_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip() or DEFAULT_GENERATION
+    except FileNotFoundError:
+        return DEFAULT_GENERATION
+
+
+def generation_path(generation: Optional[str] = None) -> str:
+    return os.path.join(BASE_PATH, generation or current_generation())
+
+
+def previous_generation() -> Optional[str]:
+    """上次切換前使用的世代（可回滾），沒有時回傳 None"""
+    try:
+        with open(PREVIOUS_GENERATION_FILE, "r", encoding="utf-8") as f:
+            generation = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return generation if generation and os.path.isdir(generation_path(generation)) else None
+
+
+def _flat_path(generation: Optional[str] = None) -> str:
+    return os.path.join(generation_path(generation), 'flat')
+
+
+def _write_pointer(path: str, generation: str):
+    os.makedirs(BASE_PATH, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(temp_path, path)
+
+
+def _write_generation(generation: str):
+    """原子地切換使用中的世代"""
+    _write_pointer(GENERATION_FILE, generation)
+
+
+def _new_generation_name() -> str:
+    return f"gen_{time.strftime('%Y%m%d%H%M%S')}_{os.urandom(3).hex()}"
+
+
+def _discard_generation(generation: str):
+    """將舊世代目錄改名（常數時間），再由背景執行緒刪除，並移除該世代的圖片引用"""
+    from app.utils.image_store import drop_generation_images
+
+    path = generation_path(generation)
+    if not os.path.exists(path):
+        return
+    drop_generation_images(generation)
+    trash_path = f"{path}.{int(time.time())}{_TRASH_SUFFIX}"
+    os.rename(path, trash_path)
+
+    def remove():
+        shutil.rmtree(trash_path, ignore_errors=True)
+        print(f"已在背景刪除舊向量索引目錄: {trash_path}")
+
+    threading.Thread(target=remove, daemon=True).start()
+
+
+def cleanup_discarded_generations():
+    """刪除上次執行時尚未刪完的舊世代目錄（服務啟動時呼叫）"""
+    if not os.path.isdir(BASE_PATH):
+        return
+    for name in os.listdir(BASE_PATH):
+        if name.endswith(_TRASH_SUFFIX):
+            shutil.rmtree(os.path.join(BASE_PATH, name), ignore_errors=True)
+            print(f"已刪除殘留的舊向量索引目錄: {name}")
+
+    from app.utils.image_store import drop_orphaned_generation_images
+
+    drop_orphaned_generation_images()
+
+
+def _prepare_directory(persist_directory: str):
+    # 確保目錄存在
+    os.makedirs(persist_directory, exist_ok=True)
+
+    # 設置目錄權限
+    try:
+        os.chmod(persist_directory, 0o777)
+
+        # 確保數據庫文件權限
+        db_path = os.path.join(persist_directory, "chroma.sqlite3")
+        if os.path.exists(db_path):
+            os.chmod(db_path, 0o777)
+
+        # 設置父目錄權限
+        parent_dir = os.path.dirname(persist_directory)
+        if os.path.exists(parent_dir):
+            os.chmod(parent_dir, 0o777)
+    except Exception as e:
+        print(f"設置權限時出錯: {str(e)}")
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        persist_directory = generation_path()
+        _prepare_directory(persist_directory)
+
+        # 使用SQLite配置；HNSW 索引的載入也交由 Chroma 依 LRU 與記憶體上限管理
         client_settings = Settings(
             anonymized_telemetry=False,
             allow_reset=True,
             is_persistent=True,
-            persist_directory=persist_directory
-        )
-        
-        _vector_store_instance = Chroma(
             persist_directory=persist_directory,
-            embedding_function=embedding_function,
-            client_settings=client_settings
+            **_chroma_memory_settings(),
+        )
+        _client = chromadb.PersistentClient(path=persist_directory, settings=client_settings)
+    return _client
+
+
+def _chroma_memory_settings() -> Dict:
+    """Chroma 載入 HNSW 分段的記憶體上限（與集合預算相同），超過時以 LRU 淘汰"""
+    return {
+        "chroma_segment_cache_policy": "LRU",
+        "chroma_memory_limit_bytes": int(VECTOR_STORE_MEMORY_MB * 1024 * 1024),
+    }
+
+
+class _ChunkStatsMixin:
+    """寫入與刪除時同步更新世代的 chunk 統計（chunk_stats），統計查詢不需讀取整個集合"""
+
+    _stats_directory: str = None
+    _stats_namespace: str = None
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = super().add_texts(texts, metadatas, ids=ids, **kwargs)
+        chunk_stats.record_chunks(self._stats_directory, self._stats_namespace, ids, texts, metadatas)
+        _bump_if_live(self)
+        return ids
+
+    def delete(self, ids=None, where=None, **kwargs):
+        removed = list(ids or [])
+        if where is not None:
+            removed += self.get(where=where, include=[])["ids"]
+        result = super().delete(ids=ids, where=where, **kwargs)
+        chunk_stats.remove_chunks(self._stats_directory, self._stats_namespace, removed)
+        _bump_if_live(self)
+        return result
+
+
+class TrackedChroma(_ChunkStatsMixin, Chroma):
+    pass
+
+
+class TrackedFlatVectorStore(_ChunkStatsMixin, FlatVectorStore):
+    pass
+
+
+def _bump_if_live(store):
+    """寫入使用中的世代才遞增資料版本號（背景重建寫入尚未啟用的世代不影響查詢結果）"""
+    if store._stats_directory == generation_path():
+        bump_data_version()
+
+
+def _track(store, generation: Optional[str], namespace: str):
+    store._stats_directory = generation_path(generation)
+    store._stats_namespace = namespace
+    return store
+
+
+def store_count(store) -> int:
+    """向量存儲中的文檔數（兩種後端通用）"""
+    if isinstance(store, FlatVectorStore):
+        return store.count()
+    return store._collection.count()
+
+
+def store_add_embeddings(store, ids: List[str], documents: List[str], metadatas: List[Dict], embeddings):
+    """直接寫入已計算好的向量，不經過嵌入模型（快照匯入用，兩種後端通用）"""
+    if isinstance(store, FlatVectorStore):
+        store.add_embeddings(documents, embeddings, metadatas, ids)
+    else:
+        # Chroma 不接受空的 metadata dict
+        store._collection.upsert(
+            ids=ids, embeddings=embeddings, documents=documents,
+            metadatas=[metadata or None for metadata in metadatas],
         )
-        
+    chunk_stats.record_chunks(store._stats_directory, store._stats_namespace, ids, documents, metadatas)
+    _bump_if_live(store)
+
+
+def _bytes_per_vector() -> int:
+    """估算常駐記憶體用的每筆向量大小：依使用中世代的嵌入維度，float32 向量加上 HNSW 圖與 metadata 約一倍"""
+    record = generation_embedding()
+    return embedding_dimensions(record["model"], record.get("dimensions")) * 4 * 2
+
+
+def _release_store(store):
+    """釋放存儲佔用的記憶體
+
+    平面存儲解除各分段的記憶體映射（仍在使用的查詢持有自己的參照，之後存取會重新映射）。
+    Chroma 1.x 內嵌模式的 HNSW 分段由 Rust 端依 chroma_memory_limit_bytes 以 LRU 載入與淘汰，
+    沒有逐一集合釋放的介面，這裡只丟棄 Python 端的集合物件，讓分段交由該 LRU 淘汰。
+    """
+    if isinstance(store, FlatVectorStore):
+        store.release()
+
+
+def _close_store(namespace: str):
+    entry = _open_stores.pop(namespace, None)
+    if entry is not None:
+        _release_store(entry["store"])
+        print(f"關閉命名空間 {namespace} 的向量集合（估計 {entry['bytes'] / 1024 / 1024:.1f} MB）")
+
+
+def _enforce_limits(keep: Optional[str]):
+    """關閉閒置或超出數量、記憶體預算的集合（最近使用的 keep 一律保留）
+
+    記憶體估計依目前的文檔數重新計算，開啟後持續寫入的集合也會計入預算。
+    """
+    now = time.time()
+    for namespace, entry in list(_open_stores.items()):
+        if namespace != keep and now - entry["last_used"] > VECTOR_STORE_IDLE_SECONDS:
+            _close_store(namespace)
+    bytes_per_vector = _bytes_per_vector()
+    for entry in _open_stores.values():
+        try:
+            entry["bytes"] = store_count(entry["store"]) * bytes_per_vector
+        except Exception as e:
+            print(f"檢查文檔數時出錯: {str(e)}")
+
+    budget = VECTOR_STORE_MEMORY_MB * 1024 * 1024
+    while len(_open_stores) > 1:
+        total = sum(entry["bytes"] for entry in _open_stores.values())
+        if len(_open_stores) <= VECTOR_STORE_MAX_OPEN and total <= budget:
+            break
+        oldest = next(iter(_open_stores))
+        if oldest == keep:
+            break
+        _close_store(oldest)
+
+
+def _sweep_idle_stores() -> bool:
+    """關閉閒置的集合，回傳是否仍有開啟的集合"""
+    with _lock:
+        _enforce_limits(keep=None)
+        return bool(_open_stores)
+
+
+def _start_idle_sweeper():
+    """有集合開啟時啟動背景執行緒，每半個閒置期限檢查一次，集合都關閉後結束（需持有 _lock）"""
+    global _idle_sweeper
+    if _idle_sweeper is not None and _idle_sweeper.is_alive():
+        return
+
+    def sweep():
+        global _idle_sweeper
+        while True:
+            time.sleep(max(VECTOR_STORE_IDLE_SECONDS / 2, 1))
+            with _lock:
+                if not _sweep_idle_stores():
+                    _idle_sweeper = None
+                    return
+
+    _idle_sweeper = threading.Thread(target=sweep, daemon=True)
+    _idle_sweeper.start()
+
+
+def generation_embedding(generation: Optional[str] = None) -> Dict:
+    """世代使用的嵌入模型 {"model", "dimensions"}
+
+    尚未記錄的世代（例如原本的 chroma_new）視為使用目前環境變數設定的模型並補上記錄。
+    """
+    generation = generation or current_generation()
+    path = os.path.join(generation_path(generation), EMBEDDING_RECORD_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        record = {"model": EMBEDDING_MODEL_NAME, "dimensions": EMBEDDING_REQUEST_DIMENSIONS}
+        if os.path.isdir(generation_path(generation)):
+            _write_embedding_record(generation, record)
+        return record
+
+
+def _write_embedding_record(generation: str, record: Dict):
+    path = os.path.join(generation_path(generation), EMBEDDING_RECORD_FILE)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(temp_path, path)
+
+
+def _get_embedding_function(generation: Optional[str] = None):
+    record = generation_embedding(generation)
+    key = (record["model"], record.get("dimensions"))
+    if key not in _embedding_functions:
+        if generation in (None, current_generation()) and key != (EMBEDDING_MODEL_NAME, EMBEDDING_REQUEST_DIMENSIONS):
+            print(
+                f"警告: 索引使用嵌入模型 {record['model']}，與環境變數設定的 {EMBEDDING_MODEL_NAME} 不同，"
+                "查詢沿用索引的模型；請以嵌入模型遷移切換"
+            )
+        _embedding_functions[key] = get_embeddings_model(record["model"], record.get("dimensions"))
+    return _embedding_functions[key]
+
+
+def _generation_store(generation: str, namespace: str, hnsw: Optional[Dict] = None):
+    """取得尚未啟用的世代中命名空間的存儲（背景重建寫入用，不計入 LRU）"""
+    key = (generation, namespace)
+    store = _generation_stores.get(key)
+    if store is not None:
+        return store
+    if VECTOR_STORE_BACKEND == "flat":
+        store = TrackedFlatVectorStore(
+            os.path.join(_flat_path(generation), namespace), _get_embedding_function(generation)
+        )
+    else:
+        client = _generation_clients.get(generation)
+        if client is None:
+            path = generation_path(generation)
+            _prepare_directory(path)
+            client = chromadb.PersistentClient(path=path, settings=Settings(
+                anonymized_telemetry=False, is_persistent=True, persist_directory=path,
+                **_chroma_memory_settings(),
+            ))
+            _generation_clients[generation] = client
+        store = TrackedChroma(
+            client=client,
+            collection_name=collection_name(namespace),
+            embedding_function=_get_embedding_function(generation),
+            collection_configuration=_chroma_configuration(normalize_hnsw_config(hnsw)),
+        )
+    _generation_stores[key] = _track(store, generation, namespace)
+    return store
+
+
+def get_vector_store(force_new=False, namespace: Optional[str] = None, hnsw: Optional[Dict] = None,
+                     generation: Optional[str] = None):
+    """獲取命名空間的向量存儲（預設命名空間沿用原本的集合）
+
+    force_new 會清空並重建該命名空間的集合（沿用原本的 HNSW 參數），不影響其他命名空間。
+    hnsw 只在集合尚不存在、需要新建時生效。
+    generation 指定尚未啟用的世代時，回傳該世代的存儲（背景重建用）。
+    """
+    namespace = validate_namespace(namespace)
+
+    with _lock:
+        if generation and generation != current_generation():
+            return _generation_store(generation, namespace, hnsw)
+
+        if force_new:
+            hnsw = hnsw or get_hnsw_config(namespace)
+            drop_namespace(namespace)
+
+        if _retired_systems:
+            _stop_retired_systems()
+
+        entry = _open_stores.get(namespace)
+        if entry is not None:
+            entry["last_used"] = time.time()
+            _open_stores.move_to_end(namespace)
+            return entry["store"]
+
+        if VECTOR_STORE_BACKEND == "flat":
+            store = TrackedFlatVectorStore(os.path.join(_flat_path(), namespace), _get_embedding_function())
+        else:
+            store = TrackedChroma(
+                client=_get_client(),
+                collection_name=collection_name(namespace),
+                embedding_function=_get_embedding_function(),
+                collection_configuration=_chroma_configuration(normalize_hnsw_config(hnsw)),
+            )
+        _track(store, None, namespace)
+
         # 驗證是否為空
+        count = 0
         try:
-            count = _vector_store_instance._collection.count()
-            print(f"新建向量存儲實例，當前文檔數: {count}")
+            count = store_count(store)
+            print(f"開啟命名空間 {namespace} 的向量存儲，當前文檔數: {count}")
         except Exception as e:
             print(f"檢查文檔數時出錯: {str(e)}")
 
-    return _vector_store_instance
+        _open_stores[namespace] = {
+            "store": store,
+            "last_used": time.time(),
+            "bytes": count * _bytes_per_vector(),
+        }
+        _enforce_limits(keep=namespace)
+        _start_idle_sweeper()
+        return store
 
 
-def reset_vector_store():
-    """清除全局實例並強制重新創建"""
-    global _vector_store_instance
+@contextmanager
+def writable_store(namespace: Optional[str] = None, generation: Optional[str] = None,
+                   sources: Iterable[str] = ()):
+    """取得要寫入的存儲，產出 (存儲, 世代名稱)
 
-    if _vector_store_instance is not None:
+    寫入使用中的索引時持有 index_write_lock，並在持鎖後才決定世代，
+    旁路資料（圖片、產品）也應寫入產出的世代；sources 為寫入的來源文件，離開時記錄寫入序號。
+    指定尚未啟用的世代時不需持鎖。
+    """
+    global _write_serial
+    if generation and generation != current_generation():
+        yield get_vector_store(namespace=namespace, generation=generation), generation
+        return
+    with index_write_lock:
         try:
-            # 嘗試清空集合
-            if hasattr(_vector_store_instance, "_collection"):
-                try:
-                    # 獲取所有文檔ID並刪除
-                    docs = _vector_store_instance._collection.get()
-                    if docs["ids"]:
-                        _vector_store_instance._collection.delete(docs["ids"])
-                    print("已清空集合中的所有文檔")
-                except Exception as e:
-                    print(f"清空集合時出錯: {str(e)}")
-
-            # 嘗試多種方式關閉連接
-            if hasattr(_vector_store_instance, "_client"):
-                if hasattr(_vector_store_instance._client, "close"):
-                    _vector_store_instance._client.close()
-                if hasattr(_vector_store_instance._client, "_collection"):
-                    if hasattr(_vector_store_instance._client._collection, "_client"):
-                        _vector_store_instance._client._collection._client.close()
-
-            # 強制清理相關屬性
-            _vector_store_instance._client = None
-            _vector_store_instance = None
-
-            print("向量存儲實例已完全重置")
+            yield get_vector_store(namespace=namespace), current_generation()
+        finally:
+            _write_serial += 1
+            for source in sources:
+                _source_writes[source] = _write_serial
+
+
+def source_write_marks() -> Dict[str, int]:
+    """使用中索引各來源文件最後一次寫入的序號（與前一次取得的比較即可知道期間是否寫入過）"""
+    return dict(_source_writes)
+
+
+def list_namespaces() -> List[Dict]:
+    """列出所有命名空間與其文檔數、是否已開啟"""
+    namespaces = []
+    if VECTOR_STORE_BACKEND == "flat":
+        if os.path.isdir(_flat_path()):
+            for namespace in sorted(os.listdir(_flat_path())):
+                if not _NAMESPACE_PATTERN.match(namespace):
+                    continue
+                was_open = namespace in _open_stores
+                namespaces.append({
+                    "namespace": namespace,
+                    "count": store_count(get_vector_store(namespace=namespace)),
+                    "open": was_open,
+                })
+        return namespaces
+
+    for collection in _get_client().list_collections():
+        name = collection.name
+        if name == DEFAULT_COLLECTION:
+            namespace = DEFAULT_NAMESPACE
+        elif name.startswith("ns_"):
+            namespace = name[3:]
+        else:
+            continue
+        namespaces.append({
+            "namespace": namespace,
+            "count": collection.count(),
+            "open": namespace in _open_stores,
+            "hnsw": _hnsw_from_collection(collection),
+        })
+    return sorted(namespaces, key=lambda item: item["namespace"])
+
+
+def _ensure_chunk_stats(namespace: str) -> str:
+    """確保命名空間已有 chunk 統計，回傳統計所在的世代目錄
+
+    這個功能之前建立的索引沒有統計，第一次查詢時分頁讀取集合補算一次，之後隨寫入即時更新。
+    """
+    directory = generation_path()
+    if not chunk_stats.is_tracked(directory, namespace):
+        store = get_vector_store(namespace=namespace)
+        offset = 0
+        while True:
+            batch = store.get(include=["documents", "metadatas"], limit=1000, offset=offset)
+            if not batch["ids"]:
+                break
+            chunk_stats.record_chunks(directory, namespace, batch["ids"], batch["documents"], batch["metadatas"])
+            offset += len(batch["ids"])
+        chunk_stats.mark_tracked(directory, namespace)
+        print(f"已建立命名空間 {namespace} 的 chunk 統計，共 {offset} 筆")
+    return directory
+
 
+def get_chunk_stats(namespace: Optional[str] = None) -> Dict:
+    """命名空間的總 chunk 數、文件數、位元組數、最後更新時間與各文件統計（讀取預先累計的結果）"""
+    namespace = validate_namespace(namespace)
+    directory = _ensure_chunk_stats(namespace)
+    return {
+        **chunk_stats.namespace_stats(directory, namespace),
+        "file_stats": chunk_stats.file_stats(directory, namespace),
+    }
+
+
+def page_chunk_ids(namespace: Optional[str] = None, filename: Optional[str] = None,
+                   after: Optional[str] = None, limit: int = 100) -> List[str]:
+    """依 chunk ID 排序分頁，after 為上一頁最後一個 ID"""
+    namespace = validate_namespace(namespace)
+    directory = _ensure_chunk_stats(namespace)
+    return chunk_stats.page_chunk_ids(directory, namespace, filename, after, limit)
+
+
+def get_hnsw_config(namespace: str) -> Optional[Dict]:
+    """命名空間集合記錄的 HNSW 參數；平面後端或集合不存在時回傳 None"""
+    namespace = validate_namespace(namespace)
+    if VECTOR_STORE_BACKEND == "flat":
+        return None
+    try:
+        return _hnsw_from_collection(_get_client().get_collection(collection_name(namespace)))
+    except Exception:
+        return None
+
+
+def create_namespace(namespace: str, hnsw: Optional[Dict] = None) -> Optional[Dict]:
+    """建立命名空間（可指定 HNSW 參數），回傳生效的 HNSW 參數
+
+    命名空間已存在時只能調整 search_ef，其他參數不同會拋出 ValueError。
+    建立時持有寫入鎖，不會落在重建或遷移最後一次追趕與切換之間。
+    """
+    namespace = validate_namespace(namespace)
+    with index_write_lock, _lock:
+        existing = get_hnsw_config(namespace)
+        if existing is None:
+            get_vector_store(namespace=namespace, hnsw=hnsw)
+            return get_hnsw_config(namespace)
+
+        requested = {key: value for key, value in (hnsw or {}).items() if value is not None}
+        normalize_hnsw_config(requested)
+        changed = [key for key in HNSW_IMMUTABLE_KEYS if key in requested and requested[key] != existing[key]]
+        if changed:
+            raise ValueError(f"命名空間 {namespace} 已存在，{', '.join(changed)} 需重建集合才能變更")
+        if "search_ef" in requested:
+            return set_search_ef(namespace, requested["search_ef"])
+        return existing
+
+
+def set_search_ef(namespace: str, search_ef: int) -> Dict:
+    """調整命名空間查詢時的 ef（不需重建索引），回傳更新後的 HNSW 參數"""
+    namespace = validate_namespace(namespace)
+    normalize_hnsw_config({"search_ef": search_ef})
+    if VECTOR_STORE_BACKEND == "flat":
+        raise ValueError("平面向量後端為精確檢索，沒有 HNSW 參數")
+    with _lock:
+        collection = _get_client().get_collection(collection_name(namespace))
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        # Chroma 只在載入 HNSW 索引時讀取 ef_search，需釋放快取的索引，下次使用時重新載入
+        _release_client()
+        print(f"命名空間 {namespace} 的 search_ef 已調整為 {search_ef}")
+        return get_hnsw_config(namespace)
+
+
+def drop_namespace(namespace: str, generation: Optional[str] = None) -> bool:
+    """刪除命名空間的集合，回傳是否存在；generation 指定尚未啟用的世代時只刪除該世代中的集合"""
+    namespace = validate_namespace(namespace)
+    with _lock:
+        if generation and generation != current_generation():
+            return _drop_generation_namespace(generation, namespace)
+        _close_store(namespace)
+        chunk_stats.drop_namespace_stats(generation_path(), namespace)
+        bump_data_version()
+        if VECTOR_STORE_BACKEND == "flat":
+            directory = os.path.join(_flat_path(), namespace)
+            existed = os.path.isdir(directory)
+            shutil.rmtree(directory, ignore_errors=True)
+            return existed
+        try:
+            _get_client().delete_collection(collection_name(namespace))
+            return True
         except Exception as e:
-            print(f"關閉向量庫連接時出錯: {str(e)}")
-            _vector_store_instance = None
+            print(f"刪除命名空間 {namespace} 時出錯: {str(e)}")
+            return False
+
+
+def _drop_generation_namespace(generation: str, namespace: str) -> bool:
+    chunk_stats.drop_namespace_stats(generation_path(generation), namespace)
+    if VECTOR_STORE_BACKEND == "flat":
+        _generation_stores.pop((generation, namespace), None)
+        directory = os.path.join(_flat_path(generation), namespace)
+        existed = os.path.isdir(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+        return existed
+    # 先確保該世代的客戶端已開啟
+    _generation_store(generation, namespace)
+    _generation_stores.pop((generation, namespace), None)
+    try:
+        _generation_clients[generation].delete_collection(collection_name(namespace))
+        return True
+    except Exception as e:
+        print(f"刪除世代 {generation} 的命名空間 {namespace} 時出錯: {str(e)}")
+        return False
+
+
+def _stop_retired_systems():
+    """停止已沒有存儲參照的舊系統實例，釋放其 HNSW 索引與文件控制代碼"""
+    for retired in list(_retired_systems):
+        if any(ref() is not None for ref in retired["stores"]):
+            continue
+        _retired_systems.remove(retired)
+        for system in retired["systems"]:
+            try:
+                system.stop()
+            except Exception as e:
+                print(f"關閉向量庫連接時出錯: {str(e)}")
+
 
-    # 清理文件系統
-    persist_directory = CHROMA_PATH
-    if os.path.exists(persist_directory):
+def _release_client():
+    """關閉所有已開啟的存儲並釋放 Chroma 快取的系統實例
+
+    進行中的請求可能仍持有舊的存儲，舊系統實例只從快取移除，
+    等交出去的存儲都被回收後才停止（見 _stop_retired_systems）。
+    """
+    global _client
+    stores = [entry["store"] for entry in _open_stores.values()] + list(_generation_stores.values())
+    clients = [client for client in [_client, *_generation_clients.values()] if client is not None]
+    for namespace in list(_open_stores):
+        _close_store(namespace)
+    # Chroma 的系統快取是全進程共用的，重建中的世代也要重新開啟
+    _generation_stores.clear()
+    _generation_clients.clear()
+    _client = None
+    if clients:
+        systems = []
+        for client in clients:
+            try:
+                systems.append(client._system)
+            except KeyError:
+                pass
         try:
-            # 刪除所有文件
-            for root, dirs, files in os.walk(persist_directory):
-                for f in files:
-                    file_path = os.path.join(root, f)
-                    try:
-                        os.chmod(file_path, 0o777)
-                        os.remove(file_path)
-                        print(f"已刪除文件: {file_path}")
-                    except Exception as e:
-                        print(f"刪除文件失敗 {file_path}: {str(e)}")
-            
-            # 重新創建空目錄
-            shutil.rmtree(persist_directory, ignore_errors=True)
-            os.makedirs(persist_directory, exist_ok=True)
-            os.chmod(persist_directory, 0o777)
-            print("向量存儲目錄已重置")
+            clients[0].clear_system_cache()
         except Exception as e:
-            print(f"清理文件系統時出錯: {str(e)}")
+            print(f"關閉向量庫連接時出錯: {str(e)}")
+        _retired_systems.append({
+            "systems": systems,
+            "stores": [weakref.ref(store) for store in stores if not isinstance(store, FlatVectorStore)],
+        })
+    _stop_retired_systems()
+
+
+def reset_vector_store(keep_namespaces: bool = False):
+    """切換到新的空索引世代並在背景刪除舊世代，耗時與資料量無關
+
+    keep_namespaces 為 True 時以原本的 HNSW 參數重建各命名空間的空集合。
+    """
+    with index_write_lock, _lock:
+        configs = {}
+        if keep_namespaces:
+            configs = {item["namespace"]: item.get("hnsw") for item in list_namespaces()}
 
+        old_generation = current_generation()
+        stale = previous_generation()
+        _release_client()
+        generation = _new_generation_name()
+        _prepare_directory(generation_path(generation))
+        _write_generation(generation)
+        # 清空後不可再回滾到清空前的索引
+        try:
+            os.remove(PREVIOUS_GENERATION_FILE)
+        except FileNotFoundError:
+            pass
+        bump_data_version()
+        print(f"向量存儲已切換到新的世代 {generation}")
+
+        for namespace, hnsw in configs.items():
+            get_vector_store(namespace=namespace, hnsw=hnsw)
+
+    _discard_generation(old_generation)
+    if stale and stale != old_generation:
+        _discard_generation(stale)
     return None
+
+
+def create_generation(embedding: Optional[Dict] = None) -> str:
+    """建立新的空世代（不啟用），以目前各命名空間的 HNSW 參數建立空集合，回傳世代名稱
+
+    embedding 指定新世代的嵌入模型 {"model", "dimensions"}，未指定時沿用目前世代的模型。
+    """
+    with _lock:
+        embedding = embedding or generation_embedding()
+        generation = _new_generation_name()
+        _prepare_directory(generation_path(generation))
+        _write_embedding_record(generation, embedding)
+        for item in list_namespaces():
+            get_vector_store(namespace=item["namespace"], hnsw=item.get("hnsw"), generation=generation)
+        print(f"已建立新的向量索引世代 {generation}")
+        return generation
+
+
+def activate_generation(generation: str) -> Optional[str]:
+    """原子地切換到指定世代，原本的世代保留以便回滾，更早的世代在背景刪除
+
+    回傳被保留的上一個世代名稱。
+    """
+    with _lock:
+        if not os.path.isdir(generation_path(generation)):
+            raise ValueError(f"找不到向量索引世代: {generation}")
+        current = current_generation()
+        if generation == current:
+            return previous_generation()
+        stale = previous_generation()
+        _release_client()
+        _write_generation(generation)
+        _write_pointer(PREVIOUS_GENERATION_FILE, current)
+        bump_data_version()
+        print(f"向量索引已切換到世代 {generation}，保留 {current} 以便回滾")
+    if stale and stale not in (generation, current):
+        _discard_generation(stale)
+    return current
+
+
+def rollback_generation() -> str:
+    """切回上一個世代（目前的世代改為保留），回傳切換後使用的世代"""
+    with index_write_lock, _lock:
+        previous = previous_generation()
+        if previous is None:
+            raise ValueError("沒有可回滾的向量索引世代")
+        activate_generation(previous)
+        return previous
+
+
+def discard_generation(generation: str):
+    """放棄尚未啟用的世代（例如重建失敗），使用中與保留的世代不會被刪除"""
+    with _lock:
+        if generation in (current_generation(), previous_generation()):
+            return
+        for key in [key for key in _generation_stores if key[0] == generation]:
+            _generation_stores.pop(key)
+        _generation_clients.pop(generation, None)
+    _discard_generation(generation)
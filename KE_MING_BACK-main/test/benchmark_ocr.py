@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.tesseract_ocr import TesseractPDFProcessor, check_tesseract
+
+# 載入環境變數
+load_dotenv()
+
+
+def benchmark_tesseract(pdf_path, workers):
+    """
+    測試本地 Tesseract 的處理速度
+
+    Args:
+        pdf_path (str): PDF文件路徑
+        workers (int): 工作進程數
+
+    Returns:
+        dict: 頁數、耗時、每秒頁數與每核心每秒頁數
+    """
+    processor = TesseractPDFProcessor(pdf_path, workers=workers)
+    processor.process()
+    return processor.report
+
+
+def benchmark_gpt(pdf_path):
+    """
+    測試 GPT-4o 路徑（強制所有頁面走視覺模型）的處理速度
+
+    Args:
+        pdf_path (str): PDF文件路徑
+
+    Returns:
+        dict: 頁數、耗時與每秒頁數
+    """
+    os.environ["TEXT_LAYER_FAST_PATH"] = "false"
+    from app.utils.gpt_processor import GPTDocumentProcessor
+
+    processor = GPTDocumentProcessor(pdf_path)
+    start_time = time.time()
+    processor.process()
+    elapsed = time.time() - start_time
+    pages = processor.report["total_pages"]
+    return {
+        "total_pages": pages,
+        "elapsed_seconds": round(elapsed, 2),
+        "pages_per_second": round(pages / elapsed, 3),
+    }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: python test/benchmark_ocr.py <PDF路徑>")
+        return
+
+    pdf_path = sys.argv[1]
+    with fitz.open(pdf_path) as pdf:
+        print(f"測試文件: {pdf_path}，共 {len(pdf)} 頁")
+
+    print(f"Tesseract 版本: {check_tesseract()}")
+
+    # 依核心數遞增測試，觀察每核心吞吐量是否維持
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, max(1, cores // 2), cores})
+    print("-" * 50)
+    for workers in worker_counts:
+        report = benchmark_tesseract(pdf_path, workers)
+        print(
+            f"Tesseract {workers} 進程: {report['pages_per_second']} 頁/秒，"
+            f"每核心 {report.get('pages_per_second_per_core', 0)} 頁/秒"
+        )
+
+    if os.getenv("OPENAI_API_KEY"):
+        report = benchmark_gpt(pdf_path)
+        print(f"GPT-4o: {report['pages_per_second']} 頁/秒")
+    else:
+        print("未設定 OPENAI_API_KEY，略過 GPT-4o 測試")
+    print("-" * 50)
+
+
+if __name__ == "__main__":
+    main()
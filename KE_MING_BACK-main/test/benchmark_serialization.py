@@ -0,0 +1,93 @@
+import gzip
+import json
+import os
+import sys
+import time
+
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.responses import BROTLI_QUALITY, GZIP_LEVEL, ORJSON_OPTIONS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_answer(sources=5, chunk_chars=1200):
+    """典型的問答回應：GPT-4o 回答加上完整的來源 chunk、metadata 與圖片"""
+    paragraph = "HK-2034 LED 投光燈，功率 100W，色溫 3000K/4000K/6500K，防水等級 IP66，適用於戶外廣場與停車場照明。"
+    return {
+        "answer": (paragraph * 8)[:800],
+        "sources": [
+            {
+                "content": (paragraph * (chunk_chars // len(paragraph) + 1))[:chunk_chars],
+                "metadata": {
+                    "source": f"/app/uploads/3f1c9a2e-8d4b-4c1e-9b7a-{i:012d}.pdf",
+                    "filename": f"3f1c9a2e-8d4b-4c1e-9b7a-{i:012d}.pdf",
+                    "chunk_id": f"{i:016x}-{'ab' * 16}",
+                    "page": i + 3,
+                    "pages": f"{i + 3}",
+                    "product_ids": "HK-2034,HK-2035",
+                },
+                "score": 0.2345 + i / 100,
+                "page_info": f"(第 {i + 3} 頁)",
+                "images": [
+                    {"url": f"/images/products/{'c3' * 32}.jpeg", "thumb": f"/images/products/{'c3' * 32}_thumb.webp",
+                     "width": 800, "height": 600}
+                    for _ in range(2)
+                ],
+            }
+            for i in range(sources)
+        ],
+    }
+
+
+def time_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1e6, result
+
+
+def main():
+    sources = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    repeat = int(os.getenv("BENCH_REPEAT", "2000"))
+    payload = make_answer(sources)
+
+    print(f"回應內容: {sources} 個來源 chunk，重複 {repeat} 次")
+    print("-" * 70)
+    encoders = {
+        # Starlette JSONResponse 的預設設定
+        "json.dumps": lambda: json.dumps(
+            payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8"),
+        # 原本 stream_chat 中的寫法（非 ASCII 字元轉義成 \\uXXXX，體積更大）
+        "json.dumps(ascii)": lambda: json.dumps(payload).encode("utf-8"),
+        "orjson": lambda: orjson.dumps(payload, option=ORJSON_OPTIONS),
+    }
+    bodies = {}
+    for name, encode in encoders.items():
+        micros, body = time_call(encode, repeat)
+        bodies[name] = body
+        print(f"{name:<20} 序列化 {micros:8.1f} µs  {len(body):8d} bytes")
+
+    print("-" * 70)
+    body = bodies["orjson"]
+    print(f"{'未壓縮':<20} {len(body):8d} bytes")
+    micros, compressed = time_call(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL), max(1, repeat // 10))
+    print(f"{f'gzip (level {GZIP_LEVEL})':<20} {len(compressed):8d} bytes  壓縮 {micros:8.1f} µs  "
+          f"比例 {len(compressed) / len(body):.1%}")
+    if brotli is not None:
+        micros, compressed = time_call(lambda: brotli.compress(body, quality=BROTLI_QUALITY), max(1, repeat // 10))
+        print(f"{f'brotli (quality {BROTLI_QUALITY})':<20} {len(compressed):8d} bytes  壓縮 {micros:8.1f} µs  "
+              f"比例 {len(compressed) / len(body):.1%}")
+    else:
+        print("未安裝 brotli，略過 brotli 測試")
+    print("-" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.flat_vector_store import FlatVectorStore
+
+
+class _UnusedEmbeddings:
+    """基準測試直接寫入向量，不呼叫嵌入模型"""
+
+    def embed_documents(self, texts):
+        raise RuntimeError("基準測試不應呼叫嵌入模型")
+
+    def embed_query(self, text):
+        raise RuntimeError("基準測試不應呼叫嵌入模型")
+
+
+def make_dataset(count, dim, queries, seed=0):
+    """產生帶有群聚結構的隨機單位向量（接近真實嵌入的分佈）與查詢向量"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = vectors[rng.integers(0, count, queries)] + 0.1 * rng.standard_normal((queries, dim)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, query_vectors
+
+
+def exact_top_k(vectors, query_vectors, k):
+    """NumPy 精確計算的標準答案"""
+    scores = query_vectors @ vectors.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def summarize(name, latencies, found, truth, k, stats=None):
+    latencies = np.asarray(latencies) * 1000
+    recall = np.mean([len(f & t) / k for f, t in zip(found, truth)])
+    line = (
+        f"{name:<22} 平均 {latencies.mean():7.2f} ms  p95 {np.percentile(latencies, 95):7.2f} ms  "
+        f"recall@{k} {recall:.4f}"
+    )
+    if stats:
+        line += f"  常駐 {stats['scan_bytes'] / 1024 / 1024:7.1f} MB"
+    print(line)
+
+
+def benchmark_flat(directory, vectors, query_vectors, k, dtype, rescore):
+    name = f"flat_{dtype}_{'rescore' if rescore else 'plain'}"
+    store = FlatVectorStore(
+        os.path.join(directory, name), _UnusedEmbeddings(), dtype=dtype, keep_full_precision=rescore
+    )
+    ids = [str(i) for i in range(len(vectors))]
+    start = time.time()
+    for offset in range(0, len(vectors), 5000):
+        store.add_embeddings(
+            ids[offset:offset + 5000], vectors[offset:offset + 5000].tolist(),
+            [{"source": "bench"} for _ in ids[offset:offset + 5000]], ids[offset:offset + 5000],
+        )
+    print(f"{name} 寫入 {len(vectors)} 筆耗時 {time.time() - start:.1f} 秒")
+
+    latencies, found = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        results = store.similarity_search_by_vector_with_score(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - start)
+        found.append({int(doc.page_content) for doc, _ in results})
+    return latencies, found, store.storage_stats()
+
+
+def benchmark_chroma(directory, vectors, query_vectors, k):
+    import chromadb
+
+    client = chromadb.PersistentClient(path=os.path.join(directory, "chroma"))
+    collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+    start = time.time()
+    for offset in range(0, len(vectors), 5000):
+        batch = vectors[offset:offset + 5000]
+        collection.add(
+            ids=[str(offset + i) for i in range(len(batch))],
+            embeddings=batch.tolist(),
+            metadatas=[{"source": "bench"} for _ in range(len(batch))],
+        )
+    print(f"chroma 寫入 {len(vectors)} 筆耗時 {time.time() - start:.1f} 秒")
+
+    latencies, found = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        results = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append(time.perf_counter() - start)
+        found.append({int(i) for i in results["ids"][0]})
+    return latencies, found
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    # 設定 BENCH_TRUNCATE 可模擬以 dimensions 參數截短的 Matryoshka 向量（取前 N 維再正規化）；
+    # 隨機資料沒有真實嵌入「前面維度較重要」的特性，截短後的 recall 會偏低，正式評估請用真實語料
+    dim = int(os.getenv("BENCH_DIMENSIONS", "1536"))
+    truncate = int(os.getenv("BENCH_TRUNCATE", "0"))
+    queries = int(os.getenv("BENCH_QUERIES", "100"))
+    k = int(os.getenv("BENCH_TOP_K", "10"))
+
+    print(f"資料量: {count} 筆，維度: {dim}，查詢數: {queries}，k={k}")
+    vectors, query_vectors = make_dataset(count, dim, queries)
+    # 標準答案一律以完整維度、完整精度計算
+    truth = exact_top_k(vectors, query_vectors, k)
+    if truncate:
+        print(f"截短為 {truncate} 維")
+        vectors = vectors[:, :truncate] / np.linalg.norm(vectors[:, :truncate], axis=1, keepdims=True)
+        query_vectors = query_vectors[:, :truncate] / np.linalg.norm(query_vectors[:, :truncate], axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        print("-" * 70)
+        for dtype, rescore in (("float32", False), ("float16", False), ("float16", True),
+                               ("int8", False), ("int8", True)):
+            latencies, found, stats = benchmark_flat(directory, vectors, query_vectors, k, dtype, rescore)
+            summarize(f"flat/{dtype}{'+rescore' if rescore else ''}", latencies, found, truth, k, stats)
+        try:
+            latencies, found = benchmark_chroma(directory, vectors, query_vectors, k)
+            summarize("chroma/hnsw", latencies, found, truth, k,
+                      {"scan_bytes": vectors.shape[0] * vectors.shape[1] * 4})
+        except ImportError:
+            print("未安裝 chromadb，略過 Chroma 測試")
+        print("-" * 70)
+
+
+if __name__ == "__main__":
+    main()
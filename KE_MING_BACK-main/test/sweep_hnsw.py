@@ -0,0 +1,155 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_vector_store import make_dataset
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def load_namespace_vectors(namespace):
+    """讀取既有命名空間集合中的所有向量（真實語料）"""
+    from app.utils.vector_store import collection_name, _get_client
+
+    collection = _get_client().get_collection(collection_name(namespace))
+    vectors = []
+    total = collection.count()
+    for offset in range(0, total, 5000):
+        batch = collection.get(include=["embeddings"], limit=5000, offset=offset)
+        vectors.extend(batch["embeddings"])
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def split_queries(vectors, queries, seed=0):
+    """隨機取出部分向量加上少量雜訊作為查詢，並從索引資料中移除（避免查到自己）"""
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(vectors), size=min(queries, len(vectors) // 10), replace=False)
+    mask = np.ones(len(vectors), dtype=bool)
+    mask[picked] = False
+    query_vectors = vectors[picked] + 0.05 * rng.standard_normal(vectors[picked].shape).astype(np.float32)
+    return vectors[mask], query_vectors
+
+
+def exact_top_k(vectors, query_vectors, k, space):
+    """依距離函數精確計算的標準答案"""
+    if space == "cosine":
+        scores = (query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)) @ (
+            vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        ).T
+    elif space == "ip":
+        scores = query_vectors @ vectors.T
+    else:
+        scores = -(
+            (query_vectors ** 2).sum(axis=1)[:, None] - 2 * query_vectors @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+        )
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def sweep(vectors, query_vectors, args):
+    """對每組 (space, M, construction_ef) 建一次索引，再依序調整 search_ef 量測"""
+    import chromadb
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        client = chromadb.PersistentClient(path=directory)
+        for space in args.spaces.split(","):
+            truth = exact_top_k(vectors, query_vectors, args.k, space)
+            for m in _int_list(args.m):
+                for construction_ef in _int_list(args.construction_ef):
+                    name = f"sweep_{space}_{m}_{construction_ef}"
+                    collection = client.create_collection(name, configuration={
+                        "hnsw": {"space": space, "max_neighbors": m, "ef_construction": construction_ef},
+                    })
+                    start = time.time()
+                    for offset in range(0, len(vectors), 5000):
+                        batch = vectors[offset:offset + 5000]
+                        collection.add(
+                            ids=[str(offset + i) for i in range(len(batch))], embeddings=batch.tolist()
+                        )
+                    build_seconds = time.time() - start
+
+                    for search_ef in _int_list(args.search_ef):
+                        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+                        # Chroma 在載入索引時才讀取 ef_search，需釋放快取後重新開啟
+                        client.clear_system_cache()
+                        client = chromadb.PersistentClient(path=directory)
+                        collection = client.get_collection(name)
+                        # 預熱，避免第一次查詢載入索引的時間計入
+                        collection.query(query_embeddings=[query_vectors[0].tolist()], n_results=args.k, include=[])
+                        latencies, recalls = [], []
+                        for query, expected in zip(query_vectors, truth):
+                            start = time.perf_counter()
+                            found = collection.query(
+                                query_embeddings=[query.tolist()], n_results=args.k, include=[]
+                            )["ids"][0]
+                            latencies.append(time.perf_counter() - start)
+                            recalls.append(len({int(i) for i in found} & expected) / args.k)
+                        row = {
+                            "space": space, "M": m, "construction_ef": construction_ef, "search_ef": search_ef,
+                            "recall": float(np.mean(recalls)),
+                            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+                            "build_seconds": build_seconds,
+                        }
+                        results.append(row)
+                        print(
+                            f"{space:<7} M={m:<3} construction_ef={construction_ef:<4} search_ef={search_ef:<4} "
+                            f"recall@{args.k} {row['recall']:.4f}  p95 {row['p95_ms']:6.2f} ms  "
+                            f"建索引 {build_seconds:.1f} 秒"
+                        )
+                    client.delete_collection(name)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW 參數掃描：量測 recall@k 與 p95 延遲")
+    parser.add_argument("--count", type=int, default=20000, help="合成資料筆數")
+    parser.add_argument("--dimensions", type=int, default=1536, help="合成資料維度")
+    parser.add_argument("--namespace", help="改用既有命名空間的真實向量")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--spaces", default="cosine,l2")
+    parser.add_argument("--m", default="8,16,32")
+    parser.add_argument("--construction-ef", default="64,100,200")
+    parser.add_argument("--search-ef", default="10,50,100,200")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="推薦設定須達到的 recall")
+    args = parser.parse_args()
+
+    if args.namespace:
+        vectors = load_namespace_vectors(args.namespace)
+        print(f"命名空間 {args.namespace}: {len(vectors)} 筆，維度 {vectors.shape[1]}")
+        vectors, query_vectors = split_queries(vectors, args.queries)
+    else:
+        vectors, query_vectors = make_dataset(args.count, args.dimensions, args.queries)
+        print(f"合成資料: {len(vectors)} 筆，維度 {args.dimensions}")
+
+    print("-" * 90)
+    results = sweep(vectors, query_vectors, args)
+    print("-" * 90)
+
+    qualified = [row for row in results if row["recall"] >= args.target_recall]
+    if not qualified:
+        print(f"沒有設定達到 recall@{args.k} >= {args.target_recall}，請加大 M 或 ef")
+        return
+    best = min(qualified, key=lambda row: (row["p95_ms"], row["build_seconds"]))
+    print(
+        f"推薦設定（recall@{args.k} >= {args.target_recall} 中 p95 最低）: "
+        f"space={best['space']} M={best['M']} construction_ef={best['construction_ef']} "
+        f"search_ef={best['search_ef']}（recall {best['recall']:.4f}，p95 {best['p95_ms']:.2f} ms）"
+    )
+    print(
+        "套用方式: POST /api/namespaces "
+        f'{{"namespace": "...", "hnsw": {{"space": "{best["space"]}", "M": {best["M"]}, '
+        f'"construction_ef": {best["construction_ef"]}, "search_ef": {best["search_ef"]}}}}}'
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+
+# 單元測試不連線 OpenAI，資料目錄使用暫存目錄（需在匯入 app 模組前設定）
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ["DATA_PATH"] = tempfile.mkdtemp(prefix="rag-test-data-")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import gc
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+
+class FakeEmbeddings(Embeddings):
+    """以文字雜湊產生固定向量，不連線 OpenAI"""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+        return rng.random(8).tolist()
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """索引世代、產品資料庫與圖片索引都放在各測試自己的暫存目錄"""
+    from app.utils import image_store, product_store, vector_store
+
+    monkeypatch.setattr(vector_store, "BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(vector_store, "GENERATION_FILE", str(tmp_path / "vector_generation"))
+    monkeypatch.setattr(
+        vector_store, "PREVIOUS_GENERATION_FILE", str(tmp_path / "vector_generation.previous")
+    )
+    monkeypatch.setattr(vector_store, "_get_embedding_function", lambda generation=None: FakeEmbeddings())
+    monkeypatch.setattr(product_store, "LEGACY_PRODUCT_DB_PATH", str(tmp_path / "products.sqlite3"))
+    monkeypatch.setattr(image_store, "IMAGE_DIR", str(tmp_path / "images"))
+    monkeypatch.setattr(image_store, "IMAGE_INDEX_PATH", str(tmp_path / "image_store.sqlite3"))
+    yield tmp_path
+    vector_store._release_client()
+    gc.collect()
+    vector_store._stop_retired_systems()
+
+
+@pytest.fixture
+def flat_data_dir(data_dir, monkeypatch):
+    """同 data_dir，但使用平面向量後端（不需啟動 Chroma）"""
+    from app.utils import vector_store
+
+    monkeypatch.setattr(vector_store, "VECTOR_STORE_BACKEND", "flat")
+    yield data_dir
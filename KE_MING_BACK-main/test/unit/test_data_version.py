@@ -0,0 +1,40 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import history
+from app.utils import data_version
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_version, "DATA_VERSION_PATH", str(tmp_path / "data_version.sqlite3"))
+    monkeypatch.setattr(history, "chat_histories", {})
+    app = FastAPI()
+    app.include_router(history.router)
+    return TestClient(app)
+
+
+def test_history_returns_304_until_changed(client):
+    first = client.get("/api/history")
+    etag = first.headers["ETag"]
+    assert history.BOOT_ID in etag
+
+    assert client.get("/api/history", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/history", json={"messages": [{"role": "user", "content": "你好"}]})
+    changed = client.get("/api/history", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.json()) == 1
+
+
+def test_history_etag_is_scoped_to_process(client, monkeypatch):
+    etag = client.get("/api/history").headers["ETag"]
+    # 另一個進程（或重啟後）記憶體中的對話記錄不同，同一版本號也不可回傳 304
+    monkeypatch.setattr(history, "BOOT_ID", "other")
+    assert client.get("/api/history", headers={"If-None-Match": etag}).status_code == 200
+    # 沒有 ETag 時不以 Last-Modified 判斷
+    assert "Last-Modified" not in client.get("/api/history").headers
+    assert client.get(
+        "/api/history", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"}
+    ).status_code == 200
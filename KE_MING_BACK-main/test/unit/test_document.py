@@ -0,0 +1,49 @@
+import pytest
+from langchain.schema import Document
+
+from app.rag import document
+from app.utils import vector_store
+
+pytestmark = pytest.mark.usefixtures("flat_data_dir")
+
+A = "/uploads/a.txt"
+B = "/uploads/b.txt"
+
+
+def _sources():
+    store = vector_store.get_vector_store()
+    return sorted({metadata["source"] for metadata in store.get(include=["metadatas"])["metadatas"]})
+
+
+def _failing_add(failures: int, monkeypatch):
+    store = vector_store.get_vector_store()
+    original = store.add_documents
+    calls = []
+
+    def add_documents(documents, **kwargs):
+        calls.append(len(documents))
+        if len(calls) <= failures:
+            raise RuntimeError("embedding service unavailable")
+        return original(documents, **kwargs)
+
+    monkeypatch.setattr(store, "add_documents", add_documents)
+    return calls
+
+
+def test_failed_add_is_retried_once(monkeypatch):
+    document.index_documents({A: [Document(page_content="alpha", metadata={"source": A})]})
+    calls = _failing_add(1, monkeypatch)
+
+    document.index_documents({B: [Document(page_content="beta", metadata={"source": B})]})
+    assert calls == [1, 1]
+    assert _sources() == [A, B]
+
+
+def test_failed_add_keeps_other_sources(monkeypatch):
+    document.index_documents({A: [Document(page_content="alpha", metadata={"source": A})]})
+    _failing_add(2, monkeypatch)
+
+    with pytest.raises(RuntimeError):
+        document.index_documents({B: [Document(page_content="beta", metadata={"source": B})]})
+    # 不可為了寫入失敗的文件重建集合而刪掉其他文件的 chunk
+    assert _sources() == [A]
@@ -0,0 +1,72 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import upload
+from app.utils import data_version, file_registry
+
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_registry, "FILE_REGISTRY_PATH", str(tmp_path / "file_registry.sqlite3"))
+    monkeypatch.setattr(data_version, "DATA_VERSION_PATH", str(tmp_path / "data_version.sqlite3"))
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(upload.router)
+    return TestClient(app)
+
+
+def _register(count: int):
+    for i in range(count):
+        file_registry.begin_processing(f"{i:04d}.pdf", f"文件{i}.pdf", "default", None, 10, 1)
+        file_registry.finish_processing(f"{i:04d}.pdf", 3)
+
+
+def test_listing_without_limit_returns_every_file(client):
+    _register(120)
+    response = client.get("/api/files")
+    assert response.status_code == 200
+    assert response.headers["X-Total-Count"] == "120"
+    assert len(response.json()) == 120
+
+    page = client.get("/api/files", params={"limit": 50, "offset": 100})
+    assert len(page.json()) == 20
+
+
+def test_listing_reports_index_status_without_status_field(client):
+    _register(1)
+    record = client.get("/api/files").json()[0]
+    # 前端以 status 判斷上傳中的暫存項目，已登記的文件不可帶 status
+    assert "status" not in record
+    assert record["index_status"] == file_registry.STATUS_INDEXED
+    assert record["chunks"] == 3
+
+
+def test_legacy_import_uses_chunk_counts(tmp_path):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    (upload_dir / "indexed.txt").write_text("內容")
+    (upload_dir / "missing.txt").write_text("內容")
+
+    assert file_registry.needs_legacy_import()
+    assert file_registry.import_legacy_uploads(str(upload_dir), {".txt"}, {"indexed.txt": 7}) == 2
+    assert not file_registry.needs_legacy_import()
+
+    records = {record["stored_name"]: record for record in file_registry.list_files()[0]}
+    assert (records["indexed.txt"]["status"], records["indexed.txt"]["chunks"]) == (file_registry.STATUS_INDEXED, 7)
+    assert records["missing.txt"]["status"] == file_registry.STATUS_FAILED
+    assert records["missing.txt"]["chunks"] == 0
+
+
+def test_upload_validation_errors_stay_400(client):
+    response = client.post("/api/upload", files={"file": ("notes.exe", b"x")})
+    assert response.status_code == 400
+
+    response = client.post(
+        "/api/upload", files={"file": ("notes.txt", b"x")}, data={"extraction_method": "unknown"}
+    )
+    assert response.status_code == 400
+    assert "unknown" in response.json()["detail"]
@@ -0,0 +1,39 @@
+import pytest
+
+from app.rag.filters import build_where
+from app.utils import vector_store
+
+CHUNKS = [
+    ("chair", {"product_id": "HK-1", "product_category": "椅子"}),
+    ("desk", {"product_id": "HK-2", "product_category": "桌子"}),
+    ("pdf page", {"extraction_method": "text_layer", "page": 1}),
+    ("vision record", {"extraction_method": "gpt4o", "record_type": "product", "page": 2}),
+    ("text file", {"extraction_method": "text"}),
+]
+
+
+@pytest.fixture
+def store(flat_data_dir):
+    store = vector_store.get_vector_store()
+    store.add_texts(
+        [text for text, _ in CHUNKS],
+        metadatas=[{"source": "/uploads/x", **metadata} for _, metadata in CHUNKS],
+        ids=[text for text, _ in CHUNKS],
+    )
+    return store
+
+
+def _matching(store, where):
+    return sorted(store.get(where=where)["ids"])
+
+
+def test_explicit_categories_only_match_products(store):
+    assert _matching(store, build_where({"categories": ["椅子"]})) == ["chair"]
+
+
+def test_inferred_categories_keep_uncategorized_chunks(store):
+    where = build_where({"categories": ["椅子"], "page_to": 1}, loose_categories=True)
+    assert _matching(store, where) == ["pdf page"]
+
+    where = build_where({"categories": ["椅子"]}, loose_categories=True)
+    assert _matching(store, where) == ["chair", "pdf page", "text file", "vision record"]
@@ -0,0 +1,100 @@
+import io
+import os
+import sqlite3
+
+import pytest
+from PIL import Image
+
+from app.utils import image_store, vector_store
+
+
+pytestmark = pytest.mark.usefixtures("data_dir")
+
+
+def _png(color) -> bytes:
+    buffered = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def _register(source: str, image: dict):
+    image_store.set_source_images(source, {"page_1_1": {**image, "page": 1}})
+
+
+def _exists(image: dict) -> bool:
+    return os.path.exists(os.path.join(image_store.IMAGE_DIR, image_store.image_relative_path(image["hash"], "png")))
+
+
+def test_shared_image_survives_release_while_other_source_is_extracting():
+    shared = _png("red")
+    first = image_store.save_image_bytes(shared, "png", source="a.pdf")
+    _register("a.pdf", first)
+
+    # b.pdf 提取到同一張圖片（檔案已存在），尚未登記引用時 a.pdf 被刪除
+    second = image_store.save_image_bytes(shared, "png", source="b.pdf")
+    image_store.release_source_images("a.pdf")
+    assert _exists(second)
+
+    _register("b.pdf", second)
+    assert image_store.image_ref_count(second["hash"]) == 1
+    assert image_store.release_source_images("b.pdf") == 1
+    assert not _exists(second)
+
+
+def test_release_during_extraction_removes_unregistered_images():
+    image = image_store.save_image_bytes(_png("blue"), "png", source="c.pdf")
+    assert _exists(image)
+    # 處理失敗時釋放：只登記為提取中的圖片也會被回收
+    image_store.release_source_images("c.pdf")
+    assert not _exists(image)
+
+
+def test_staged_images_are_committed_to_the_written_generation():
+    image = image_store.save_image_bytes(_png("green"), "png", source="d.pdf")
+    _register("d.pdf", image)
+    image_store.set_chunk_pages("d.pdf", {"chunk-1": [1]})
+
+    # 背景重建重新提取，入庫到新世代前使用中的世代不受影響
+    generation = vector_store.create_generation()
+    image_store.stage_source_images("d.pdf", {"page_1_1": {**image, "page": 1}})
+    image_store.commit_source_images("d.pdf", generation)
+    image_store.set_chunk_pages("d.pdf", {"chunk-2": [1]}, generation)
+    assert [i["key"] for i in image_store.get_chunk_images(["chunk-1"])["chunk-1"]] == ["page_1_1"]
+    assert image_store.get_chunk_images(["chunk-2"]) == {}
+
+    vector_store.activate_generation(generation)
+    assert "chunk-2" in image_store.get_chunk_images(["chunk-2"])
+
+    assert image_store.image_ref_count(image["hash"]) == 1
+
+    # 清空索引刪除兩個世代後，不再被引用的圖片一併回收
+    vector_store.reset_vector_store()
+    assert not _exists(image)
+
+
+def test_legacy_tables_are_adopted_into_current_generation():
+    image = image_store.save_image_bytes(_png("white"), "png")
+    os.makedirs(os.path.dirname(image_store.IMAGE_INDEX_PATH), exist_ok=True)
+    conn = sqlite3.connect(image_store.IMAGE_INDEX_PATH)
+    conn.execute(
+        "CREATE TABLE images (hash TEXT PRIMARY KEY, path TEXT NOT NULL, ext TEXT NOT NULL, size INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE TABLE image_refs (source TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (source, hash))")
+    conn.execute(
+        "CREATE TABLE source_images (source TEXT NOT NULL, image_key TEXT NOT NULL, hash TEXT NOT NULL, "
+        "page INTEGER NOT NULL, PRIMARY KEY (source, image_key))"
+    )
+    conn.execute(
+        "CREATE TABLE chunk_pages (chunk_id TEXT NOT NULL, source TEXT NOT NULL, page INTEGER NOT NULL, "
+        "PRIMARY KEY (chunk_id, page))"
+    )
+    conn.execute("INSERT OR IGNORE INTO images VALUES (?, ?, ?, ?)",
+                 (image["hash"], image["path"], image["ext"], image["size"]))
+    conn.execute("INSERT INTO image_refs VALUES ('e.pdf', ?)", (image["hash"],))
+    conn.execute("INSERT INTO source_images VALUES ('e.pdf', 'page_2_1', ?, 2)", (image["hash"],))
+    conn.execute("INSERT INTO chunk_pages VALUES ('chunk-e', 'e.pdf', 2)")
+    conn.commit()
+    conn.close()
+
+    assert [i["key"] for i in image_store.get_chunk_images(["chunk-e"])["chunk-e"]] == ["page_2_1"]
+    assert image_store.release_source_images("e.pdf") == 1
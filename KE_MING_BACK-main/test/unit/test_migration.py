@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.rag import migration
+from app.utils import vector_store
+
+pytestmark = pytest.mark.usefixtures("flat_data_dir")
+
+A = "/uploads/a.pdf"
+B = "/uploads/b.pdf"
+
+
+def _write_live(source: str, text: str, namespace: str = None):
+    with vector_store.writable_store(namespace, sources=[source]) as (store, _):
+        store.add_texts([text], metadatas=[{"source": source}], ids=[f"{source}-{text}"])
+
+
+def _delete_live(source: str, namespace: str = None):
+    with vector_store.writable_store(namespace, sources=[source]) as (store, _):
+        store.delete(where={"source": source})
+
+
+def _sources_in(namespace: str = None, generation: str = None):
+    store = vector_store.get_vector_store(namespace=namespace, generation=generation)
+    return sorted({metadata["source"] for metadata in store.get(include=["metadatas"])["metadatas"]})
+
+
+def _migrated_job():
+    """建立遷移工作並把目前使用中的索引完整複製到影子世代（不雙讀、不自動切換）"""
+    job = migration.new_migration_job("text-embedding-3-small", auto_cutover=False)
+    job["generation"] = vector_store.create_generation(
+        {"model": "text-embedding-3-small", "dimensions": None}
+    )
+    for item in vector_store.list_namespaces():
+        job["namespaces"][item["namespace"]] = {"total": 0, "migrated": 0}
+        asyncio.run(migration._migrate_namespace(job, item["namespace"], None))
+    return job
+
+
+def test_catch_up_copies_only_sources_written_during_migration():
+    _write_live(A, "alpha")
+    job = _migrated_job()
+    assert _sources_in(generation=job["generation"]) == [A]
+
+    _write_live(B, "beta")
+    _delete_live(A)
+    assert migration._catch_up(job) == 1.0
+    assert _sources_in(generation=job["generation"]) == [B]
+    assert job["writes"] == vector_store.source_write_marks()
+
+    # 沒有新的寫入時不再複製
+    shadow = vector_store.get_vector_store(generation=job["generation"])
+    shadow.add_texts(["stray"], metadatas=[{"source": "/uploads/stray.pdf"}], ids=["stray"])
+    migration._catch_up(job)
+    assert _sources_in(generation=job["generation"]) == [B, "/uploads/stray.pdf"]
+
+
+def test_cutover_refuses_incomplete_shadow():
+    _write_live(A, "alpha")
+    job = _migrated_job()
+    live = vector_store.current_generation()
+    # 影子世代缺少未經寫入記錄的 chunk，追趕補不上，覆蓋率不足
+    vector_store.get_vector_store(generation=job["generation"]).delete(where={"source": A})
+    job["status"] = "ready"
+
+    with pytest.raises(RuntimeError):
+        migration.cutover(job)
+    assert vector_store.current_generation() == live
+    assert job["coverage"] == 0.0
+    assert job["status"] == "ready"
+
+
+def test_cutover_follows_namespaces_created_and_dropped():
+    _write_live(A, "alpha")
+    _write_live(B, "gone", namespace="gone")
+    job = _migrated_job()
+    assert sorted(job["namespaces"]) == ["default", "gone"]
+
+    vector_store.drop_namespace("gone")
+    vector_store.create_namespace("late")
+    _write_live(B, "beta", namespace="late")
+    job["status"] = "ready"
+    migration.cutover(job)
+
+    assert vector_store.current_generation() == job["generation"]
+    assert job["status"] == "finished"
+    assert sorted(item["namespace"] for item in vector_store.list_namespaces()) == ["default", "late"]
+    assert _sources_in() == [A]
+    assert _sources_in(namespace="late") == [B]
@@ -0,0 +1,111 @@
+import pytest
+
+from app.rag.product_query import answer_structured_query, parse_product_constraints
+from app.utils import product_store, vector_store
+
+PRODUCTS = [
+    {"id": "HK-2001", "name": "充電工作燈", "description": "USB 充電", "price": 800, "category": "工作燈",
+     "specifications": {"亮度": "1000流明", "電壓": "12V", "防水": "IP65"}},
+    {"id": "HK-2002", "name": "磁吸工作燈", "description": "底部磁吸", "price": 1500, "category": "工作燈",
+     "specifications": {"亮度": "2000流明", "電壓": "24V", "防水": "IP44"}},
+    {"id": "HK-3001", "name": "感應頭燈", "description": "揮手感應", "price": 450, "category": "頭燈",
+     "specifications": {"亮度": "300流明", "防水": "IP65"}},
+]
+
+
+@pytest.fixture(autouse=True)
+def product_db(data_dir):
+    product_store.upsert_products("/uploads/catalog.json", PRODUCTS, run="run-1")
+
+
+@pytest.mark.parametrize("query", [
+    "請問第3-5頁的工作燈",
+    "這款工作燈支援 12-24V 電壓嗎？",
+    "2023-2024 年的工作燈規格有改嗎",
+    "IP65 的頭燈怎麼充電？",
+    "工作燈怎麼充電",
+])
+def test_non_listing_questions_go_to_retrieval(query):
+    assert parse_product_constraints(query) is None
+    assert answer_structured_query(query) is None
+
+
+def test_page_and_year_ranges_are_not_prices():
+    constraints = parse_product_constraints("第3-5頁有哪些工作燈")
+    assert constraints["categories"] == ["工作燈"]
+    assert constraints["min_price"] is None and constraints["max_price"] is None
+
+    constraints = parse_product_constraints("2023-2024 年推出了哪些工作燈")
+    assert constraints["min_price"] is None and constraints["max_price"] is None
+
+
+def test_price_range_needs_price_unit_or_word():
+    constraints = parse_product_constraints("500 到 1000 元的工作燈有哪些")
+    assert (constraints["min_price"], constraints["max_price"]) == (500, 1000)
+
+    constraints = parse_product_constraints("價格 500-1000 有哪些工作燈")
+    assert (constraints["min_price"], constraints["max_price"]) == (500, 1000)
+
+    constraints = parse_product_constraints("500-1000 有哪些工作燈")
+    assert constraints["min_price"] is None and constraints["max_price"] is None
+
+
+def test_unit_suffixed_range_maps_to_spec():
+    constraints = parse_product_constraints("列出 12-24V 的工作燈")
+    assert constraints["min_price"] is None
+    assert constraints["spec_ranges"] == [{"key": "電壓", "min": 12}, {"key": "電壓", "max": 24}]
+
+    answer = answer_structured_query("1000流明以上的燈有哪些")
+    assert [source["metadata"]["product_id"] for source in answer["sources"]] == ["HK-2001", "HK-2002"]
+
+
+def test_listing_with_price_bound():
+    answer = answer_structured_query("1000元以下的工作燈有哪些")
+    assert [source["metadata"]["product_id"] for source in answer["sources"]] == ["HK-2001"]
+
+
+def test_vocabulary_is_scoped_by_namespace():
+    product_store.upsert_products(
+        "/uploads/other.json",
+        [{"id": "XY-0001", "name": "手電筒", "description": "鋁合金", "price": 300, "category": "手電筒",
+          "specifications": {"續航": "8小時"}}],
+        run="run-1", namespace="other",
+    )
+    vocabulary = product_store.get_product_vocabulary("default")
+    assert "續航" not in vocabulary["spec_keys"]
+    assert product_store.find_spec_key_by_unit("小時", "default") is None
+    assert product_store.find_spec_key_by_unit("小時", "other") == "續航"
+
+
+def test_products_follow_index_generation():
+    generation = vector_store.create_generation()
+    product_store.copy_products(vector_store.current_generation(), generation, sources=["/uploads/catalog.json"])
+    vector_store.activate_generation(generation)
+    assert product_store.get_product_vocabulary()["categories"] == ["工作燈", "頭燈"]
+
+    # 清空索引切換到新的空世代，產品資料隨之清空
+    vector_store.reset_vector_store()
+    assert product_store.get_product_vocabulary() == {"categories": [], "spec_keys": []}
+
+
+def test_vocabulary_follows_removed_products():
+    product_store.upsert_products(
+        "/uploads/extra.json",
+        [{"id": "HK-9001", "name": "露營燈", "description": "掛鉤", "price": 600, "category": "露營燈",
+          "specifications": {"續航": "8小時"}}],
+        run="run-1",
+    )
+    vocabulary = product_store.get_product_vocabulary()
+    assert "露營燈" in vocabulary["categories"] and "續航" in vocabulary["spec_keys"]
+
+    product_store.release_source_products("/uploads/extra.json")
+    vocabulary = product_store.get_product_vocabulary()
+    assert vocabulary == {"categories": ["工作燈", "頭燈"], "spec_keys": ["亮度", "防水", "電壓"]}
+
+
+def test_structured_answer_uses_loader_text():
+    from app.rag.document import JSONProductLoader
+
+    answer = answer_structured_query("1000元以下的工作燈有哪些")
+    document = JSONProductLoader("/uploads/catalog.json").product_to_document(PRODUCTS[0])
+    assert answer["sources"][0]["content"] == document.page_content
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from app.rag import rebuild
+from app.utils import vector_store
+
+pytestmark = pytest.mark.usefixtures("data_dir")
+
+A = "/uploads/a.pdf"
+B = "/uploads/b.pdf"
+
+
+def _write_live(source: str, text: str):
+    with vector_store.writable_store(sources=[source]) as (store, _):
+        store.add_texts([text], metadatas=[{"source": source}])
+
+
+def _sources_in(generation=None):
+    store = vector_store.get_vector_store(generation=generation)
+    return sorted({metadata["source"] for metadata in store.get(include=["metadatas"])["metadatas"]})
+
+
+def test_final_catch_up_includes_writes_after_first_pass():
+    _write_live(A, "alpha")
+    job = rebuild.new_rebuild_job({A: "default"})
+    generation = vector_store.create_generation()
+    job["generation"] = generation
+    asyncio.run(rebuild._copy_sources(job, job["sources"], generation))
+
+    # b.pdf 上傳後仍在處理中，第一次追趕時使用中的索引還沒有它的 chunk
+    rebuild._catch_up(job, generation, lambda: {A: "default", B: "default"})
+    assert _sources_in(generation) == [A]
+
+    # 處理完成（文件修改時間不變）後 a.pdf 被刪除，切換前持鎖的追趕仍要補上
+    _write_live(B, "beta")
+    rebuild._finalize(job, generation, lambda: {B: "default"})
+
+    assert vector_store.current_generation() == generation
+    assert _sources_in() == [B]
+
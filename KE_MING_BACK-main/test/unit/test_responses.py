@@ -0,0 +1,92 @@
+import asyncio
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.utils import responses
+from app.utils.responses import CompressionMiddleware
+
+LARGE = "產品資料" * 1000
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @app.get("/large")
+    def large():
+        return PlainTextResponse(LARGE)
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/events")
+    def events():
+        return StreamingResponse(iter([f"data: {LARGE}\n\n"]), media_type="text/event-stream")
+
+    return TestClient(app)
+
+
+def test_large_response_is_compressed(client):
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.text == LARGE
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "ok"
+
+
+def test_sse_is_not_compressed(client):
+    response = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == f"data: {LARGE}\n\n"
+
+
+@pytest.mark.parametrize("accept", ["gzip;q=0", "identity", "*;q=0, br;q=0"])
+def test_refused_encodings_are_not_used(client, accept):
+    response = client.get("/large", headers={"Accept-Encoding": accept})
+    assert "content-encoding" not in response.headers
+
+
+def test_negotiation_falls_back_to_gzip_without_brotli(monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    assert responses._negotiate("br, gzip;q=0.5") == "gzip"
+    assert responses._negotiate("br") is None
+    assert responses._negotiate("*") == "gzip"
+
+
+def test_streaming_chunks_are_compressed_as_they_arrive():
+    chunks = [b"first chunk " * 10, b"second chunk " * 10, b""]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain")]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app)(scope, None, send))
+
+    assert dict(sent[0]["headers"])[b"content-encoding"] == b"gzip"
+    bodies = [message["body"] for message in sent[1:]]
+    assert len(bodies) == len(chunks)
+    # 每段送出時都已 flush，解壓到目前為止的資料即可得到已送出的內容
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(bodies[0]) == chunks[0]
+    assert decoder.decompress(bodies[1]) == chunks[1]
+    decoder.decompress(bodies[2])
+    assert decoder.eof
@@ -0,0 +1,30 @@
+from app.utils.gpt_processor import _garbled_ratio, _is_garbled_char
+
+# 實際產品目錄的文字層（含 CJK 擴充 A 區與相容區的罕用字）
+CATALOG_TEXT = """
+HK-2189 電池式磁吸軟管工作燈
+鋁合金燈頭，矽膠軟管可 360° 彎折，底部強力磁鐵可吸附於鈑金、車架。
+內建 18650 鋰電池 3.7V 2600mAh，續航約 8 小時，USB Type-C 充電。
+亮度 1000 流明，色溫 6500K，防水等級 IP65。
+適用：汽車保養、機車維修、鐵件焊接、㸃膠作業、䓕田灌溉機具檢修。
+配件：掛勾、充電線、說明書。裝箱數量 20 入，建議售價 NT$1,299。
+"""
+
+
+def test_catalog_text_with_rare_characters_is_not_garbled():
+    assert not _is_garbled_char("㸃")  # U+3E03，CJK 擴充 A 區
+    assert not _is_garbled_char("䓕")  # U+44D5，CJK 擴充 A 區
+    assert not _is_garbled_char("𨧀")  # U+289C0，CJK 擴充 B 區
+    assert _garbled_ratio(CATALOG_TEXT) == 0.0
+
+
+def test_private_use_and_replacement_characters_are_garbled():
+    assert _is_garbled_char("\ue000")  # 私用區
+    assert _is_garbled_char("\U000f0001")
+    assert _is_garbled_char("\ufffd")
+    assert _is_garbled_char("\u0378")  # 未指派碼位
+
+
+def test_font_mapping_garbage_exceeds_threshold():
+    garbled = "HK-2189 " + "\ufffd" * 10
+    assert _garbled_ratio(garbled) > 0.5
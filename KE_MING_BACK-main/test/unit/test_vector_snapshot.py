@@ -0,0 +1,21 @@
+import pytest
+
+from app.utils import vector_snapshot, vector_store
+
+pytestmark = pytest.mark.usefixtures("data_dir")
+
+
+def test_export_pages_by_chunk_id_and_round_trips(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_snapshot, "SNAPSHOT_BATCH_SIZE", 2)
+    store = vector_store.get_vector_store()
+    texts = [f"chunk {i}" for i in range(5)]
+    store.add_texts(texts, metadatas=[{"source": "/uploads/a.pdf"}] * 5, ids=[f"id-{i}" for i in range(5)])
+
+    path = str(tmp_path / "snapshot.kmvs.zst")
+    summary = vector_snapshot.export_snapshot(path)
+    assert summary["namespaces"] == {"default": 5}
+
+    imported = vector_snapshot.import_snapshot(path)
+    assert vector_store.current_generation() == imported["generation"]
+    restored = vector_store.get_vector_store().get(include=["documents"])
+    assert sorted(zip(restored["ids"], restored["documents"])) == [(f"id-{i}", f"chunk {i}") for i in range(5)]
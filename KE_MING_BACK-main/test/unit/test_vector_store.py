@@ -0,0 +1,62 @@
+import gc
+import os
+
+import pytest
+
+from app.utils import vector_store
+
+pytestmark = pytest.mark.usefixtures("data_dir")
+
+
+def _add(texts, namespace="default", generation=None):
+    store = vector_store.get_vector_store(namespace=namespace, generation=generation)
+    store.add_texts(texts, metadatas=[{"source": f"/uploads/{text}.pdf"} for text in texts])
+
+
+def test_reset_discards_rollback_target():
+    _add(["first"])
+    generation = vector_store.create_generation()
+    _add(["second"], generation=generation)
+    old = vector_store.activate_generation(generation)
+    assert vector_store.previous_generation() == old
+
+    vector_store.reset_vector_store()
+
+    assert vector_store.previous_generation() is None
+    assert not os.path.exists(vector_store.generation_path(old))
+    with pytest.raises(ValueError):
+        vector_store.rollback_generation()
+
+
+def test_released_system_stays_usable_until_store_is_dropped():
+    _add(["kept"])
+    store = vector_store.get_vector_store()
+
+    vector_store.reset_vector_store(keep_namespaces=True)
+
+    # 進行中的請求持有的舊存儲仍可查詢
+    assert vector_store._retired_systems
+    assert store.similarity_search("kept", k=1)[0].page_content == "kept"
+
+    del store
+    gc.collect()
+    vector_store.get_vector_store()
+    assert not vector_store._retired_systems
+
+
+@pytest.mark.usefixtures("flat_data_dir")
+def test_idle_sweep_closes_stores_and_tracks_growth(monkeypatch):
+    _add(["first"], namespace="brand-a")
+    entry = vector_store._open_stores["brand-a"]
+    assert entry["bytes"] == 0
+
+    # 開啟後寫入的文檔也計入記憶體預算
+    _add(["second", "third"], namespace="brand-a")
+    assert vector_store._sweep_idle_stores()
+    assert entry["bytes"] == 3 * vector_store._bytes_per_vector()
+
+    # 沒有新的查詢時，閒置的集合仍由定期檢查關閉
+    monkeypatch.setattr(vector_store, "VECTOR_STORE_IDLE_SECONDS", 60)
+    entry["last_used"] -= 120
+    assert not vector_store._sweep_idle_stores()
+    assert "brand-a" not in vector_store._open_stores